@@ -0,0 +1,201 @@
+"""
+Load test for concurrent pipeline runs: N workbooks ingested and upserted at the same time.
+
+Every simulated run does what one state machine execution does - the lite ingestion
+into its own staging partitions, then upsert_all_data(ingestion_id) - in its own process.
+The runs' date ranges overlap, and every numeric cell of run r holds r, so afterwards
+each date must exist in all four main tables with the values of one run covering it,
+the same run in every table, and no run may have left staged rows behind.
+
+The schema is deployed into a scratch schema of the target database and dropped again.
+Each concurrency level starts from an empty schema, so the timings are comparable.
+--partitioning deploys range-partitioned main tables, whose partitions the runs create.
+
+Usage:
+    python benchmarks/concurrent_runs_load_test.py --dsn "host=localhost dbname=postgres user=postgres" --runs 8 --concurrency 1 8
+"""
+import argparse
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import psycopg2
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "glue"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "lambda"))
+import deploy_schema  # noqa: E402
+import table_registry  # noqa: E402
+from lite_engine import run_lite_ingestion  # noqa: E402
+
+LOAD_TEST_SCHEMA = "concurrent_runs_load_test"
+START_DATE = datetime(2020, 1, 1)
+
+
+def connect(dsn):
+    return psycopg2.connect(dsn, options=f"-c search_path={LOAD_TEST_SCHEMA}")
+
+
+def excel_headers():
+    headers = []
+    for table in table_registry.TABLES:
+        for _, _, excel_header in table["columns"]:
+            if excel_header not in headers:
+                headers.append(excel_header)
+    return headers
+
+
+def build_workbook(run_number, first_day, rows):
+    """
+    An export covering rows days from first_day, every numeric cell holding the run number
+    """
+    headers = excel_headers()
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append([f"Load test run {run_number}"])
+    sheet.append(["Datum"] + headers)
+    for day in range(first_day, first_day + rows):
+        sheet.append([START_DATE + timedelta(days=day)] + [run_number] * len(headers))
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def reset_schema(dsn, partitioning):
+    connection = connect(dsn)
+    try:
+        with connection, connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {LOAD_TEST_SCHEMA} CASCADE")
+            cursor.execute(f"CREATE SCHEMA {LOAD_TEST_SCHEMA}")
+            cursor.execute(deploy_schema.get_embedded_schema(partitioning=partitioning))
+    finally:
+        connection.close()
+
+
+def drop_schema(dsn):
+    connection = connect(dsn)
+    try:
+        with connection, connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {LOAD_TEST_SCHEMA} CASCADE")
+    finally:
+        connection.close()
+
+
+def run_pipeline(dsn, run_number, workbook_bytes):
+    """
+    One simulated execution: stage the workbook into the run's partitions, then upsert them
+    """
+    ingestion_id = f"load-test-run-{run_number}"
+    connection = connect(dsn)
+    try:
+        start = time.perf_counter()
+        metrics = run_lite_ingestion(connection, io.BytesIO(workbook_bytes), source_file=f"run-{run_number}.xlsx",
+                                     ingestion_id=ingestion_id)
+        staged_seconds = time.perf_counter() - start
+
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT upsert_all_data(%s)", (ingestion_id,))
+            counts = cursor.fetchone()[0]
+        return {
+            "run_number": run_number,
+            "ingestion_id": ingestion_id,
+            "staged_rows": metrics["tables"],
+            "counts": counts,
+            "staged_seconds": staged_seconds,
+            "seconds": time.perf_counter() - start
+        }
+    finally:
+        connection.close()
+
+
+def verify(dsn, runs, coverage):
+    """
+    Check that no staged row was lost; returns a list of problems
+    """
+    problems = []
+    connection = connect(dsn)
+    try:
+        with connection, connection.cursor() as cursor:
+            run_per_table = {}
+            for table in table_registry.TABLES:
+                table_name = table["table_name"]
+                value_column = table_registry.value_columns(table)[0]
+                cursor.execute(f"SELECT {table_registry.KEY_COLUMN}, {value_column} FROM {table_name}")
+                run_per_table[table_name] = {day: int(value) for day, value in cursor.fetchall()}
+                if len(run_per_table[table_name]) != len(coverage):
+                    problems.append(f"{table_name} has {len(run_per_table[table_name])} dates, "
+                                    f"{len(coverage)} were staged")
+
+                inserted = sum(run["counts"][table_name]["inserted"] for run in runs)
+                if inserted != len(coverage):
+                    problems.append(f"{table_name}: runs report {inserted} inserts for {len(coverage)} dates")
+                for run in runs:
+                    table_counts = run["counts"][table_name]
+                    upserted = table_counts["inserted"] + table_counts["updated"] + table_counts["unchanged"]
+                    if upserted != run["staged_rows"][table_name]:
+                        problems.append(f"{run['ingestion_id']} staged {run['staged_rows'][table_name]} "
+                                        f"{table_name} rows but upserted {upserted}")
+
+                cursor.execute(f"SELECT count(*) FROM {table_registry.staging_table_name(table)}")
+                left_over = cursor.fetchone()[0]
+                if left_over:
+                    problems.append(f"{left_over} rows left in {table_registry.staging_table_name(table)}")
+
+            for day, covering_runs in coverage.items():
+                winners = {table_name: rows.get(day.date()) for table_name, rows in run_per_table.items()}
+                if len(set(winners.values())) != 1 or next(iter(winners.values())) not in covering_runs:
+                    problems.append(f"{day.date()}: rows come from runs {winners}, staged by {sorted(covering_runs)}")
+    finally:
+        connection.close()
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=os.environ.get("BENCHMARK_DSN", "host=localhost dbname=postgres user=postgres"))
+    parser.add_argument("--runs", type=int, default=8, help="Simulated executions per concurrency level")
+    parser.add_argument("--rows", type=int, default=2000, help="Days per workbook")
+    parser.add_argument("--overlap", type=float, default=0.5, help="Share of a run's days also staged by the next run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--partitioning", choices=table_registry.PARTITIONINGS, default=table_registry.PARTITIONING_NONE)
+    args = parser.parse_args()
+
+    step = max(1, int(args.rows * (1 - args.overlap)))
+    workbooks, coverage = {}, {}
+    for run_number in range(1, args.runs + 1):
+        first_day = (run_number - 1) * step
+        workbooks[run_number] = build_workbook(run_number, first_day, args.rows)
+        for day in range(first_day, first_day + args.rows):
+            coverage.setdefault(START_DATE + timedelta(days=day), set()).add(run_number)
+
+    print(f"📊 {args.runs} runs of {args.rows} days ({args.overlap:.0%} overlap, {len(coverage)} distinct days)")
+    failed = False
+    try:
+        for concurrency in args.concurrency:
+            reset_schema(args.dsn, args.partitioning)
+            start = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=concurrency) as executor:
+                futures = [executor.submit(run_pipeline, args.dsn, run_number, workbook_bytes)
+                           for run_number, workbook_bytes in workbooks.items()]
+                runs = [future.result() for future in futures]
+            wall_seconds = time.perf_counter() - start
+
+            problems = verify(args.dsn, runs, coverage)
+            failed = failed or bool(problems)
+            slowest = max(run["seconds"] for run in runs)
+            print(f"  concurrency {concurrency:>3}  {wall_seconds:8.2f}s wall  "
+                  f"{args.runs / wall_seconds:6.2f} runs/s  {args.runs * args.rows / wall_seconds:10,.0f} rows/s  "
+                  f"(slowest run {slowest:.2f}s)  {'✅ no data lost' if not problems else '❌ ' + str(len(problems)) + ' problems'}")
+            for problem in problems[:20]:
+                print(f"    ❌ {problem}")
+    finally:
+        drop_schema(args.dsn)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
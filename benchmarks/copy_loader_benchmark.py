@@ -0,0 +1,101 @@
+"""
+Benchmark the COPY staging loader against the batched-INSERT path used by Glue's JDBC writer.
+
+Glue's JDBC writer sends parameterized INSERTs in batches of 1000 rows; that is reproduced
+here with psycopg2.extras.execute_batch so both paths run against the same local Postgres.
+
+Usage:
+    python benchmarks/copy_loader_benchmark.py --dsn "host=localhost dbname=postgres user=postgres" --rows 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import psycopg2
+from psycopg2.extras import execute_batch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "glue"))
+import copy_loader  # noqa: E402
+
+# Same shape as drying_staging, the widest staging table
+BENCHMARK_TABLE = "copy_benchmark_staging"
+COLUMNS = [("date", "date")] + [(f"int_{i}", "int") for i in range(1, 15)] + [("avg_drying_load", "double")] + [(f"int_{i}", "int") for i in range(15, 17)]
+SQL_TYPES = {"int": "INTEGER", "double": "REAL", "date": "DATE"}
+JDBC_BATCH_SIZE = 1000
+
+
+def generate_rows(row_count):
+    start = date(2000, 1, 1)
+    rows = []
+    for i in range(row_count):
+        row = []
+        for _, data_type in COLUMNS:
+            if data_type == "date":
+                row.append(start + timedelta(days=i))
+            elif random.random() < 0.05:
+                row.append(None)
+            elif data_type == "int":
+                row.append(random.randint(0, 5000))
+            else:
+                row.append(random.random() * 100)
+        rows.append(tuple(row))
+    return rows
+
+
+def reset_table(connection):
+    with connection, connection.cursor() as cursor:
+        column_ddl = ", ".join(f"{name} {SQL_TYPES[data_type]}" for name, data_type in COLUMNS)
+        cursor.execute(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE}")
+        cursor.execute(f"CREATE TABLE {BENCHMARK_TABLE} ({column_ddl})")
+
+
+def load_batched_insert(connection, rows):
+    column_names = [name for name, _ in COLUMNS]
+    insert_sql = f"INSERT INTO {BENCHMARK_TABLE} ({', '.join(column_names)}) VALUES ({', '.join(['%s'] * len(column_names))})"
+    with connection, connection.cursor() as cursor:
+        execute_batch(cursor, insert_sql, rows, page_size=JDBC_BATCH_SIZE)
+
+
+def load_copy(connection, rows, copy_format):
+    with connection:
+        copy_loader.copy_rows(connection, BENCHMARK_TABLE, [name for name, _ in COLUMNS],
+                              [data_type for _, data_type in COLUMNS], rows, copy_format)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=os.environ.get("BENCHMARK_DSN", "host=localhost dbname=postgres user=postgres"))
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = generate_rows(args.rows)
+    connection = psycopg2.connect(args.dsn)
+    loaders = {
+        "jdbc-style batched INSERT": load_batched_insert,
+        "COPY csv": lambda conn, data: load_copy(conn, data, copy_loader.COPY_FORMAT_CSV),
+        "COPY binary": lambda conn, data: load_copy(conn, data, copy_loader.COPY_FORMAT_BINARY),
+    }
+
+    print(f"📊 Loading {args.rows} rows x {len(COLUMNS)} columns, best of {args.repeat}")
+    try:
+        for name, loader in loaders.items():
+            best = None
+            for _ in range(args.repeat):
+                reset_table(connection)
+                start = time.perf_counter()
+                loader(connection, rows)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"  {name:<28} {best:8.3f}s  {args.rows / best:12,.0f} rows/s")
+    finally:
+        with connection, connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE}")
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark the generated upsert functions: INSERT ... ON CONFLICT against MERGE ... RETURNING.
+
+Both engines are generated from table_registry.py for the drying table (the widest one)
+in a scratch schema. For every size the main table is seeded with N rows, then N rows
+are staged: half of them existing dates (every other one with changed values), half new
+dates, plus 1% duplicates - so each run inserts N/2, updates N/4 and skips N/4 rows.
+Staged rows carry ascending source rows like an ingested workbook.
+The merge engine needs Postgres 17 and is skipped on older servers.
+
+Usage:
+    python benchmarks/upsert_engine_benchmark.py --dsn "host=localhost dbname=postgres user=postgres" --rows 10000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "glue"))
+import copy_loader  # noqa: E402
+import table_registry  # noqa: E402
+
+BENCHMARK_SCHEMA = "upsert_benchmark"
+# Same columns as drying, without the foreign key to overview
+TABLE = dict(next(table for table in table_registry.TABLES if table["table_name"] == "drying"), parent=None)
+COLUMNS = [table_registry.KEY_COLUMN] + table_registry.value_columns(TABLE)
+COLUMN_TYPES = ["date"] + [data_type for _, data_type, _ in TABLE["columns"]]
+STAGING_COLUMNS = COLUMNS + [table_registry.SOURCE_ROW_COLUMN]
+STAGING_COLUMN_TYPES = COLUMN_TYPES + [table_registry.STAGING_SOURCE_COLUMNS[table_registry.SOURCE_ROW_COLUMN]]
+ENGINES = [table_registry.UPSERT_ENGINE_ON_CONFLICT, table_registry.UPSERT_ENGINE_MERGE]
+MERGE_MIN_SERVER_VERSION = 170000
+START_DATE = date(1900, 1, 1)
+
+
+def generate_rows(first_day, count, variant=0):
+    for day in range(first_day, first_day + count):
+        row = [START_DATE + timedelta(days=day)]
+        for position, data_type in enumerate(COLUMN_TYPES[1:], start=1):
+            value = (day * position + variant) % 5000
+            row.append(value / 7 if data_type == "double" else value)
+        yield tuple(row)
+
+
+def staged_rows(row_count):
+    """
+    N rows starting at N/2: existing dates (every other one changed) followed by new dates, plus 1% duplicates,
+    each with its source row
+    """
+    first_day = row_count // 2
+    source_row = 0
+    for offset, row in enumerate(generate_rows(first_day, row_count)):
+        existing = first_day + offset < row_count
+        if existing and offset % 2 == 0:
+            row = next(generate_rows(first_day + offset, 1, variant=1))
+        source_row += 1
+        yield row + (source_row,)
+        if offset % 100 == 0:
+            source_row += 1
+            yield row + (source_row,)
+
+
+def reset_schema(connection, engine):
+    with connection, connection.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE")
+        cursor.execute(f"CREATE SCHEMA {BENCHMARK_SCHEMA}")
+        cursor.execute(f"SET search_path TO {BENCHMARK_SCHEMA}")
+        # The main table DDL converts existing tables through these functions, and the
+        # upsert queues the dates it changed for the reporting tables
+        cursor.execute(table_registry.partitioning_functions_sql([TABLE]))
+        cursor.execute(table_registry.reporting_tables_ddl([TABLE]))
+        cursor.execute(table_registry.main_table_ddl(TABLE))
+        cursor.execute(table_registry.staging_table_ddl(TABLE))
+        cursor.execute(table_registry.upsert_function_sql(TABLE, engine))
+
+
+def run_engine(connection, engine, row_count):
+    reset_schema(connection, engine)
+    with connection:
+        copy_loader.copy_rows(connection, TABLE["table_name"], COLUMNS, COLUMN_TYPES,
+                              generate_rows(0, row_count), copy_loader.COPY_FORMAT_BINARY)
+        copy_loader.copy_rows(connection, table_registry.staging_table_name(TABLE), STAGING_COLUMNS,
+                              STAGING_COLUMN_TYPES, staged_rows(row_count), copy_loader.COPY_FORMAT_BINARY)
+
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(f"VACUUM ANALYZE {TABLE['table_name']}, {table_registry.staging_table_name(TABLE)}")
+    connection.autocommit = False
+
+    with connection, connection.cursor() as cursor:
+        start = time.perf_counter()
+        cursor.execute(f"SELECT inserted, updated, unchanged FROM {table_registry.upsert_function_name(TABLE)}()")
+        counts = cursor.fetchone()
+        elapsed = time.perf_counter() - start
+    return elapsed, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=os.environ.get("BENCHMARK_DSN", "host=localhost dbname=postgres user=postgres"))
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(args.dsn)
+    engines = ENGINES
+    if connection.server_version < MERGE_MIN_SERVER_VERSION:
+        print(f"⚠️ Server version {connection.server_version} has no MERGE ... RETURNING, skipping the merge engine")
+        engines = [engine for engine in ENGINES if engine != table_registry.UPSERT_ENGINE_MERGE]
+
+    print(f"📊 Upserting {len(COLUMNS)}-column rows, best of {args.repeat}")
+    try:
+        for row_count in args.rows:
+            for engine in engines:
+                best, counts = None, None
+                for _ in range(args.repeat):
+                    elapsed, counts = run_engine(connection, engine, row_count)
+                    best = elapsed if best is None else min(best, elapsed)
+                inserted, updated, unchanged = counts
+                print(f"  {row_count:>9,} rows  {engine:<12} {best:8.3f}s  {row_count / best:12,.0f} rows/s  "
+                      f"({inserted} inserted, {updated} updated, {unchanged} unchanged)")
+    finally:
+        with connection, connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE")
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,232 +1,180 @@
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from awsglue.transforms import *
 from awsglue.utils import getResolvedOptions
-from pyspark import SparkContext
+from pyspark import SparkContext, StorageLevel
 from awsglue.context import GlueContext
 from awsglue.job import Job
 from awsglue import DynamicFrame
-import pandas as pd
+import fsspec
 from pyspark.sql.types import *
 from pyspark.sql.functions import col as F_col, lit, to_date, when, regexp_replace, regexp_extract, split, expr, concat_ws, lpad, concat
 from awsglue.dynamicframe import DynamicFrame
 from pyspark.sql import functions as SqlFuncs
-from urllib.parse import unquote
+from urllib.parse import unquote, urlparse
+# Shared with the lite ingestion engine, shipped via --extra-py-files
+from table_registry import (SOURCE_FILE_COLUMN, SOURCE_ROW_COLUMN, INGESTION_ID_COLUMN, SHARED_INGESTION_ID,
+                            staging_column_types)
+from workbook import (target_schemas, read_excel_frame, iter_excel_chunks, typed_source_columns, build_typed_frame,
+                      merge_ingestion_metrics)
 
-# Get job arguments
-args = getResolvedOptions(sys.argv, ['JOB_NAME', 's3_input_path'])
+# Reader modes for the Excel workbook
+READER_MODE_FULL = "full"
+READER_MODE_STREAMING = "streaming"
+DEFAULT_CHUNK_ROWS = 10000
 
-# Initialize Glue context and job
-sc = SparkContext()
-glueContext = GlueContext(sc)
-spark = glueContext.spark_session
-job = Job(glueContext)
-job.init(args['JOB_NAME'], args)
+# How the normalized wide frame is materialized before the table fan-out
+MATERIALIZE_MODE_CACHE = "cache"
+MATERIALIZE_MODE_CHECKPOINT = "checkpoint"
+MATERIALIZE_MODE_NONE = "none"
 
-print(f"🚀 Starting Glue job...")
+# Staging write modes
+WRITE_MODE_SEQUENTIAL = "sequential"
+WRITE_MODE_PARALLEL = "parallel"
+DEFAULT_WRITE_PARALLELISM = 4
 
-# Handle URL encoding in S3 path
-s3_input_path = args['s3_input_path']
-# Decode any URL-encoded characters in the path
-s3_input_path_decoded = unquote(s3_input_path)
-print(f"📄 Original S3 path: {s3_input_path}")
-print(f"📄 Decoded S3 path: {s3_input_path_decoded}")
+# Staging loaders: Glue's JDBC writer or COPY ... FROM STDIN through psycopg2
+STAGING_LOADER_JDBC = "jdbc"
+STAGING_LOADER_COPY = "copy"
 
-# Read Excel file directly from S3 using pandas (works in Glue!)
-excel_df = pd.read_excel(s3_input_path_decoded, header=1)
-print(f"✅ Excel file loaded: {excel_df.shape[0]} rows, {excel_df.shape[1]} columns")
+# Ingestion modes for the pandas-to-Spark handoff
+INGESTION_MODE_TYPED = "typed"
+INGESTION_MODE_STRING = "string"
 
-# Drop duplicates at pandas level
-excel_df = excel_df.drop_duplicates()
-print(f"✅ Duplicates dropped: {excel_df.shape[0]} rows remaining")
+SPARK_TYPES = {
+    "int": IntegerType(),
+    "double": DoubleType(),
+    "date": DateType(),
+    "string": StringType()
+}
 
-# Create schema with proper data types (start with StringType for flexibility)
-excel_schema = StructType([StructField(column_name, StringType(), True) for column_name in excel_df.columns])
 
-# Convert to Spark DataFrame
-spark_df = spark.createDataFrame(excel_df, schema=excel_schema)
-print("✅ Converted to Spark DataFrame")
+def get_optional_arg(name, default):
+    """
+    Resolve an optional job argument, falling back to a default when it is not passed
+    """
+    if f"--{name}" in sys.argv:
+        return getResolvedOptions(sys.argv, [name])[name]
+    return default
+
+
+def to_spark_frame(excel_df):
+    """
+    Convert a pandas workbook frame to Spark, keeping every column as a string,
+    plus its worksheet row (the frame index)
+    """
+    excel_df = excel_df.assign(**{SOURCE_ROW_COLUMN: excel_df.index})
+    # Create schema with proper data types (start with StringType for flexibility)
+    excel_schema = StructType([StructField(column_name, StringType(), True) for column_name in excel_df.columns])
+    return spark.createDataFrame(excel_df, schema=excel_schema)
 
-# Process date column - handle datetime objects and strings from Excel
-try:
-    # Handle different date formats:
-    # 1. For datetime objects (converted to Java Calendar strings by Spark)
-    # 2. For string values like "Werte aus KW1 2024"
-    
-    # Extract date from Java Calendar format (for datetime objects)
-    spark_df = spark_df.withColumn("java_year", 
-        regexp_extract(F_col("Datum"), r"YEAR=(\d{4})", 1))
-    spark_df = spark_df.withColumn("java_month", 
-        regexp_extract(F_col("Datum"), r"MONTH=(\d+)", 1))
-    spark_df = spark_df.withColumn("java_day", 
-        regexp_extract(F_col("Datum"), r"DAY_OF_MONTH=(\d+)", 1))
-    
-    # Create date from Java Calendar parts (month is 0-based in Java Calendar, so add 1)
-    spark_df = spark_df.withColumn("java_month_adj", 
-        when(F_col("java_month") != "", F_col("java_month").cast("int") + 1).otherwise(None))
-    
-    spark_df = spark_df.withColumn("date_string", 
-        when((F_col("java_year") != "") & (F_col("java_month") != "") & (F_col("java_day") != ""),
-             concat(F_col("java_year"), lit("-"), 
-                   lpad(F_col("java_month_adj").cast("string"), 2, "0"), lit("-"),
-                   lpad(F_col("java_day"), 2, "0"))
-        ).otherwise(None))
-    
-    spark_df = spark_df.withColumn("date_from_java", 
-        to_date(F_col("date_string"), "yyyy-MM-dd"))
-    
-    # Try to parse as regular date strings (MM/dd/yyyy format)
-    spark_df = spark_df.withColumn("date_from_string", 
-        to_date(F_col("Datum"), "MM/dd/yyyy"))
-    
-    # Use the first successful date parsing
-    spark_df = spark_df.withColumn("date", 
-        when(F_col("date_from_java").isNotNull(), F_col("date_from_java"))
-        .when(F_col("date_from_string").isNotNull(), F_col("date_from_string"))
-        .otherwise(None))
-    
-    # Clean up temporary columns
-    spark_df = spark_df.drop("java_year", "java_month", "java_day", "java_month_adj", "date_string", "date_from_java", "date_from_string")
-    
-    print("✅ Date column processed with datetime and string handling")
-    
-    # Count valid dates
-    valid_date_count = spark_df.filter(F_col("date").isNotNull()).count()
-    total_count = spark_df.count()
-    print(f"📊 Valid dates: {valid_date_count}/{total_count}")
-    
-except Exception as e:
-    print(f"❌ Error processing date column: {e}")
-    print("⚠️ Continuing without date filtering...")
-    # If date parsing fails completely, create a dummy date column and continue
-    spark_df = spark_df.withColumn("date", lit(None).cast("date"))
-
-# Define target table schemas matching the database
-target_schemas = [
-    {
-        "table_name": "overview",
-        "schema": {
-            "date": "date",
-            "tonage": "int", 
-            "water_m3": "double",
-            "liters_per_kg": "double",
-            "electricity_per_kg": "double", 
-            "gas_per_kg": "double",
-            "gas_plus_elec_per_kg": "double",
-            "hours_production": "double",
-            "kg_per_hour": "double"
-        },
-        "column_mapping": {
-            "date": "date",
-            "tonage": "Gesamt \nTonage",
-            "water_m3": "Wasserverbrauch in m³",
-            "liters_per_kg": "Liter/kg gesamt", 
-            "electricity_per_kg": "Stom / Kg Wäsche",
-            "gas_per_kg": "Gas / Kg\nWäsche",
-            "gas_plus_elec_per_kg": "Gas+ Stom / Kg Wäsche",
-            "hours_production": "Stunden\nProduktion",
-            "kg_per_hour": "KG / \nStunde Produktion"
-        }
-    },
-    {
-        "table_name": "fleet", 
-        "schema": {
-            "date": "date",
-            "driving_hours": "double",
-            "kg_per_hour_driving": "double", 
-            "km_driven": "int"
-        },
-        "column_mapping": {
-            "date": "date",
-            "driving_hours": "Stunden\nFuhrpark / Verlader",
-            "kg_per_hour_driving": "KG / Stunde\n Fuhrpark / Verlader",
-            "km_driven": "Gefahrene Km"
-        }
-    },
-    {
-        "table_name": "washing_machines",
-        "schema": {
-            "date": "date",
-            "machine_130kg": "int",
-            "steps_130kg": "int", 
-            "machine_85kg_plus_85kg": "int",
-            "machine_85kg_middle": "int",
-            "steps_85kg_middle": "int",
-            "machine_85kg_right": "int", 
-            "steps_85kg_right": "int",
-            "electrolux": "int",
-            "avg_load_130kg": "double",
-            "avg_load_85kg_middle": "double",
-            "avg_load_85kg_right": "double"
-        },
-        "column_mapping": {
-            "date": "date", 
-            "machine_130kg": "130 KG",
-            "steps_130kg": "130 KG\nTakte",
-            "machine_85kg_plus_85kg": "85 KG + 85 KG\n ",
-            "machine_85kg_middle": "85 KG\nmitte", 
-            "steps_85kg_middle": "85 KG mitte\nTakte",
-            "machine_85kg_right": "85 kg \nrechts",
-            "steps_85kg_right": "85 KG rechts\nTakte",
-            "electrolux": "Electrolux",
-            "avg_load_130kg": "Ø Beladung 130",
-            "avg_load_85kg_middle": "Ø Beladung 85\nmitte", 
-            "avg_load_85kg_right": "Ø Beladung 85\nrechts"
-        }
-    },
-    {
-        "table_name": "drying",
-        "schema": {
-            "date": "date",
-            "roboter_1": "int",
-            "roboter_2": "int",
-            "roboter_3": "int", 
-            "roboter_4": "int",
-            "terry_prep_1": "int",
-            "terry_prep_2": "int",
-            "terry_prep_3": "int",
-            "terry_prep_4": "int",
-            "blankets_1": "int",
-            "blankets_2": "int", 
-            "sum_drying_load": "int",
-            "steps_total": "int",
-            "kipper": "int",
-            "avg_drying_load": "double",
-            "sum_drying": "int",
-            "steps": "int"
-        },
-        "column_mapping": {
-            "date": "date",
-            "roboter_1": "Roboter 1",
-            "roboter_2": "Roboter 2", 
-            "roboter_3": "Roboter 3 ",
-            "roboter_4": "Roboter 4",
-            "terry_prep_1": "Frottelege 1 ",
-            "terry_prep_2": "Frottelege 2",
-            "terry_prep_3": "Frottelege 3",
-            "terry_prep_4": "Frottelege 4 ",
-            "blankets_1": "Decken 1",
-            "blankets_2": "Decken 2",
-            "sum_drying_load": "Summe Frottee", 
-            "steps_total": "Takte",
-            "kipper": "Kipper",
-            "avg_drying_load": "Ø Beladung\n Trockner",
-            "sum_drying": "Trockner",
-            "steps": "Takte"
-        }
-    }
-]
-print("✅ Table schemas defined")
 
-# Process each table
-for schema_obj in target_schemas:
+def to_typed_spark_frame(excel_df):
+    """
+    Convert a pandas workbook frame to a typed Spark DataFrame through Arrow record batches.
+
+    Only the columns referenced by target_schemas are kept, already cast to their target
+    types, and the 'date' column is parsed in pandas - no string round trip in Spark.
+    """
+    typed_df = build_typed_frame(excel_df)
+    fields = [StructField("date", DateType(), True)]
+    for excel_col, data_type in typed_source_columns().items():
+        if excel_col in typed_df.columns:
+            fields.append(StructField(excel_col, SPARK_TYPES[data_type], True))
+    fields.append(StructField(SOURCE_ROW_COLUMN, IntegerType(), True))
+
+    return spark.createDataFrame(typed_df, schema=StructType(fields))
+
+
+def parse_date_column(spark_df):
+    """
+    Derive the 'date' column from 'Datum' - handle datetime objects and strings from Excel
+    """
+    try:
+        # Handle different date formats:
+        # 1. For datetime objects (converted to Java Calendar strings by Spark)
+        # 2. For string values like "Werte aus KW1 2024"
+        
+        # Extract date from Java Calendar format (for datetime objects)
+        spark_df = spark_df.withColumn("java_year", 
+            regexp_extract(F_col("Datum"), r"YEAR=(\d{4})", 1))
+        spark_df = spark_df.withColumn("java_month", 
+            regexp_extract(F_col("Datum"), r"MONTH=(\d+)", 1))
+        spark_df = spark_df.withColumn("java_day", 
+            regexp_extract(F_col("Datum"), r"DAY_OF_MONTH=(\d+)", 1))
+        
+        # Create date from Java Calendar parts (month is 0-based in Java Calendar, so add 1)
+        spark_df = spark_df.withColumn("java_month_adj", 
+            when(F_col("java_month") != "", F_col("java_month").cast("int") + 1).otherwise(None))
+        
+        spark_df = spark_df.withColumn("date_string", 
+            when((F_col("java_year") != "") & (F_col("java_month") != "") & (F_col("java_day") != ""),
+                 concat(F_col("java_year"), lit("-"), 
+                       lpad(F_col("java_month_adj").cast("string"), 2, "0"), lit("-"),
+                       lpad(F_col("java_day"), 2, "0"))
+            ).otherwise(None))
+        
+        spark_df = spark_df.withColumn("date_from_java", 
+            to_date(F_col("date_string"), "yyyy-MM-dd"))
+        
+        # Try to parse as regular date strings (MM/dd/yyyy format)
+        spark_df = spark_df.withColumn("date_from_string", 
+            to_date(F_col("Datum"), "MM/dd/yyyy"))
+        
+        # Use the first successful date parsing
+        spark_df = spark_df.withColumn("date", 
+            when(F_col("date_from_java").isNotNull(), F_col("date_from_java"))
+            .when(F_col("date_from_string").isNotNull(), F_col("date_from_string"))
+            .otherwise(None))
+        
+        # Clean up temporary columns
+        spark_df = spark_df.drop("java_year", "java_month", "java_day", "java_month_adj", "date_string", "date_from_java", "date_from_string")
+        
+        print("✅ Date column processed with datetime and string handling")
+        
+    except Exception as e:
+        print(f"❌ Error processing date column: {e}")
+        print("⚠️ Continuing without date filtering...")
+        # If date parsing fails completely, create a dummy date column and continue
+        spark_df = spark_df.withColumn("date", lit(None).cast("date"))
+
+    return spark_df
+
+
+def normalize_wide_frame(spark_df):
+    """
+    Keep only 'date', the Excel columns that target_schemas reads and the source row
+    """
+    source_columns = ["date"] + [column for column in typed_source_columns() if column in spark_df.columns]
+    return spark_df.select(*[F_col(column) for column in source_columns],
+                           F_col(SOURCE_ROW_COLUMN).cast(IntegerType()).alias(SOURCE_ROW_COLUMN))
+
+
+def materialize_frame(spark_df, mode):
+    """
+    Materialize the normalized wide frame once so every table projection reads from it.
+
+    'cache' persists it (filled by the first action, the metrics pass), 'checkpoint' computes
+    it eagerly and truncates the lineage back to the pandas source.
+    """
+    if mode == MATERIALIZE_MODE_CACHE:
+        print("💾 Caching normalized workbook frame")
+        return spark_df.persist(StorageLevel.MEMORY_AND_DISK)
+    if mode == MATERIALIZE_MODE_CHECKPOINT:
+        print("💾 Checkpointing normalized workbook frame")
+        return spark_df.localCheckpoint(eager=True)
+    return spark_df
+
+
+def map_table_columns(spark_df, schema_obj):
+    """
+    Build the mapped and cast column expressions for one target table
+    """
     table_name = schema_obj["table_name"]
-    staging_table_name = f"{table_name}_staging"
     schema = schema_obj["schema"] 
     column_mapping = schema_obj["column_mapping"]
-    
-    print(f"📊 Processing table: {staging_table_name}")
-    
-    # Map and cast columns for this table
+
     selected_cols = []
     found_columns = 0
     for db_col, data_type in schema.items():
@@ -259,24 +207,126 @@ for schema_obj in target_schemas:
         selected_cols.append(col_expr)
     
     print(f"📊 Column mapping for {table_name}: {found_columns}/{len(schema)} columns found")
-    
+    return selected_cols
+
+
+def project_table(spark_df, selected_cols, source_file, ingestion_id):
+    """
+    Select one target table from the workbook frame, dropping invalid dates and duplicates.
+
+    Every staged row carries the source file and worksheet row it came from, so the upsert
+    can resolve conflicting rows for the same date by keeping the last one, and the
+    ingestion id that routes it to this run's staging partition.
+    """
     # Create DataFrame for this table
-    df_table = spark_df.select(*selected_cols)
+    df_table = spark_df.select(*selected_cols, F_col(SOURCE_ROW_COLUMN))
     
     # Filter out rows with null dates (but be more lenient)
-    initial_count = df_table.count()
     df_table = df_table.filter(F_col("date").isNotNull())
-    filtered_count = df_table.count()
-    print(f"  📊 Rows after date filtering: {filtered_count}/{initial_count} (removed {initial_count - filtered_count} rows with invalid dates)")
-    
-    # Drop duplicates for this table
-    df_table = df_table.dropDuplicates()
     
+    # Drop duplicates for this table, keeping the last source row of identical rows
+    data_columns = [column for column in df_table.columns if column != SOURCE_ROW_COLUMN]
+    df_table = df_table.groupBy(*data_columns).agg(SqlFuncs.max(SOURCE_ROW_COLUMN).alias(SOURCE_ROW_COLUMN))
+    return df_table.select(*data_columns, lit(source_file).cast(StringType()).alias(SOURCE_FILE_COLUMN),
+                           F_col(SOURCE_ROW_COLUMN), lit(ingestion_id).alias(INGESTION_ID_COLUMN))
+
+
+def collect_ingestion_metrics(spark_df, table_columns):
+    """
+    Gather valid dates, filtered-out rows and rows to write for every table in one Spark job.
+
+    The per-table count is the number of distinct projected rows with a valid date, which is
+    exactly what project_table hands to the staging write.
+    """
+    valid_date = F_col("date").isNotNull()
+    aggregations = [
+        SqlFuncs.count(lit(1)).alias("total_rows"),
+        SqlFuncs.count(when(valid_date, lit(1))).alias("valid_dates")
+    ]
+    for table_name, selected_cols in table_columns.items():
+        aggregations.append(
+            SqlFuncs.count_distinct(when(valid_date, SqlFuncs.struct(*selected_cols))).alias(table_name)
+        )
+
+    row = spark_df.agg(*aggregations).collect()[0]
+    metrics = {
+        "total_rows": row["total_rows"],
+        "valid_dates": row["valid_dates"],
+        "filtered_out": row["total_rows"] - row["valid_dates"],
+        "tables": {table_name: row[table_name] for table_name in table_columns}
+    }
+
+    print(f"📊 Valid dates: {metrics['valid_dates']}/{metrics['total_rows']} (removed {metrics['filtered_out']} rows with invalid dates)")
+    for table_name, rows_to_write in metrics["tables"].items():
+        print(f"  📊 {table_name}: {rows_to_write} distinct rows to write")
+    return metrics
+
+
+def database_connection_params():
+    """
+    psycopg2 connection parameters of the Glue database connection
+    """
+    # Only needed (with psycopg2) for the COPY loader and run-scoped staging
+    import copy_loader
+
+    connection_params = copy_loader.connection_params_from_jdbc(glueContext.extract_jdbc_conf("glue-db-connection"))
+    connection_params["database"] = "ring_textilservice_data"
+    return connection_params
+
+
+def prepare_staging_partitions(run_ingestion_id):
+    """
+    Create this run's unlogged staging partitions before anything is written
+    """
+    import copy_loader
+    import psycopg2
+
+    print(f"🧱 Preparing staging partitions for ingestion {run_ingestion_id}")
+    connection = psycopg2.connect(**database_connection_params())
+    try:
+        copy_loader.prepare_run_staging(connection, run_ingestion_id)
+    finally:
+        connection.close()
+
+
+def copy_staging_table(df_table, table_name, row_count):
+    """
+    Stream a projected table into its staging table with COPY, one transaction per partition
+    """
+    import copy_loader
+
+    staging_table_name = f"{table_name}_staging"
+    schema = {schema_obj["table_name"]: schema_obj["schema"] for schema_obj in target_schemas}[table_name]
+    schema = staging_column_types(schema)
+    columns = df_table.columns
+    column_types = [schema[column] for column in columns]
+
+    connection_params = database_connection_params()
+    load_format = copy_format
+
+    print(f"🔄 Copying {row_count} rows to staging table {staging_table_name} ({load_format} COPY)...")
+    df_table.foreachPartition(
+        lambda rows: copy_loader.copy_partition(rows, connection_params, staging_table_name, columns, column_types, load_format)
+    )
+    print(f"✅ {table_name} written to database successfully")
+
+
+def write_staging_table(df_table, table_name, row_count):
+    """
+    Append a projected table to its staging table with the configured --staging_loader:
+    COPY over psycopg2 (copy_staging_table) or the Glue JDBC connection (the default)
+    """
+    if staging_loader == STAGING_LOADER_COPY:
+        copy_staging_table(df_table, table_name, row_count)
+        return
+
+    staging_table_name = f"{table_name}_staging"
+
     # Convert Spark DataFrame to Glue DynamicFrame for JDBC operations
     dynamic_frame = DynamicFrame.fromDF(df_table, glueContext, f"{staging_table_name}_frame")
 
     # Write to staging table
-    print(f"🔄 Writing {df_table.count()} rows to staging table {staging_table_name}...")
+    print(f"🔄 Writing {row_count} rows to staging table {staging_table_name}...")
     
     glueContext.write_dynamic_frame.from_jdbc_conf(
         frame=dynamic_frame,
@@ -289,6 +339,157 @@ for schema_obj in target_schemas:
     )
     print(f"✅ {table_name} written to database successfully")
 
+
+def timed_staging_write(df_table, table_name, row_count):
+    """
+    Write one staging table and return how long it took in seconds
+    """
+    write_start = time.perf_counter()
+    write_staging_table(df_table, table_name, row_count)
+    return time.perf_counter() - write_start
+
+
+def write_staging_tables(table_frames, metrics, mode, parallelism):
+    """
+    Write every projected table to staging, one after another or as concurrent Spark jobs.
+
+    In parallel mode the writes are submitted from a bounded thread pool; every write is
+    awaited and any failure fails the whole run. Prints a per-table timing report.
+    """
+    timings = {}
+    wall_start = time.perf_counter()
+
+    if mode == WRITE_MODE_PARALLEL:
+        print(f"⚡ Writing {len(table_frames)} staging tables concurrently ({parallelism} threads)")
+        failures = {}
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+            futures = {
+                executor.submit(timed_staging_write, df_table, table_name, metrics["tables"][table_name]): table_name
+                for table_name, df_table in table_frames.items()
+            }
+            for future in as_completed(futures):
+                table_name = futures[future]
+                try:
+                    timings[table_name] = future.result()
+                except Exception as e:
+                    print(f"❌ Writing {table_name} failed: {e}")
+                    failures[table_name] = e
+        if failures:
+            first_failure = next(iter(failures.values()))
+            raise RuntimeError(f"Staging writes failed for: {', '.join(failures)}") from first_failure
+    else:
+        for table_name, df_table in table_frames.items():
+            timings[table_name] = timed_staging_write(df_table, table_name, metrics["tables"][table_name])
+
+    wall_seconds = time.perf_counter() - wall_start
+    print(f"⏱️ Staging write timings ({mode} mode):")
+    for table_name, seconds in timings.items():
+        print(f"  ⏱️ {table_name}: {seconds:.2f}s")
+    print(f"  ⏱️ Wall clock {wall_seconds:.2f}s vs {sum(timings.values()):.2f}s summed per-table time")
+    return timings
+
+
+def process_workbook_frame(excel_df):
+    """
+    Run one pandas workbook frame through date parsing, projection and the staging writes
+    """
+    # Drop duplicates at pandas level
+    excel_df = excel_df.drop_duplicates(keep="last")
+    print(f"✅ Duplicates dropped: {excel_df.shape[0]} rows remaining")
+
+    # Convert to Spark DataFrame
+    conversion_start = time.perf_counter()
+    if ingestion_mode == INGESTION_MODE_TYPED:
+        spark_df = to_typed_spark_frame(excel_df)
+    else:
+        spark_df = to_spark_frame(excel_df)
+    conversion_seconds = time.perf_counter() - conversion_start
+    print(f"✅ Converted to Spark DataFrame ({ingestion_mode} mode) in {conversion_seconds:.2f}s")
+
+    if ingestion_mode != INGESTION_MODE_TYPED:
+        spark_df = parse_date_column(spark_df)
+
+    # Materialization stage: conversion and date parsing run once for all four tables
+    spark_df = materialize_frame(normalize_wide_frame(spark_df), materialize_mode)
+
+    table_columns = {}
+    for schema_obj in target_schemas:
+        table_columns[schema_obj["table_name"]] = map_table_columns(spark_df, schema_obj)
+
+    # One aggregated pass instead of repeated count() actions per table
+    metrics = collect_ingestion_metrics(spark_df, table_columns)
+
+    # Process each table
+    table_frames = {}
+    for table_name, selected_cols in table_columns.items():
+        print(f"📊 Processing table: {table_name}_staging")
+        table_frames[table_name] = project_table(spark_df, selected_cols, source_file, ingestion_id)
+
+    write_staging_tables(table_frames, metrics, write_mode, write_parallelism)
+
+    spark_df.unpersist()
+    return metrics
+
+
+# Get job arguments
+args = getResolvedOptions(sys.argv, ['JOB_NAME', 's3_input_path'])
+reader_mode = get_optional_arg('reader_mode', READER_MODE_FULL)
+chunk_rows = int(get_optional_arg('chunk_rows', DEFAULT_CHUNK_ROWS))
+ingestion_mode = get_optional_arg('ingestion_mode', INGESTION_MODE_TYPED)
+materialize_mode = get_optional_arg('materialize_mode', MATERIALIZE_MODE_CACHE)
+write_mode = get_optional_arg('write_mode', WRITE_MODE_SEQUENTIAL)
+write_parallelism = int(get_optional_arg('write_parallelism', DEFAULT_WRITE_PARALLELISM))
+staging_loader = get_optional_arg('staging_loader', STAGING_LOADER_JDBC)
+copy_format = get_optional_arg('copy_format', "csv")
+ingestion_id = get_optional_arg('ingestion_id', SHARED_INGESTION_ID)
+
+# Initialize Glue context and job
+sc = SparkContext()
+glueContext = GlueContext(sc)
+spark = glueContext.spark_session
+job = Job(glueContext)
+job.init(args['JOB_NAME'], args)
+
+if ingestion_mode == INGESTION_MODE_TYPED:
+    # Move pandas frames into Spark as Arrow record batches instead of pickled rows
+    spark.conf.set("spark.sql.execution.arrow.pyspark.enabled", "true")
+
+print(f"🚀 Starting Glue job...")
+
+# Handle URL encoding in S3 path
+s3_input_path = args['s3_input_path']
+# Decode any URL-encoded characters in the path
+s3_input_path_decoded = unquote(s3_input_path)
+print(f"📄 Original S3 path: {s3_input_path}")
+print(f"📄 Decoded S3 path: {s3_input_path_decoded}")
+# Recorded with every staged row next to its worksheet row
+source_file = urlparse(s3_input_path_decoded).path.lstrip('/')
+
+if ingestion_id != SHARED_INGESTION_ID:
+    # A retried run gets its partitions emptied, so nothing is staged twice
+    prepare_staging_partitions(ingestion_id)
+
+if reader_mode == READER_MODE_STREAMING:
+    # Walk the workbook in fixed-size chunks so driver memory stays constant
+    print(f"📖 Streaming Excel file in chunks of {chunk_rows} rows")
+    chunk_count = 0
+    ingestion_metrics = None
+    with fsspec.open(s3_input_path_decoded, "rb") as excel_file:
+        for excel_chunk in iter_excel_chunks(excel_file, chunk_rows):
+            chunk_count += 1
+            print(f"✅ Excel chunk {chunk_count} loaded: {excel_chunk.shape[0]} rows, {excel_chunk.shape[1]} columns")
+            ingestion_metrics = merge_ingestion_metrics(ingestion_metrics, process_workbook_frame(excel_chunk))
+    print(f"✅ Streamed {chunk_count} chunks")
+else:
+    # Read Excel file directly from S3 using pandas (works in Glue!)
+    excel_df = read_excel_frame(s3_input_path_decoded)
+    print(f"✅ Excel file loaded: {excel_df.shape[0]} rows, {excel_df.shape[1]} columns")
+    ingestion_metrics = process_workbook_frame(excel_df)
+
+if ingestion_metrics:
+    print(f"📊 Ingestion summary: {ingestion_metrics['valid_dates']}/{ingestion_metrics['total_rows']} valid dates, "
+          f"{ingestion_metrics['filtered_out']} rows filtered out, rows written per table: {ingestion_metrics['tables']}")
+
 print("🎉 All staging tables populated successfully!")
 
 # Note: The upserts from staging to main tables will be handled by Lambda
@@ -0,0 +1,112 @@
+"""
+Spark-free "lite" ingestion engine for small workbooks.
+
+Runs the same pipeline as glue_job.py's typed path - Datum parsing, target_schemas
+mapping, casting, date filtering and dedup - in pandas and loads the staging tables
+with COPY, so small uploads skip Spark startup, DynamicFrames and JDBC writes.
+
+Usage:
+    python src/glue/lite_engine.py workbook.xlsx --dsn "host=localhost dbname=ring_textilservice_data user=postgres"
+"""
+import argparse
+import json
+import time
+
+import psycopg2
+
+from copy_loader import COPY_FORMAT_BINARY, COPY_FORMAT_CSV, copy_rows, prepare_run_staging
+from table_registry import INGESTION_ID_COLUMN, SHARED_INGESTION_ID, staging_column_types
+from workbook import (target_schemas, read_excel_frame, iter_excel_chunks, build_typed_frame, project_table_frame,
+                      merge_ingestion_metrics)
+
+
+def frame_rows(table_df):
+    """
+    Iterate a projected table as tuples with None for missing values
+    """
+    return table_df.astype(object).where(table_df.notna(), None).itertuples(index=False, name=None)
+
+
+def process_workbook_frame(connection, excel_df, copy_format, source_file=None, ingestion_id=SHARED_INGESTION_ID):
+    """
+    Run one pandas workbook frame through parsing, projection and the staging COPY
+    """
+    # Drop duplicates at pandas level
+    excel_df = excel_df.drop_duplicates(keep="last")
+    typed_df = build_typed_frame(excel_df)
+
+    valid_dates = int(typed_df["date"].notna().sum())
+    metrics = {
+        "total_rows": len(typed_df),
+        "valid_dates": valid_dates,
+        "filtered_out": len(typed_df) - valid_dates,
+        "tables": {}
+    }
+
+    for schema_obj in target_schemas:
+        table_name = schema_obj["table_name"]
+        schema = staging_column_types(schema_obj["schema"])
+        table_df = project_table_frame(typed_df, schema_obj, source_file)
+        table_df = table_df.assign(**{INGESTION_ID_COLUMN: ingestion_id})
+
+        columns = list(schema)
+        copy_rows(connection, f"{table_name}_staging", columns, [schema[column] for column in columns],
+                  frame_rows(table_df), copy_format)
+        metrics["tables"][table_name] = len(table_df)
+
+    return metrics
+
+
+def run_lite_ingestion(connection, excel_source, chunk_rows=None, copy_format=COPY_FORMAT_CSV, source_file=None,
+                       ingestion_id=SHARED_INGESTION_ID):
+    """
+    Load one workbook (path or binary file object) into the staging tables and return ingestion metrics.
+
+    All four staging tables are loaded in a single transaction, so a failed run leaves
+    nothing behind. With chunk_rows the workbook is streamed in chunks of that many rows.
+    source_file (e.g. the S3 key) is stored with every staged row next to its worksheet row.
+    With an ingestion_id the rows go to that run's own staging partitions.
+    """
+    start = time.perf_counter()
+    metrics = None
+
+    if ingestion_id != SHARED_INGESTION_ID:
+        # Committed on its own: the partitions' ATTACH lock is not held during the load
+        prepare_run_staging(connection, ingestion_id)
+
+    with connection:
+        if chunk_rows:
+            for excel_chunk in iter_excel_chunks(excel_source, chunk_rows):
+                chunk_metrics = process_workbook_frame(connection, excel_chunk, copy_format, source_file,
+                                                       ingestion_id)
+                metrics = merge_ingestion_metrics(metrics, chunk_metrics)
+        else:
+            excel_df = read_excel_frame(excel_source)
+            metrics = process_workbook_frame(connection, excel_df, copy_format, source_file, ingestion_id)
+
+    metrics = metrics or {"total_rows": 0, "valid_dates": 0, "filtered_out": 0, "tables": {}}
+    metrics["seconds"] = round(time.perf_counter() - start, 3)
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("workbook", help="Path of the Excel export to ingest")
+    parser.add_argument("--dsn", required=True, help="libpq connection string of the target database")
+    parser.add_argument("--chunk-rows", type=int, default=None, help="Stream the workbook in chunks of this many rows")
+    parser.add_argument("--copy-format", choices=[COPY_FORMAT_CSV, COPY_FORMAT_BINARY], default=COPY_FORMAT_CSV)
+    parser.add_argument("--ingestion-id", default=SHARED_INGESTION_ID,
+                        help="Stage into this run's own partitions instead of the shared one")
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(args.dsn)
+    try:
+        metrics = run_lite_ingestion(connection, args.workbook, args.chunk_rows, args.copy_format,
+                                     source_file=args.workbook, ingestion_id=args.ingestion_id)
+    finally:
+        connection.close()
+    print(json.dumps(metrics, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1087 @@
+"""
+Declarative registry of the tables loaded from the Excel export.
+
+Every column is declared once - database name, type and the Excel header it is read
+from - and everything that used to be copied by hand is generated from it: the
+target_schemas mapping used by the Glue job and the lite engine, the main and staging
+table DDL and the upsert_*_data() functions deployed by deploy_schema.py.
+
+To add a column, append it to its table's "columns". Deploying the schema adds it to
+the existing main and staging tables and regenerates the upsert functions. Pure Python
+on purpose, so the schema and upsert Lambdas can import it without pandas or Spark.
+"""
+
+# Every table is keyed by the production day
+KEY_COLUMN = "date"
+
+SQL_TYPES = {"date": "DATE", "int": "INTEGER", "double": "REAL", "string": "TEXT"}
+
+# Staging-only columns recording where each row came from: the uploaded object key and
+# the 1-based worksheet row. The upserts keep the last row of a date (last write wins).
+SOURCE_FILE_COLUMN = "source_file"
+SOURCE_ROW_COLUMN = "source_row"
+STAGING_SOURCE_COLUMNS = {SOURCE_FILE_COLUMN: "string", SOURCE_ROW_COLUMN: "int"}
+# Filled in by the database when a row is staged. A file's first staged row orders it
+# against the other files staged for a date, so the file loaded last wins.
+STAGED_AT_COLUMN = "staged_at"
+
+# Staging tables are list-partitioned by ingestion id. A pipeline run stages into its own
+# unlogged partition (no WAL, dropped when the run finishes, invisible to other runs);
+# rows staged without an id (manual runs) land in the logged 'shared' partition.
+INGESTION_ID_COLUMN = "ingestion_id"
+SHARED_INGESTION_ID = "shared"
+
+# Statements the generated upsert functions can be built on
+UPSERT_ENGINE_ON_CONFLICT = "on_conflict"
+UPSERT_ENGINE_MERGE = "merge"  # needs Postgres 17 (MERGE ... RETURNING)
+
+# Main tables are plain tables or range-partitioned by date, one partition per year or
+# month. Deploying converts existing tables; the upsert functions create the partitions.
+PARTITIONING_NONE = "none"
+PARTITIONING_YEAR = "year"
+PARTITIONING_MONTH = "month"
+PARTITIONINGS = (PARTITIONING_NONE, PARTITIONING_YEAR, PARTITIONING_MONTH)
+
+# detach_date_partitions() gives up after waiting this long for a main table's lock
+# instead of queueing every query behind its ACCESS EXCLUSIVE request
+PARTITION_DETACH_LOCK_TIMEOUT = "5s"
+
+# Orphan dates listed per table when staged child rows reference missing parent dates
+ORPHAN_DATES_REPORTED = 50
+
+# Foreign keys a load has held dropped for longer than the 15 minute Lambda limit are
+# restored even if its database session still looks alive
+REFERENCE_KEY_DROP_MAX_MINUTES = 15
+
+# Tables in load order: a table's parent must come before it
+TABLES = [
+    {
+        "table_name": "overview",
+        "description": "production metrics",
+        "parent": None,
+        # (column, type, Excel header)
+        "columns": [
+            ("tonage", "int", "Gesamt \nTonage"),
+            ("water_m3", "double", "Wasserverbrauch in m³"),
+            ("liters_per_kg", "double", "Liter/kg gesamt"),
+            ("electricity_per_kg", "double", "Stom / Kg Wäsche"),
+            ("gas_per_kg", "double", "Gas / Kg\nWäsche"),
+            ("gas_plus_elec_per_kg", "double", "Gas+ Stom / Kg Wäsche"),
+            ("hours_production", "double", "Stunden\nProduktion"),
+            ("kg_per_hour", "double", "KG / \nStunde Produktion")
+        ]
+    },
+    {
+        "table_name": "fleet",
+        "description": "vehicle and transport metrics",
+        "parent": "overview",
+        "columns": [
+            ("driving_hours", "double", "Stunden\nFuhrpark / Verlader"),
+            ("kg_per_hour_driving", "double", "KG / Stunde\n Fuhrpark / Verlader"),
+            ("km_driven", "int", "Gefahrene Km")
+        ]
+    },
+    {
+        "table_name": "washing_machines",
+        "description": "equipment performance",
+        "parent": "overview",
+        "columns": [
+            ("machine_130kg", "int", "130 KG"),
+            ("steps_130kg", "int", "130 KG\nTakte"),
+            ("machine_85kg_plus_85kg", "int", "85 KG + 85 KG\n "),
+            ("machine_85kg_middle", "int", "85 KG\nmitte"),
+            ("steps_85kg_middle", "int", "85 KG mitte\nTakte"),
+            ("machine_85kg_right", "int", "85 kg \nrechts"),
+            ("steps_85kg_right", "int", "85 KG rechts\nTakte"),
+            ("electrolux", "int", "Electrolux"),
+            ("avg_load_130kg", "double", "Ø Beladung 130"),
+            ("avg_load_85kg_middle", "double", "Ø Beladung 85\nmitte"),
+            ("avg_load_85kg_right", "double", "Ø Beladung 85\nrechts")
+        ]
+    },
+    {
+        "table_name": "drying",
+        "description": "drying equipment and processes",
+        "parent": "overview",
+        "columns": [
+            ("roboter_1", "int", "Roboter 1"),
+            ("roboter_2", "int", "Roboter 2"),
+            ("roboter_3", "int", "Roboter 3 "),
+            ("roboter_4", "int", "Roboter 4"),
+            ("terry_prep_1", "int", "Frottelege 1 "),
+            ("terry_prep_2", "int", "Frottelege 2"),
+            ("terry_prep_3", "int", "Frottelege 3"),
+            ("terry_prep_4", "int", "Frottelege 4 "),
+            ("blankets_1", "int", "Decken 1"),
+            ("blankets_2", "int", "Decken 2"),
+            ("sum_drying_load", "int", "Summe Frottee"),
+            ("steps_total", "int", "Takte"),
+            ("kipper", "int", "Kipper"),
+            ("avg_drying_load", "double", "Ø Beladung\n Trockner"),
+            ("sum_drying", "int", "Trockner"),
+            ("steps", "int", "Takte")
+        ]
+    }
+]
+
+# Reporting tables derived from the main tables and kept in sync by the upsert path:
+# upserting a source table queues the dates it inserted or updated, and
+# refresh_reporting_tables() recomputes only what depends on those dates
+REPORTING_QUEUE_TABLE = "reporting_refresh_queue"
+
+# KPI rollups of overview by ISO week, month and year: (table, period, label format)
+ROLLUP_SOURCE_TABLE = "overview"
+ROLLUP_PERIODS = [
+    ("kpi_weekly", "week", 'IYYY-"W"IW'),
+    ("kpi_monthly", "month", "YYYY-MM"),
+    ("kpi_yearly", "year", "YYYY")
+]
+# (column, SQL type, aggregate over the period's overview rows). Rates are weighted by
+# what they are per, so a period's rate is its total over its total.
+ROLLUP_MEASURES = [
+    ("production_days", "INTEGER", "count(*)"),
+    ("tonnage", "BIGINT", "sum(tonage)"),
+    ("water_m3", "DOUBLE PRECISION", "sum(water_m3::DOUBLE PRECISION)"),
+    ("hours_production", "DOUBLE PRECISION", "sum(hours_production::DOUBLE PRECISION)"),
+    ("kg_per_hour", "DOUBLE PRECISION",
+     "sum(kg_per_hour::DOUBLE PRECISION * hours_production)"
+     " / nullif(sum(hours_production) FILTER (WHERE kg_per_hour IS NOT NULL), 0)"),
+    ("liters_per_kg", "DOUBLE PRECISION",
+     "sum(liters_per_kg::DOUBLE PRECISION * tonage)"
+     " / nullif(sum(tonage) FILTER (WHERE liters_per_kg IS NOT NULL), 0)"),
+    ("gas_plus_elec_per_kg", "DOUBLE PRECISION",
+     "sum(gas_plus_elec_per_kg::DOUBLE PRECISION * tonage)"
+     " / nullif(sum(tonage) FILTER (WHERE gas_plus_elec_per_kg IS NOT NULL), 0)")
+]
+
+# One row per date with the columns of all main tables, so dashboards read the four
+# tables without joining them. Column names must be unique across the tables.
+DAILY_REPORT_TABLE = "daily_report"
+
+
+def value_columns(table):
+    """
+    Names of a table's non-key columns, in declaration order
+    """
+    return [name for name, _, _ in table["columns"]]
+
+
+def staging_column_types(schema):
+    """
+    Column name -> type of the rows written to a staging table, for a target_schemas schema
+    """
+    return {**schema, **STAGING_SOURCE_COLUMNS, INGESTION_ID_COLUMN: "string"}
+
+
+def staging_table_name(table):
+    return f"{table['table_name']}_staging"
+
+
+def upsert_lock_name(table):
+    """
+    Advisory lock (hashed) held while a run writes a main table
+    """
+    return f"upsert:{table['table_name']}"
+
+
+def upsert_function_name(table):
+    return f"upsert_{table['table_name']}_data"
+
+
+def foreign_key_name(table):
+    """
+    Name of a child table's date foreign key to its parent
+    """
+    return f"fk_{table['table_name']}_{KEY_COLUMN}"
+
+
+def foreign_key_ddl(table):
+    return f"FOREIGN KEY ({KEY_COLUMN}) REFERENCES {table['parent']} ({KEY_COLUMN})"
+
+
+def reporting_source_tables():
+    """
+    Main tables whose upserts queue their changed dates for the reporting tables: all of
+    them, as the daily report holds every table's columns
+    """
+    return {table["table_name"] for table in TABLES}
+
+
+def target_schema(table):
+    """
+    The target_schemas entry (table_name, schema, column_mapping) the ingestion engines consume
+    """
+    schema = {KEY_COLUMN: "date"}
+    column_mapping = {KEY_COLUMN: "date"}
+    for name, data_type, excel_column in table["columns"]:
+        schema[name] = data_type
+        column_mapping[name] = excel_column
+    return {
+        "table_name": table["table_name"],
+        "schema": schema,
+        "column_mapping": column_mapping
+    }
+
+
+# Define target table schemas matching the database
+target_schemas = [target_schema(table) for table in TABLES]
+
+
+def wrap_list(items, indent, width=88):
+    """
+    Join SQL list items with ', ', wrapping lines at width and indenting continuation lines
+    """
+    lines = []
+    line = ""
+    for item in items:
+        candidate = f"{line}, {item}" if line else item
+        if line and indent + len(candidate) > width:
+            lines.append(line + ",")
+            line = item
+        else:
+            line = candidate
+    lines.append(line)
+    return ("\n" + " " * indent).join(lines)
+
+
+def column_definitions(table):
+    return [f"{name} {SQL_TYPES[data_type]}" for name, data_type, _ in table["columns"]]
+
+
+def main_table_ddl(table, partitioning=PARTITIONING_NONE):
+    """
+    CREATE TABLE for a main table (date primary key, foreign key to its parent), plus
+    ADD COLUMN IF NOT EXISTS so columns added to the registry reach existing tables.
+
+    A table whose layout differs from partitioning is stashed, recreated and refilled
+    (see partitioning_functions_sql), and foreign keys dropped on the way are added back.
+    """
+    if partitioning not in PARTITIONINGS:
+        raise ValueError(f"Unknown partitioning '{partitioning}', expected one of {', '.join(PARTITIONINGS)}")
+    table_name = table["table_name"]
+    definitions = [f"{KEY_COLUMN} DATE PRIMARY KEY"] + column_definitions(table)
+    if table["parent"]:
+        definitions.append(f"CONSTRAINT {foreign_key_name(table)} {foreign_key_ddl(table)}")
+    body = ",\n    ".join(definitions)
+    partition_by = f" PARTITION BY RANGE ({KEY_COLUMN})" if partitioning != PARTITIONING_NONE else ""
+    ddl = (
+        f"-- {table_name.replace('_', ' ').capitalize()} table: {table['description']}\n"
+        f"SELECT stash_main_table('{table_name}', '{partitioning}');\n"
+        f"CREATE TABLE IF NOT EXISTS {table_name} (\n    {body}\n){partition_by};\n"
+        f"{add_missing_columns_ddl(table_name, column_definitions(table))}"
+        f"SELECT restore_main_table('{table_name}', '{partitioning}');\n"
+    )
+    if table["parent"]:
+        ddl += (
+            f"DO $$\n"
+            f"BEGIN\n"
+            f"    IF NOT EXISTS (SELECT 1 FROM pg_constraint\n"
+            f"                   WHERE conrelid = '{table_name}'::regclass AND conname = '{foreign_key_name(table)}') THEN\n"
+            f"        ALTER TABLE {table_name} ADD CONSTRAINT {foreign_key_name(table)} {foreign_key_ddl(table)};\n"
+            f"    END IF;\n"
+            f"END $$;\n"
+        )
+    return ddl
+
+
+def partitioning_functions_sql(tables):
+    """
+    Helpers for range-partitioned main tables, deployed before the main tables:
+
+    - create_date_partitions(table, partitioning, from, to) creates the missing yearly or
+      monthly partitions covering a date range. Each is created standalone and attached,
+      which only takes a SHARE UPDATE EXCLUSIVE lock on the main table. Callers pass one
+      period at a time for the distinct periods their rows fall in, so an outlier date
+      adds one partition rather than every period up to it.
+    - stash_main_table() / restore_main_table() convert a table whose layout differs from
+      the configured one: its rows are copied to a temporary table, it is dropped (with
+      the foreign keys referencing it) and refilled once recreated.
+    - detach_date_partitions(before) detaches every partition ending on or before a date,
+      child tables first. Detaching is a catalog change, the rows are not touched; the
+      detached tables are left as standalone archives. Their dates are queued and the
+      reporting tables refreshed, which removes them from the reports as well.
+
+      It uses the blocking DETACH PARTITION, which locks the main table ACCESS EXCLUSIVE
+      until the function's transaction ends. DETACH ... CONCURRENTLY cannot run inside a
+      function or transaction block, and this one has to be a single transaction: it
+      holds the upsert locks so no load writes to a partition being detached, and the
+      reports drop the archived dates in the same commit. The lock is only held for the
+      catalog changes and the report refresh of an occasional archiving run, and the
+      detach waits at most PARTITION_DETACH_LOCK_TIMEOUT for it (after the upsert locks),
+      so long dashboard queries make it fail rather than stall every query queued behind it.
+    """
+    detach_order = ", ".join(f"'{table['table_name']}'" for table in reversed(tables))
+    # Child rows only exist for dates of their parents, so the parents' dates cover them
+    root_tables = ", ".join(f"'{table['table_name']}'" for table in tables if not table["parent"])
+    locks = "\n".join(
+        f"    PERFORM pg_advisory_xact_lock(hashtext('{upsert_lock_name(table)}'));" for table in tables
+    )
+
+    return f"""CREATE OR REPLACE FUNCTION date_partition_bounds(p_partition REGCLASS, OUT lower_bound DATE, OUT upper_bound DATE)
+AS $$
+    SELECT bounds[1]::DATE, bounds[2]::DATE
+    FROM pg_class, regexp_match(pg_get_expr(relpartbound, oid), $re$FROM \\('([^']+)'\\) TO \\('([^']+)'\\)$re$) AS bounds
+    WHERE oid = p_partition;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION create_date_partitions(p_table TEXT, p_partitioning TEXT, p_from DATE, p_to DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    period_start DATE := date_trunc(p_partitioning, p_from);
+    period_end DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE period_start <= p_to LOOP
+        period_end := period_start + ('1 ' || p_partitioning)::INTERVAL;
+        partition_name := p_table || '_'
+            || to_char(period_start, CASE p_partitioning WHEN '{PARTITIONING_YEAR}' THEN 'YYYY' ELSE 'YYYY_MM' END);
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE %I)', partition_name, p_table);
+            EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           p_table, partition_name, period_start, period_end);
+            created := created + 1;
+        END IF;
+        period_start := period_end;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- NULL when the table does not exist
+CREATE OR REPLACE FUNCTION main_table_layout_matches(p_table TEXT, p_partitioning TEXT)
+RETURNS BOOLEAN AS $$
+    SELECT CASE
+        WHEN relkind = 'r' THEN p_partitioning = '{PARTITIONING_NONE}'
+        WHEN p_partitioning = '{PARTITIONING_NONE}' THEN false
+        ELSE NOT EXISTS (
+            SELECT 1 FROM pg_inherits, date_partition_bounds(inhrelid) AS bounds
+            WHERE inhparent = pg_class.oid
+              AND bounds.lower_bound + ('1 ' || p_partitioning)::INTERVAL <> bounds.upper_bound
+        )
+    END
+    FROM pg_class
+    WHERE oid = to_regclass(p_table);
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION stash_main_table(p_table TEXT, p_partitioning TEXT)
+RETURNS VOID AS $$
+DECLARE
+    foreign_key RECORD;
+BEGIN
+    IF main_table_layout_matches(p_table, p_partitioning) IS NOT false THEN
+        RETURN;
+    END IF;
+    RAISE NOTICE 'Converting % to partitioning %', p_table, p_partitioning;
+
+    EXECUTE format('CREATE TEMP TABLE %I ON COMMIT DROP AS TABLE %I', p_table || '_stash', p_table);
+    -- Child tables get their foreign keys back once this table is refilled
+    FOR foreign_key IN
+        SELECT conrelid::regclass AS child_table, conname FROM pg_constraint
+        WHERE confrelid = p_table::regclass AND contype = 'f' AND conparentid = 0
+    LOOP
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', foreign_key.child_table, foreign_key.conname);
+    END LOOP;
+    EXECUTE format('DROP TABLE %I', p_table);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION restore_main_table(p_table TEXT, p_partitioning TEXT)
+RETURNS VOID AS $$
+DECLARE
+    stash REGCLASS := to_regclass('pg_temp.' || quote_ident(p_table || '_stash'));
+    columns TEXT;
+BEGIN
+    IF stash IS NULL THEN
+        RETURN;
+    END IF;
+
+    IF p_partitioning <> '{PARTITIONING_NONE}' THEN
+        EXECUTE format('SELECT count(create_date_partitions(%L, %L, period, period)) '
+                       'FROM (SELECT DISTINCT date_trunc(%L, {KEY_COLUMN})::DATE AS period FROM %s) AS periods',
+                       p_table, p_partitioning, p_partitioning, stash);
+    END IF;
+    -- Columns in both, by name: the recreated table has the registry's column order
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO columns
+    FROM pg_attribute
+    WHERE attrelid = stash AND attnum > 0 AND NOT attisdropped
+      AND attname IN (SELECT attname FROM pg_attribute WHERE attrelid = p_table::regclass AND NOT attisdropped);
+    EXECUTE format('INSERT INTO %I (%s) SELECT %s FROM %s', p_table, columns, columns, stash);
+    EXECUTE format('DROP TABLE %s', stash);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION detach_date_partitions(p_before DATE)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    main_table TEXT;
+    partition RECORD;
+    foreign_key TEXT;
+    previous_lock_timeout TEXT := current_setting('lock_timeout');
+BEGIN
+{locks}
+    PERFORM set_config('lock_timeout', '{PARTITION_DETACH_LOCK_TIMEOUT}', true);
+
+    -- Child tables first, their rows reference overview's partitions
+    FOREACH main_table IN ARRAY ARRAY[{detach_order}] LOOP
+        FOR partition IN
+            SELECT inhrelid::regclass AS name FROM pg_inherits, date_partition_bounds(inhrelid) AS bounds
+            WHERE inhparent = to_regclass(main_table) AND bounds.upper_bound <= p_before
+            ORDER BY bounds.lower_bound
+        LOOP
+            IF main_table = ANY(ARRAY[{root_tables}]) THEN
+                EXECUTE format('INSERT INTO {REPORTING_QUEUE_TABLE} ({KEY_COLUMN}) SELECT {KEY_COLUMN} FROM %s ON CONFLICT DO NOTHING',
+                               partition.name);
+            END IF;
+            EXECUTE format('ALTER TABLE %I DETACH PARTITION %s', main_table, partition.name);
+            -- A detached partition keeps its own copy of the foreign key, which would tie
+            -- the archive to overview's remaining partitions
+            FOR foreign_key IN
+                SELECT conname FROM pg_constraint WHERE conrelid = partition.name AND contype = 'f'
+            LOOP
+                EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', partition.name, foreign_key);
+            END LOOP;
+            RETURN NEXT partition.name::TEXT;
+        END LOOP;
+    END LOOP;
+    PERFORM set_config('lock_timeout', previous_lock_timeout, true);
+
+    PERFORM refresh_reporting_tables();
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def staging_table_ddl(table):
+    """
+    CREATE TABLE for a staging table: the main table's columns without any constraints,
+    plus the source columns, list-partitioned by ingestion id with the shared partition.
+
+    Staging tables from before the partitioning are plain tables; they only ever hold
+    rows in flight, so they are dropped and recreated.
+    """
+    staging_table = staging_table_name(table)
+    definitions = column_definitions(table) + [
+        f"{name} {SQL_TYPES[data_type]}" for name, data_type in STAGING_SOURCE_COLUMNS.items()
+    ] + [f"{STAGED_AT_COLUMN} TIMESTAMPTZ NOT NULL DEFAULT now()"]
+    body = ",\n    ".join(
+        [f"{KEY_COLUMN} DATE"] + definitions
+        + [f"{INGESTION_ID_COLUMN} TEXT NOT NULL DEFAULT '{SHARED_INGESTION_ID}'"]
+    )
+    return (
+        f"-- Staging table for {table['table_name'].replace('_', ' ')} data\n"
+        f"DO $$\n"
+        f"BEGIN\n"
+        f"    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('{staging_table}')) = 'r' THEN\n"
+        f"        DROP TABLE {staging_table};\n"
+        f"    END IF;\n"
+        f"END $$;\n"
+        f"CREATE TABLE IF NOT EXISTS {staging_table} (\n    {body}\n) PARTITION BY LIST ({INGESTION_ID_COLUMN});\n"
+        f"{add_missing_columns_ddl(staging_table, definitions)}"
+        f"CREATE TABLE IF NOT EXISTS {staging_table}_{SHARED_INGESTION_ID} PARTITION OF {staging_table}\n"
+        f"    FOR VALUES IN ('{SHARED_INGESTION_ID}');\n"
+        f"-- Chunked upserts used to leave their batch index on the shared partition\n"
+        f"DROP INDEX IF EXISTS {staging_table}_{SHARED_INGESTION_ID}_date_idx;\n"
+    )
+
+
+def add_missing_columns_ddl(table_name, definitions):
+    additions = ",\n    ".join(f"ADD COLUMN IF NOT EXISTS {definition}" for definition in definitions)
+    return f"ALTER TABLE {table_name}\n    {additions};\n"
+
+
+def source_query_sql(table, indent):
+    """
+    The rows staged by one ingestion run between p_from and p_to, deduplicated per date:
+    last write wins.
+
+    DISTINCT ON keeps, of each date, the row of the file staged last (by its first staged
+    row, as one file can be written in several transactions), then the highest source_row
+    within it. Rows without a source row (or with the same file and row) fall back to the
+    remaining columns, so the same staging content always picks the same row.
+    """
+    columns = value_columns(table)
+    pad = " " * indent
+    order_by = (
+        ["file_staged_at DESC", f"{SOURCE_ROW_COLUMN} DESC NULLS LAST"]
+        + [f"{column} DESC NULLS LAST" for column in columns]
+    )
+    staged_columns = [KEY_COLUMN] + columns + [SOURCE_ROW_COLUMN]
+    return (
+        f"SELECT DISTINCT ON ({KEY_COLUMN}) {wrap_list([KEY_COLUMN] + columns, indent + 26)}\n"
+        f"{pad}FROM (\n"
+        f"{pad}    SELECT {wrap_list(staged_columns, indent + 11)},\n"
+        f"{pad}           min({STAGED_AT_COLUMN}) OVER (PARTITION BY {SOURCE_FILE_COLUMN}) AS file_staged_at\n"
+        f"{pad}    FROM {staging_table_name(table)}\n"
+        f"{pad}    WHERE {INGESTION_ID_COLUMN} = p_ingestion_id AND {KEY_COLUMN} BETWEEN p_from AND p_to\n"
+        f"{pad}) AS staged\n"
+        f"{pad}ORDER BY {KEY_COLUMN}, {wrap_list(order_by, indent + 9)}"
+    )
+
+
+def queue_changes_sql(changed_rows):
+    """
+    A CTE queueing the dates of an upsert's inserted and updated rows for the reporting tables
+    """
+    return f""",
+    queued AS (
+        INSERT INTO {REPORTING_QUEUE_TABLE} ({KEY_COLUMN})
+        SELECT {KEY_COLUMN} FROM {changed_rows}
+        ON CONFLICT DO NOTHING
+    )"""
+
+
+def on_conflict_upsert_sql(table, partitioned=False, queue_changes=False):
+    """
+    INSERT ... ON CONFLICT DO UPDATE with a change-skipping WHERE; (xmax = 0) tells inserts from updates.
+
+    System columns cannot be returned through a partitioned table, there the upserted
+    dates are looked up in the main table instead: the statement's snapshot still shows
+    it as it was before the upsert.
+    """
+    table_name = table["table_name"]
+    columns = value_columns(table)
+    all_columns = [KEY_COLUMN] + columns
+    if partitioned:
+        returning = KEY_COLUMN
+        counts = (
+            f"SELECT count(*) FILTER (WHERE existing.{KEY_COLUMN} IS NULL),\n"
+            f"           count(*) FILTER (WHERE existing.{KEY_COLUMN} IS NOT NULL),\n"
+            f"           (SELECT count(*) FROM source)\n"
+            f"    INTO inserted, updated, staged_rows\n"
+            f"    FROM upserted LEFT JOIN {table_name} AS existing USING ({KEY_COLUMN});"
+        )
+    else:
+        returning = "(xmax = 0) AS is_insert" + (f", {KEY_COLUMN}" if queue_changes else "")
+        counts = (
+            "SELECT count(*) FILTER (WHERE is_insert),\n"
+            "           count(*) FILTER (WHERE NOT is_insert),\n"
+            "           (SELECT count(*) FROM source)\n"
+            "    INTO inserted, updated, staged_rows\n"
+            "    FROM upserted;"
+        )
+
+    return f"""    WITH source AS (
+        {source_query_sql(table, 8)}
+    ),
+    upserted AS (
+        INSERT INTO {table_name} ({wrap_list(all_columns, 22 + len(table_name))})
+        SELECT {wrap_list(all_columns, 15)}
+        FROM source
+        ON CONFLICT ({KEY_COLUMN}) DO UPDATE SET
+            {wrap_list([f"{column} = EXCLUDED.{column}" for column in columns], 12, width=0)}
+        WHERE ({wrap_list([f"{table_name}.{column}" for column in columns], 15)})
+              IS DISTINCT FROM
+              ({wrap_list([f"EXCLUDED.{column}" for column in columns], 15)})
+        RETURNING {returning}
+    ){queue_changes_sql("upserted") if queue_changes else ""}
+    {counts}"""
+
+
+def merge_upsert_sql(table, partitioned=False, queue_changes=False):
+    """
+    MERGE with a WHEN MATCHED AND ... IS DISTINCT FROM guard; RETURNING merge_action()
+    (Postgres 17+) reports each row's action, unchanged rows return nothing
+    """
+    table_name = table["table_name"]
+    columns = value_columns(table)
+    all_columns = [KEY_COLUMN] + columns
+
+    return f"""    WITH source AS (
+        {source_query_sql(table, 8)}
+    ),
+    merged AS (
+        MERGE INTO {table_name} AS target
+        USING source
+        ON target.{KEY_COLUMN} = source.{KEY_COLUMN}
+        WHEN MATCHED AND ({wrap_list([f"target.{column}" for column in columns], 26)})
+                         IS DISTINCT FROM
+                         ({wrap_list([f"source.{column}" for column in columns], 26)}) THEN
+            UPDATE SET {wrap_list([f"{column} = source.{column}" for column in columns], 23, width=0)}
+        WHEN NOT MATCHED THEN
+            INSERT ({wrap_list(all_columns, 20)})
+            VALUES ({wrap_list([f"source.{column}" for column in all_columns], 20)})
+        RETURNING merge_action() AS action, source.{KEY_COLUMN}
+    ){queue_changes_sql("merged") if queue_changes else ""}
+    SELECT count(*) FILTER (WHERE action = 'INSERT'),
+           count(*) FILTER (WHERE action = 'UPDATE'),
+           (SELECT count(*) FROM source)
+    INTO inserted, updated, staged_rows
+    FROM merged;"""
+
+
+UPSERT_STATEMENTS = {
+    UPSERT_ENGINE_ON_CONFLICT: on_conflict_upsert_sql,
+    UPSERT_ENGINE_MERGE: merge_upsert_sql
+}
+
+
+def upsert_function_sql(table, engine=UPSERT_ENGINE_ON_CONFLICT, function_name=None, partitioning=PARTITIONING_NONE):
+    """
+    The upsert_<table>_data(p_ingestion_id, p_from, p_to) function moving one run's staged
+    rows into the main table - all of them, or those of one date range for a chunked upsert.
+
+    Staged rows are deduplicated per date, rows identical to the main table are skipped,
+    and inserted/updated/unchanged counts are returned. The run's staged rows are deleted
+    afterwards. engine picks the statement doing the work (see UPSERT_STATEMENTS).
+
+    Concurrent runs take turns on the main table through a transaction-scoped advisory
+    lock. upsert_all_data() takes the locks in load order, so runs cannot deadlock, and
+    each run's counts are exact against the state the previous run committed.
+
+    On a partitioned main table the partitions for the staged dates are created first,
+    the rows are then routed to them by Postgres. Upserts of reporting_source_tables()
+    queue the dates they changed for refresh_reporting_tables().
+    """
+    if engine not in UPSERT_STATEMENTS:
+        raise ValueError(f"Unknown upsert engine '{engine}', expected one of {', '.join(UPSERT_STATEMENTS)}")
+    function_name = function_name or upsert_function_name(table)
+    partitioned = partitioning != PARTITIONING_NONE
+    create_partitions = ""
+    if partitioned:
+        create_partitions = (
+            f"\n    -- Only the periods with staged rows, not every period between the first and last date\n"
+            f"    PERFORM create_date_partitions('{table['table_name']}', '{partitioning}', period, period)\n"
+            f"    FROM (SELECT DISTINCT date_trunc('{partitioning}', {KEY_COLUMN})::DATE AS period\n"
+            f"          FROM {staging_table_name(table)}\n"
+            f"          WHERE {INGESTION_ID_COLUMN} = p_ingestion_id AND {KEY_COLUMN} BETWEEN p_from AND p_to) AS periods;\n"
+        )
+
+    return f"""DROP FUNCTION IF EXISTS {function_name}(), {function_name}(TEXT);
+
+CREATE OR REPLACE FUNCTION {function_name}(
+    p_ingestion_id TEXT DEFAULT '{SHARED_INGESTION_ID}',
+    -- Infinite rather than NULL defaults keep the bounds usable as index conditions
+    p_from DATE DEFAULT '-infinity',
+    p_to DATE DEFAULT 'infinity',
+    OUT inserted INTEGER,
+    OUT updated INTEGER,
+    OUT unchanged INTEGER
+) AS $$
+DECLARE
+    staged_rows INTEGER;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('{upsert_lock_name(table)}'));
+{create_partitions}
+{UPSERT_STATEMENTS[engine](table, partitioned, table["table_name"] in reporting_source_tables())}
+
+    unchanged := staged_rows - inserted - updated;
+    -- In a run's unlogged partition this writes no WAL, and the partition is dropped
+    -- when the run finishes, dead tuples included
+    DELETE FROM {staging_table_name(table)}
+    WHERE {INGESTION_ID_COLUMN} = p_ingestion_id AND {KEY_COLUMN} BETWEEN p_from AND p_to;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def reference_check_function_sql(tables):
+    """
+    check_staged_references(p_ingestion_id, p_from, p_to): one anti-join per child table
+    for the staged dates that neither the parent table nor the run's staged parent rows
+    contain. All of them are reported in one foreign_key_violation, rather than the first
+    row a foreign key trigger trips over.
+
+    The staged parent dates are subtracted with EXCEPT (hashed or sorted): run partitions
+    are unanalyzed and unindexed, and a NOT EXISTS against them may be planned as a
+    nested loop over both. What is left is probed through the parent's primary key.
+    """
+    tables_by_name = {table["table_name"]: table for table in tables}
+    checks = []
+    for table in tables:
+        if not table["parent"]:
+            continue
+        parent = tables_by_name[table["parent"]]
+        checks.append(f"""    SELECT array_agg({KEY_COLUMN} ORDER BY {KEY_COLUMN}) INTO orphan_dates
+    FROM (
+        SELECT {KEY_COLUMN} FROM {staging_table_name(table)}
+        WHERE {INGESTION_ID_COLUMN} = p_ingestion_id AND {KEY_COLUMN} BETWEEN p_from AND p_to
+        EXCEPT
+        SELECT {KEY_COLUMN} FROM {staging_table_name(parent)}
+        WHERE {INGESTION_ID_COLUMN} = p_ingestion_id AND {KEY_COLUMN} BETWEEN p_from AND p_to
+    ) AS staged
+    WHERE NOT EXISTS (SELECT 1 FROM {parent['table_name']} WHERE {KEY_COLUMN} = staged.{KEY_COLUMN});
+    IF orphan_dates IS NOT NULL THEN
+        orphans := orphans || format('{table['table_name']}: %s dates missing from {parent['table_name']} (%s%s)',
+                                     cardinality(orphan_dates),
+                                     array_to_string(orphan_dates[1:{ORPHAN_DATES_REPORTED}], ', '),
+                                     CASE WHEN cardinality(orphan_dates) > {ORPHAN_DATES_REPORTED} THEN ', ...' ELSE '' END);
+    END IF;""")
+    checks = "\n\n".join(checks)
+
+    return f"""CREATE OR REPLACE FUNCTION check_staged_references(
+    p_ingestion_id TEXT DEFAULT '{SHARED_INGESTION_ID}',
+    p_from DATE DEFAULT '-infinity',
+    p_to DATE DEFAULT 'infinity'
+)
+RETURNS VOID AS $$
+DECLARE
+    orphan_dates DATE[];
+    orphans TEXT[] := '{{}}';
+BEGIN
+{checks}
+
+    IF cardinality(orphans) > 0 THEN
+        RAISE EXCEPTION USING
+            ERRCODE = 'foreign_key_violation',
+            MESSAGE = format('Rows staged by %s reference dates missing from their parent tables', p_ingestion_id),
+            DETAIL = array_to_string(orphans, E'\\n');
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def reference_key_functions_sql(tables, partitioning=PARTITIONING_NONE):
+    """
+    drop_reference_keys() / restore_reference_keys(): drop the child tables' foreign keys
+    for a bulk load and add the missing ones back.
+
+    They are added back NOT VALID: rows written later are checked again, and the caller
+    validates the loaded rows with one ALTER TABLE ... VALIDATE CONSTRAINT per table once
+    the load is done. Partitioned tables cannot take NOT VALID foreign keys before
+    Postgres 18, theirs are validated right away by one set-based check per table.
+    Both take every upsert lock first, like upsert_all_data(), and are idempotent, so a
+    retried or interrupted load can call them again.
+
+    A load that commits the drop on its own (the chunked mode) records its session in
+    reference_key_drop until the keys are restored. restore_abandoned_reference_keys()
+    restores them once that session is gone - the load was killed in between - or has
+    held them dropped longer than any Lambda can run.
+    """
+    children = [table for table in tables if table["parent"]]
+    locks = "\n".join(
+        f"    PERFORM pg_advisory_xact_lock(hashtext('{upsert_lock_name(table)}'));" for table in tables
+    )
+    drop_foreign_keys = "\n".join(
+        f"    ALTER TABLE {table['table_name']} DROP CONSTRAINT IF EXISTS {foreign_key_name(table)};"
+        for table in children
+    )
+    not_valid = " NOT VALID" if partitioning == PARTITIONING_NONE else ""
+    add_foreign_keys = "\n".join(
+        f"    IF NOT EXISTS (SELECT 1 FROM pg_constraint\n"
+        f"                   WHERE conrelid = '{table['table_name']}'::regclass AND conname = '{foreign_key_name(table)}') THEN\n"
+        f"        ALTER TABLE {table['table_name']} ADD CONSTRAINT {foreign_key_name(table)}\n"
+        f"            {foreign_key_ddl(table)}{not_valid};\n"
+        f"    END IF;"
+        for table in children
+    )
+
+    return f"""CREATE OR REPLACE FUNCTION drop_reference_keys()
+RETURNS VOID AS $$
+BEGIN
+{locks}
+
+{drop_foreign_keys}
+
+    INSERT INTO reference_key_drop (pid, backend_start)
+    SELECT pid, backend_start FROM pg_stat_activity WHERE pid = pg_backend_pid();
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION restore_reference_keys()
+RETURNS VOID AS $$
+BEGIN
+{locks}
+
+{add_foreign_keys}
+
+    DELETE FROM reference_key_drop;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION restore_abandoned_reference_keys()
+RETURNS BOOLEAN AS $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM reference_key_drop
+        WHERE dropped_at < now() - interval '{REFERENCE_KEY_DROP_MAX_MINUTES} minutes'
+           OR NOT EXISTS (SELECT 1 FROM pg_stat_activity AS activity
+                          WHERE activity.pid = reference_key_drop.pid
+                            AND activity.backend_start = reference_key_drop.backend_start)
+    ) THEN
+        RETURN FALSE;
+    END IF;
+
+    PERFORM restore_reference_keys();
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def upsert_all_function_sql(tables, partitioning=PARTITIONING_NONE):
+    """
+    upsert_all_data(p_ingestion_id, p_from, p_to, p_bulk_references): every table's upsert
+    in load order in a single statement, returning per-table counts as JSONB. The
+    reporting tables are refreshed for the changed dates in the same transaction.
+
+    Staged child rows are checked against their parents up front (check_staged_references).
+    With p_bulk_references the child tables' foreign keys are dropped for the upsert
+    (drop_reference_keys), so inserted rows skip the per-row lookup into the parent, and
+    restored afterwards (restore_reference_keys). Dropping a foreign key locks both tables
+    ACCESS EXCLUSIVE until the statement commits - meant for backfills. A load split into
+    several calls drops and restores the keys itself, once around all of them.
+    """
+    declarations = "\n".join(f"    {table['table_name']}_counts RECORD;" for table in tables)
+    locks = "\n".join(
+        f"    PERFORM pg_advisory_xact_lock(hashtext('{upsert_lock_name(table)}'));" for table in tables
+    )
+    calls = "\n".join(
+        f"    SELECT * INTO {table['table_name']}_counts\n"
+        f"    FROM {upsert_function_name(table)}(p_ingestion_id, p_from, p_to);"
+        for table in tables
+    )
+    notice_format = ", ".join(f"{table['table_name']}=%/%/%" for table in tables)
+    notice_args = ",\n                 ".join(
+        f"{table['table_name']}_counts.inserted, {table['table_name']}_counts.updated, "
+        f"{table['table_name']}_counts.unchanged"
+        for table in tables
+    )
+    json_pairs = ",\n        ".join(
+        f"'{table['table_name']}', to_jsonb({table['table_name']}_counts)" for table in tables
+    )
+
+    return f"""-- Earlier versions returned TEXT and took fewer arguments, which CREATE OR REPLACE
+-- cannot change in place
+DROP FUNCTION IF EXISTS upsert_all_data(), upsert_all_data(TEXT), upsert_all_data(TEXT, DATE, DATE);
+
+CREATE OR REPLACE FUNCTION upsert_all_data(
+    p_ingestion_id TEXT DEFAULT '{SHARED_INGESTION_ID}',
+    p_from DATE DEFAULT '-infinity',
+    p_to DATE DEFAULT 'infinity',
+    p_bulk_references BOOLEAN DEFAULT false
+)
+RETURNS JSONB AS $$
+DECLARE
+{declarations}
+BEGIN
+    -- Every upsert lock first, in the order the upsert functions take them and before
+    -- any table is read, so runs queue here instead of deadlocking with the table locks
+    -- of a bulk run
+{locks}
+
+    PERFORM check_staged_references(p_ingestion_id, p_from, p_to);
+
+    IF p_bulk_references THEN
+        PERFORM drop_reference_keys();
+    END IF;
+
+    -- Upsert in order: parent tables first, then child tables
+{calls}
+
+    IF p_bulk_references THEN
+        PERFORM restore_reference_keys();
+    END IF;
+
+    PERFORM refresh_reporting_tables();
+
+    RAISE NOTICE 'Upsert completed (inserted/updated/unchanged): {notice_format}',
+                 {notice_args};
+
+    RETURN jsonb_build_object(
+        {json_pairs}
+    );
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def daily_report_columns(tables):
+    """
+    (column, SQL type) of the daily report after its date, in load order
+    """
+    columns = {}
+    for table in tables:
+        for name, data_type, _ in table["columns"]:
+            if name in columns or name in (KEY_COLUMN, "refreshed_at"):
+                raise ValueError(f"Column '{name}' of {table['table_name']} is not unique in {DAILY_REPORT_TABLE}")
+            columns[name] = SQL_TYPES[data_type]
+    return list(columns.items())
+
+
+def reporting_tables_ddl(tables):
+    """
+    The refresh queue, the daily report (one row per date in overview) and the KPI rollup
+    tables (one row per period with data)
+    """
+    report_definitions = [f"{name} {sql_type}" for name, sql_type in daily_report_columns(tables)]
+    report_body = ",\n    ".join(
+        [f"{KEY_COLUMN} DATE PRIMARY KEY"] + report_definitions + ["refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()"]
+    )
+    measure_definitions = [f"{name} {sql_type}" for name, sql_type, _ in ROLLUP_MEASURES]
+    ddl = (
+        f"CREATE TABLE IF NOT EXISTS {REPORTING_QUEUE_TABLE} (\n"
+        f"    {KEY_COLUMN} DATE PRIMARY KEY\n"
+        f");\n"
+        f"\n-- Every table's columns per date\n"
+        f"CREATE TABLE IF NOT EXISTS {DAILY_REPORT_TABLE} (\n    {report_body}\n);\n"
+        f"{add_missing_columns_ddl(DAILY_REPORT_TABLE, report_definitions)}"
+    )
+    for rollup_table, period, _ in ROLLUP_PERIODS:
+        body = ",\n    ".join(
+            ["period_start DATE PRIMARY KEY", "period_end DATE NOT NULL", "period_label TEXT NOT NULL"]
+            + measure_definitions
+            + ["refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()"]
+        )
+        ddl += (
+            f"\n-- KPIs per {period}\n"
+            f"CREATE TABLE IF NOT EXISTS {rollup_table} (\n    {body}\n);\n"
+            f"{add_missing_columns_ddl(rollup_table, measure_definitions)}"
+        )
+    return ddl
+
+
+def daily_report_refresh_sql(tables):
+    """
+    Rebuild the daily report rows of changed_dates from the main tables. Dates without a
+    row in the parent table (deleted or archived) are removed.
+
+    The parent table is inner joined and its children left joined, as their foreign keys
+    allow child rows only for dates the parent has.
+    """
+    columns = [name for name, _ in daily_report_columns(tables)]
+    joins = "\n".join(
+        f"        {'LEFT JOIN' if table['parent'] else 'JOIN'} {table['table_name']} USING ({KEY_COLUMN})"
+        for table in tables
+    )
+    return f"""    WITH report AS (
+        SELECT {wrap_list([KEY_COLUMN] + columns, 15)}
+        FROM unnest(changed_dates) AS changed({KEY_COLUMN})
+{joins}
+    ),
+    emptied AS (
+        DELETE FROM {DAILY_REPORT_TABLE}
+        WHERE {KEY_COLUMN} = ANY(changed_dates)
+          AND {KEY_COLUMN} NOT IN (SELECT {KEY_COLUMN} FROM report)
+    )
+    INSERT INTO {DAILY_REPORT_TABLE} ({wrap_list([KEY_COLUMN] + columns, 18 + len(DAILY_REPORT_TABLE))})
+    SELECT {wrap_list([KEY_COLUMN] + columns, 11)}
+    FROM report
+    ON CONFLICT ({KEY_COLUMN}) DO UPDATE SET
+        {wrap_list([f"{name} = EXCLUDED.{name}" for name in columns] + ["refreshed_at = now()"], 8, width=0)}
+    WHERE ({wrap_list([f"{DAILY_REPORT_TABLE}.{name}" for name in columns], 11)})
+          IS DISTINCT FROM
+          ({wrap_list([f"EXCLUDED.{name}" for name in columns], 11)});"""
+
+
+def rollup_refresh_sql(rollup_table, period, label_format):
+    """
+    Recompute the periods of one rollup table containing changed_dates; periods left
+    without rows are deleted
+    """
+    measures = [name for name, _, _ in ROLLUP_MEASURES]
+    aggregates = ",\n               ".join(f"{expression} AS {name}" for name, _, expression in ROLLUP_MEASURES)
+    return f"""    WITH periods AS (
+        SELECT DISTINCT date_trunc('{period}', changed_date)::DATE AS period_start
+        FROM unnest(changed_dates) AS changed_date
+    ),
+    totals AS (
+        SELECT periods.period_start,
+               {aggregates}
+        FROM periods
+        JOIN {ROLLUP_SOURCE_TABLE}
+          ON {KEY_COLUMN} >= periods.period_start
+         AND {KEY_COLUMN} < (periods.period_start + INTERVAL '1 {period}')::DATE
+        GROUP BY periods.period_start
+    ),
+    emptied AS (
+        DELETE FROM {rollup_table}
+        WHERE period_start IN (SELECT period_start FROM periods)
+          AND period_start NOT IN (SELECT period_start FROM totals)
+    )
+    INSERT INTO {rollup_table} ({wrap_list(["period_start", "period_end", "period_label"] + measures, 18 + len(rollup_table))})
+    SELECT period_start, (period_start + INTERVAL '1 {period}')::DATE - 1, to_char(period_start, '{label_format}'),
+           {wrap_list(measures, 11)}
+    FROM totals
+    ON CONFLICT (period_start) DO UPDATE SET
+        {wrap_list([f"{name} = EXCLUDED.{name}" for name in measures] + ["refreshed_at = now()"], 8, width=0)}
+    WHERE ({wrap_list([f"{rollup_table}.{name}" for name in measures], 11)})
+          IS DISTINCT FROM
+          ({wrap_list([f"EXCLUDED.{name}" for name in measures], 11)});"""
+
+
+def reporting_functions_sql(tables):
+    """
+    refresh_reporting_tables(): takes the queued dates and recomputes the reporting rows
+    depending on them, returning how many dates were refreshed.
+
+    It takes the upsert locks of the tables it reads, in load order, so it sees a
+    consistent state of them and can run inside upsert_all_data() or on its own.
+    """
+    sources = reporting_source_tables()
+    locks = "\n".join(
+        f"    PERFORM pg_advisory_xact_lock(hashtext('{upsert_lock_name(table)}'));"
+        for table in tables if table["table_name"] in sources
+    )
+    refreshes = "\n\n".join(
+        [daily_report_refresh_sql(tables)]
+        + [rollup_refresh_sql(rollup_table, period, label_format) for rollup_table, period, label_format in ROLLUP_PERIODS]
+    )
+
+    return f"""CREATE OR REPLACE FUNCTION refresh_reporting_tables()
+RETURNS INTEGER AS $$
+DECLARE
+    changed_dates DATE[];
+BEGIN
+{locks}
+
+    WITH dequeued AS (
+        DELETE FROM {REPORTING_QUEUE_TABLE} RETURNING {KEY_COLUMN}
+    )
+    SELECT array_agg({KEY_COLUMN}) INTO changed_dates FROM dequeued;
+    IF changed_dates IS NULL THEN
+        RETURN 0;
+    END IF;
+
+{refreshes}
+
+    RETURN cardinality(changed_dates);
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def run_staging_functions_sql(tables):
+    """
+    run_staging_partition_name() and prepare_run_staging(p_ingestion_id), which creates a
+    run's unlogged staging partitions - or empties them when a retried run prepares again.
+
+    Partitions are created standalone and then attached: ATTACH PARTITION only takes a
+    SHARE UPDATE EXCLUSIVE lock, so other runs keep writing to their partitions meanwhile.
+    Runs are recorded in staging_run so stale partitions of failed runs can be dropped.
+    """
+    staging_tables = ", ".join(f"'{staging_table_name(table)}'" for table in tables)
+
+    return f"""CREATE OR REPLACE FUNCTION run_staging_partition_name(staging_table TEXT, ingestion_id TEXT)
+RETURNS TEXT AS $$
+    -- Execution names can be longer than an identifier, so the partition is named by a hash
+    SELECT staging_table || '_r' || left(md5(ingestion_id), 16);
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION prepare_run_staging(p_ingestion_id TEXT)
+RETURNS VOID AS $$
+DECLARE
+    staging_table TEXT;
+    partition_name TEXT;
+BEGIN
+    IF p_ingestion_id = '{SHARED_INGESTION_ID}' THEN
+        RAISE EXCEPTION 'The shared staging partition always exists';
+    END IF;
+
+    INSERT INTO staging_run (ingestion_id) VALUES (p_ingestion_id)
+    ON CONFLICT (ingestion_id) DO UPDATE SET prepared_at = now();
+
+    FOREACH staging_table IN ARRAY ARRAY[{staging_tables}] LOOP
+        partition_name := run_staging_partition_name(staging_table, p_ingestion_id);
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format('CREATE UNLOGGED TABLE %I (LIKE %I INCLUDING DEFAULTS)', partition_name, staging_table);
+            EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES IN (%L)',
+                           staging_table, partition_name, p_ingestion_id);
+        ELSE
+            EXECUTE format('TRUNCATE %I', partition_name);
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+"""
@@ -0,0 +1,203 @@
+"""
+Spark-free workbook handling shared by the Glue job and the lite ingestion engine.
+
+Holds the pandas-side reading, date parsing and casting of the target_schemas columns
+(generated from table_registry.py), so both engines produce exactly the same staging rows.
+"""
+import numbers
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+from table_registry import SOURCE_FILE_COLUMN, SOURCE_ROW_COLUMN, target_schemas
+
+# When two tables read the same Excel column with different types, keep the widest
+TYPE_PRECEDENCE = {"int": 0, "double": 1, "string": 2}
+INT32_MIN, INT32_MAX = -2**31, 2**31 - 1
+
+
+def excel_column_names(header_row):
+    """
+    Build column names the same way pd.read_excel does (unnamed and duplicate headers)
+    """
+    columns = []
+    seen = {}
+    for position, value in enumerate(header_row):
+        name = f"Unnamed: {position}" if value is None else value
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    return columns
+
+
+def read_excel_frame(excel_source, header=1):
+    """
+    Read the first worksheet in full, indexed by 1-based worksheet row like iter_excel_chunks
+    """
+    excel_df = pd.read_excel(excel_source, header=header)
+    # header rows above the column names, the column names themselves, then 1-based
+    excel_df.index = excel_df.index + header + 2
+    return excel_df
+
+
+def iter_excel_chunks(excel_file, chunk_rows, header=1):
+    """
+    Stream the first worksheet as pandas DataFrames of at most chunk_rows rows.
+
+    Uses openpyxl's read-only row iterator so the driver only holds one chunk at a time.
+    Chunks keep object dtype so 'Datum' stays a mix of datetimes and strings, as in a full read.
+    Fully empty rows are skipped; they carry no date and would be filtered out anyway.
+    Chunks are indexed by 1-based worksheet row, the source row of the staged data.
+    """
+    workbook = load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        for _ in range(header):
+            next(rows, None)
+        columns = excel_column_names(next(rows, ()))
+        width = len(columns)
+
+        chunk, chunk_index = [], []
+        for sheet_row, row in enumerate(rows, start=header + 2):
+            if all(value is None for value in row):
+                continue
+            row = tuple(row[:width]) + (None,) * (width - len(row))
+            chunk.append(row)
+            chunk_index.append(sheet_row)
+            if len(chunk) >= chunk_rows:
+                yield pd.DataFrame(chunk, index=chunk_index, columns=columns, dtype=object)
+                chunk, chunk_index = [], []
+        if chunk:
+            yield pd.DataFrame(chunk, index=chunk_index, columns=columns, dtype=object)
+    finally:
+        workbook.close()
+
+
+def typed_source_columns():
+    """
+    Derive the Spark type of every mapped Excel column from the target_schemas definitions
+    """
+    column_types = {}
+    for schema_obj in target_schemas:
+        for db_col, data_type in schema_obj["schema"].items():
+            excel_col = schema_obj["column_mapping"].get(db_col)
+            if not excel_col or data_type == "date":
+                continue
+            current_type = column_types.get(excel_col)
+            if current_type is None or TYPE_PRECEDENCE[data_type] > TYPE_PRECEDENCE[current_type]:
+                column_types[excel_col] = data_type
+    return column_types
+
+
+def parse_excel_date(value):
+    """
+    Parse a 'Datum' cell: Excel datetimes and MM/dd/yyyy strings, anything else (e.g. "Werte aus KW1 2024") is None
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.strptime(value.strip(), "%m/%d/%Y").date()
+        except ValueError:
+            return None
+    return None
+
+
+def numeric_cell(value):
+    """
+    Keep numbers and (stripped) strings for numeric parsing, drop everything else
+    """
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, numbers.Number) and not isinstance(value, bool):
+        return value
+    return None
+
+
+def cast_pandas_column(series, data_type):
+    """
+    Cast a raw workbook column the way Spark's string cast would, producing nullable typed values
+    """
+    if data_type == "string":
+        return series.map(lambda value: None if pd.isna(value) else str(value)).astype(object)
+
+    # Non-numeric cells (text, datetimes) become NaN like a failed Spark cast
+    numeric = pd.to_numeric(series.map(numeric_cell), errors="coerce").astype("float64")
+    if data_type == "int":
+        # Spark truncates fractional values and yields NULL on int overflow
+        numeric = np.trunc(numeric).where((numeric >= INT32_MIN) & (numeric <= INT32_MAX))
+        return numeric.astype("Int32")
+    return numeric
+
+
+def build_typed_frame(excel_df):
+    """
+    Keep only the columns referenced by target_schemas, cast to their target types,
+    plus a parsed 'date' column and the source row taken from the frame index
+    """
+    column_types = typed_source_columns()
+
+    typed_df = pd.DataFrame(index=excel_df.index)
+    if "Datum" in excel_df.columns:
+        typed_df["date"] = excel_df["Datum"].map(parse_excel_date).astype(object)
+    else:
+        typed_df["date"] = None
+
+    for excel_col, data_type in column_types.items():
+        if excel_col in excel_df.columns:
+            typed_df[excel_col] = cast_pandas_column(excel_df[excel_col], data_type)
+    typed_df[SOURCE_ROW_COLUMN] = pd.Series(excel_df.index, index=excel_df.index, dtype="Int32")
+    return typed_df
+
+
+def null_column(index, data_type):
+    """
+    All-NULL column with the dtype cast_pandas_column would produce
+    """
+    dtype = {"int": "Int32", "double": "float64"}.get(data_type, object)
+    return pd.Series(None, index=index, dtype=dtype)
+
+
+def project_table_frame(typed_df, schema_obj, source_file=None):
+    """
+    pandas equivalent of the Glue projection: map and cast one table's columns,
+    drop rows without a valid date and drop duplicates, keeping the last source row
+    """
+    column_types = typed_source_columns()
+    projected = pd.DataFrame(index=typed_df.index)
+    for db_col, data_type in schema_obj["schema"].items():
+        excel_col = schema_obj["column_mapping"].get(db_col)
+        if not excel_col or excel_col not in typed_df.columns:
+            projected[db_col] = null_column(typed_df.index, data_type)
+        elif data_type == "date" or column_types[excel_col] == data_type:
+            projected[db_col] = typed_df[excel_col]
+        else:
+            # Column was widened for another table, cast it back like Spark would
+            projected[db_col] = cast_pandas_column(typed_df[excel_col], data_type)
+
+    columns = list(projected.columns)
+    projected[SOURCE_FILE_COLUMN] = pd.Series(source_file, index=typed_df.index, dtype=object)
+    projected[SOURCE_ROW_COLUMN] = typed_df[SOURCE_ROW_COLUMN]
+
+    projected = projected[projected["date"].notna()]
+    return projected.drop_duplicates(subset=columns, keep="last")
+
+
+def merge_ingestion_metrics(total, metrics):
+    """
+    Add one frame's metrics to the running job totals
+    """
+    if total is None:
+        return {**metrics, "tables": dict(metrics["tables"])}
+    for key in ("total_rows", "valid_dates", "filtered_out"):
+        total[key] += metrics[key]
+    for table_name, rows_to_write in metrics["tables"].items():
+        total["tables"][table_name] = total["tables"].get(table_name, 0) + rows_to_write
+    return total
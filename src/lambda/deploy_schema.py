@@ -4,10 +4,20 @@ import psycopg2
 import logging
 import os
 
+from table_registry import (
+    PARTITIONING_NONE, PARTITIONINGS, TABLES, UPSERT_ENGINE_MERGE, UPSERT_ENGINE_ON_CONFLICT,
+    main_table_ddl, staging_table_ddl, upsert_function_sql, upsert_all_function_sql, run_staging_functions_sql,
+    reference_check_function_sql, reference_key_functions_sql, partitioning_functions_sql, reporting_tables_ddl, reporting_functions_sql,
+    REPORTING_QUEUE_TABLE, ROLLUP_SOURCE_TABLE
+)
+
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# MERGE ... RETURNING merge_action() was added in Postgres 17
+MERGE_MIN_SERVER_VERSION = 170000
+
 def lambda_handler(event, context):
     """
     Lambda function to deploy database schema
@@ -48,13 +58,25 @@ def lambda_handler(event, context):
         
         # Get schema SQL from event or use embedded schema
         schema_sql = event.get('schema_sql')
-        if not schema_sql:
-            # Use embedded schema if not provided in event
-            schema_sql = get_embedded_schema()
         
         # Execute schema deployment
         cursor = conn.cursor()
         
+        if not schema_sql:
+            # Use embedded schema if not provided in event
+            upsert_engine = event.get('upsert_engine') or os.environ.get('UPSERT_ENGINE', UPSERT_ENGINE_ON_CONFLICT)
+            if upsert_engine == UPSERT_ENGINE_MERGE:
+                cursor.execute("SHOW server_version_num")
+                server_version = int(cursor.fetchone()[0])
+                if server_version < MERGE_MIN_SERVER_VERSION:
+                    raise ValueError(f"The merge upsert engine needs Postgres 17 or newer (server_version_num {server_version})")
+            partitioning = event.get('main_table_partitioning') or os.environ.get('MAIN_TABLE_PARTITIONING', PARTITIONING_NONE)
+            if partitioning not in PARTITIONINGS:
+                raise ValueError(f"Unknown main table partitioning '{partitioning}', expected one of {', '.join(PARTITIONINGS)}")
+            logger.info(f"🧩 Generating upsert functions with the {upsert_engine} engine, "
+                        f"main tables partitioned by {partitioning}")
+            schema_sql = get_embedded_schema(upsert_engine, partitioning)
+        
         logger.info("📝 Executing schema SQL...")
         
         # Execute the entire schema as one block to handle dollar-quoted functions properly
@@ -95,284 +117,125 @@ def lambda_handler(event, context):
             }
         }
 
-def get_embedded_schema():
+def get_embedded_schema(upsert_engine=UPSERT_ENGINE_ON_CONFLICT, partitioning=PARTITIONING_NONE):
     """
-    Embedded SQL schema - update this when schema.sql changes
+    Embedded SQL schema - the ingested tables and their upsert functions are generated
+    from TABLES in table_registry.py, edit that instead of the SQL below
     """
+    main_tables = "\n".join(main_table_ddl(table, partitioning) for table in TABLES)
+    staging_tables = "\n".join(staging_table_ddl(table) for table in TABLES)
+    upsert_functions = "\n".join(
+        upsert_function_sql(table, upsert_engine, partitioning=partitioning) for table in TABLES
+    )
+
     return '''
 -- Create tables for Ring Textilservice data processing
 -- This script is idempotent - safe to run multiple times
 
--- Overview table: production metrics
-CREATE TABLE IF NOT EXISTS overview (
-    date DATE PRIMARY KEY,
-    tonage INTEGER,
-    water_m3 REAL,
-    liters_per_kg REAL,
-    electricity_per_kg REAL,
-    gas_per_kg REAL,
-    gas_plus_elec_per_kg REAL,
-    hours_production REAL,
-    kg_per_hour REAL
-);
-
--- Fleet table: vehicle and transport metrics
-CREATE TABLE IF NOT EXISTS fleet (
-    date DATE PRIMARY KEY,
-    driving_hours REAL,
-    kg_per_hour_driving REAL,
-    km_driven INTEGER,
-    CONSTRAINT fk_fleet_date FOREIGN KEY (date) REFERENCES overview (date)
-);
+-- =============================================================================
+-- MAIN TABLE PARTITIONING
+-- Main tables are plain or range-partitioned by year or month (MAIN_TABLE_PARTITIONING).
+-- Deploying with a different setting converts the existing tables; partitions are
+-- created by the upsert functions and old ones detached with detach_date_partitions().
+-- =============================================================================
 
--- Washing machines table: equipment performance
-CREATE TABLE IF NOT EXISTS washing_machines (
-    date DATE PRIMARY KEY,
-    machine_130kg INTEGER,
-    steps_130kg INTEGER,
-    machine_85kg_plus_85kg INTEGER,
-    machine_85kg_middle INTEGER,
-    steps_85kg_middle INTEGER,
-    machine_85kg_right INTEGER,
-    steps_85kg_right INTEGER,
-    electrolux INTEGER,
-    avg_load_130kg REAL,
-    avg_load_85kg_middle REAL,
-    avg_load_85kg_right REAL,
-    CONSTRAINT fk_washing_machines_date FOREIGN KEY (date) REFERENCES overview (date)
-);
+''' + partitioning_functions_sql(TABLES) + '''
+''' + main_tables + '''
+-- =============================================================================
+-- STAGING TABLES FOR UPSERT WORKFLOW
+-- These tables temporarily hold new data before upserting to main tables.
+-- Each pipeline run stages into its own unlogged partition (keyed by ingestion_id),
+-- created by prepare_run_staging() and dropped by the upsert Lambda afterwards.
+-- =============================================================================
 
--- Drying table: drying equipment and processes
-CREATE TABLE IF NOT EXISTS drying (
-    date DATE PRIMARY KEY,
-    roboter_1 INTEGER,
-    roboter_2 INTEGER,
-    roboter_3 INTEGER,
-    roboter_4 INTEGER,
-    terry_prep_1 INTEGER,
-    terry_prep_2 INTEGER,
-    terry_prep_3 INTEGER,
-    terry_prep_4 INTEGER,
-    blankets_1 INTEGER,
-    blankets_2 INTEGER,
-    sum_drying_load INTEGER,
-    steps_total INTEGER,
-    kipper INTEGER,
-    avg_drying_load REAL,
-    sum_drying INTEGER,
-    steps INTEGER,
-    CONSTRAINT fk_drying_date FOREIGN KEY (date) REFERENCES overview (date)
+''' + staging_tables + '''
+-- One row per run with staging partitions, so partitions of failed runs can be dropped.
+-- finished_at is set once a run's upsert committed and its partitions are only left
+-- over because dropping them timed out
+CREATE TABLE IF NOT EXISTS staging_run (
+    ingestion_id TEXT PRIMARY KEY,
+    prepared_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at TIMESTAMPTZ
 );
+ALTER TABLE staging_run ADD COLUMN IF NOT EXISTS finished_at TIMESTAMPTZ;
 
+''' + run_staging_functions_sql(TABLES) + '''
 -- =============================================================================
--- STAGING TABLES FOR UPSERT WORKFLOW
--- These tables temporarily hold new data before upserting to main tables
+-- INGESTION MANIFEST
+-- One row per distinct uploaded file content, used to skip re-processing duplicates
 -- =============================================================================
 
--- Staging table for overview data
-CREATE TABLE IF NOT EXISTS overview_staging (
-    date DATE,
-    tonage INTEGER,
-    water_m3 REAL,
-    liters_per_kg REAL,
-    electricity_per_kg REAL,
-    gas_per_kg REAL,
-    gas_plus_elec_per_kg REAL,
-    hours_production REAL,
-    kg_per_hour REAL
+CREATE TABLE IF NOT EXISTS ingestion_manifest (
+    content_hash TEXT PRIMARY KEY,
+    source_key TEXT NOT NULL,
+    size_bytes BIGINT,
+    status TEXT NOT NULL CHECK (status IN ('processing', 'succeeded', 'failed')),
+    execution_id TEXT,
+    row_counts JSONB,
+    first_seen_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    processed_at TIMESTAMPTZ
 );
 
--- Staging table for fleet data  
-CREATE TABLE IF NOT EXISTS fleet_staging (
-    date DATE,
-    driving_hours REAL,
-    kg_per_hour_driving REAL,
-    km_driven INTEGER
-);
+-- =============================================================================
+-- MAINTENANCE LOG
+-- ANALYZE / VACUUM statements the upsert Lambda ran after a load, and how long they took
+-- =============================================================================
 
--- Staging table for washing machines data
-CREATE TABLE IF NOT EXISTS washing_machines_staging (
-    date DATE,
-    machine_130kg INTEGER,
-    steps_130kg INTEGER,
-    machine_85kg_plus_85kg INTEGER,
-    machine_85kg_middle INTEGER,
-    steps_85kg_middle INTEGER,
-    machine_85kg_right INTEGER,
-    steps_85kg_right INTEGER,
-    electrolux INTEGER,
-    avg_load_130kg REAL,
-    avg_load_85kg_middle REAL,
-    avg_load_85kg_right REAL
+CREATE TABLE IF NOT EXISTS maintenance_log (
+    id BIGSERIAL PRIMARY KEY,
+    ingestion_id TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    action TEXT NOT NULL,
+    rows_changed BIGINT NOT NULL,
+    table_rows BIGINT,
+    seconds REAL NOT NULL,
+    performed_at TIMESTAMPTZ NOT NULL DEFAULT now()
 );
 
--- Staging table for drying data
-CREATE TABLE IF NOT EXISTS drying_staging (
-    date DATE,
-    roboter_1 INTEGER,
-    roboter_2 INTEGER,
-    roboter_3 INTEGER,
-    roboter_4 INTEGER,
-    terry_prep_1 INTEGER,
-    terry_prep_2 INTEGER,
-    terry_prep_3 INTEGER,
-    terry_prep_4 INTEGER,
-    blankets_1 INTEGER,
-    blankets_2 INTEGER,
-    sum_drying_load INTEGER,
-    steps_total INTEGER,
-    kipper INTEGER,
-    avg_drying_load REAL,
-    sum_drying INTEGER,
-    steps INTEGER
-);
+-- =============================================================================
+-- REPORTING TABLES
+-- The daily report (all tables' columns per date) and KPI rollups by ISO week, month
+-- and year, refreshed by upsert_all_data() for the dates an upsert changed (queued in
+-- ''' + REPORTING_QUEUE_TABLE + ''') and the periods containing them
+-- =============================================================================
 
+''' + reporting_tables_ddl(TABLES) + '''
+''' + reporting_functions_sql(TABLES) + '''
 -- =============================================================================
 -- UPSERT FUNCTIONS FOR EACH TABLE
--- These functions handle the INSERT ... ON CONFLICT UPDATE logic
+-- These functions handle the INSERT ... ON CONFLICT UPDATE (or MERGE) logic.
+-- Staged rows are deduplicated per date deterministically, rows whose values are
+-- identical to the main table are skipped (no new row version, WAL or index churn)
+-- and the counts are reported separately.
+-- Their signatures changed over time, so existing versions are dropped first.
 -- =============================================================================
 
-CREATE OR REPLACE FUNCTION upsert_overview_data()
-RETURNS INTEGER AS $$
-DECLARE
-    rows_affected INTEGER;
-BEGIN
-    INSERT INTO overview (date, tonage, water_m3, liters_per_kg, electricity_per_kg, 
-                         gas_per_kg, gas_plus_elec_per_kg, hours_production, kg_per_hour)
-    SELECT DISTINCT date, tonage, water_m3, liters_per_kg, electricity_per_kg, 
-           gas_per_kg, gas_plus_elec_per_kg, hours_production, kg_per_hour
-    FROM overview_staging
-    ON CONFLICT (date) DO UPDATE SET
-        tonage = EXCLUDED.tonage,
-        water_m3 = EXCLUDED.water_m3,
-        liters_per_kg = EXCLUDED.liters_per_kg,
-        electricity_per_kg = EXCLUDED.electricity_per_kg,
-        gas_per_kg = EXCLUDED.gas_per_kg,
-        gas_plus_elec_per_kg = EXCLUDED.gas_plus_elec_per_kg,
-        hours_production = EXCLUDED.hours_production,
-        kg_per_hour = EXCLUDED.kg_per_hour;
-    
-    GET DIAGNOSTICS rows_affected = ROW_COUNT;
-    DELETE FROM overview_staging;
-    RETURN rows_affected;
-END;
-$$ LANGUAGE plpgsql;
-
-CREATE OR REPLACE FUNCTION upsert_fleet_data()
-RETURNS INTEGER AS $$
-DECLARE
-    rows_affected INTEGER;
-BEGIN
-    INSERT INTO fleet (date, driving_hours, kg_per_hour_driving, km_driven)
-    SELECT DISTINCT date, driving_hours, kg_per_hour_driving, km_driven
-    FROM fleet_staging
-    ON CONFLICT (date) DO UPDATE SET
-        driving_hours = EXCLUDED.driving_hours,
-        kg_per_hour_driving = EXCLUDED.kg_per_hour_driving,
-        km_driven = EXCLUDED.km_driven;
-    
-    GET DIAGNOSTICS rows_affected = ROW_COUNT;
-    DELETE FROM fleet_staging;
-    RETURN rows_affected;
-END;
-$$ LANGUAGE plpgsql;
-
-CREATE OR REPLACE FUNCTION upsert_washing_machines_data()
-RETURNS INTEGER AS $$
-DECLARE
-    rows_affected INTEGER;
-BEGIN
-    INSERT INTO washing_machines (date, machine_130kg, steps_130kg, machine_85kg_plus_85kg,
-                                 machine_85kg_middle, steps_85kg_middle, machine_85kg_right,
-                                 steps_85kg_right, electrolux, avg_load_130kg, 
-                                 avg_load_85kg_middle, avg_load_85kg_right)
-    SELECT DISTINCT date, machine_130kg, steps_130kg, machine_85kg_plus_85kg,
-           machine_85kg_middle, steps_85kg_middle, machine_85kg_right,
-           steps_85kg_right, electrolux, avg_load_130kg, 
-           avg_load_85kg_middle, avg_load_85kg_right
-    FROM washing_machines_staging
-    ON CONFLICT (date) DO UPDATE SET
-        machine_130kg = EXCLUDED.machine_130kg,
-        steps_130kg = EXCLUDED.steps_130kg,
-        machine_85kg_plus_85kg = EXCLUDED.machine_85kg_plus_85kg,
-        machine_85kg_middle = EXCLUDED.machine_85kg_middle,
-        steps_85kg_middle = EXCLUDED.steps_85kg_middle,
-        machine_85kg_right = EXCLUDED.machine_85kg_right,
-        steps_85kg_right = EXCLUDED.steps_85kg_right,
-        electrolux = EXCLUDED.electrolux,
-        avg_load_130kg = EXCLUDED.avg_load_130kg,
-        avg_load_85kg_middle = EXCLUDED.avg_load_85kg_middle,
-        avg_load_85kg_right = EXCLUDED.avg_load_85kg_right;
-    
-    GET DIAGNOSTICS rows_affected = ROW_COUNT;
-    DELETE FROM washing_machines_staging;
-    RETURN rows_affected;
-END;
-$$ LANGUAGE plpgsql;
-
-CREATE OR REPLACE FUNCTION upsert_drying_data()
-RETURNS INTEGER AS $$
-DECLARE
-    rows_affected INTEGER;
-BEGIN
-    INSERT INTO drying (date, roboter_1, roboter_2, roboter_3, roboter_4,
-                       terry_prep_1, terry_prep_2, terry_prep_3, terry_prep_4,
-                       blankets_1, blankets_2, sum_drying_load, steps_total,
-                       kipper, avg_drying_load, sum_drying, steps)
-    SELECT DISTINCT date, roboter_1, roboter_2, roboter_3, roboter_4,
-           terry_prep_1, terry_prep_2, terry_prep_3, terry_prep_4,
-           blankets_1, blankets_2, sum_drying_load, steps_total,
-           kipper, avg_drying_load, sum_drying, steps
-    FROM drying_staging
-    ON CONFLICT (date) DO UPDATE SET
-        roboter_1 = EXCLUDED.roboter_1,
-        roboter_2 = EXCLUDED.roboter_2,
-        roboter_3 = EXCLUDED.roboter_3,
-        roboter_4 = EXCLUDED.roboter_4,
-        terry_prep_1 = EXCLUDED.terry_prep_1,
-        terry_prep_2 = EXCLUDED.terry_prep_2,
-        terry_prep_3 = EXCLUDED.terry_prep_3,
-        terry_prep_4 = EXCLUDED.terry_prep_4,
-        blankets_1 = EXCLUDED.blankets_1,
-        blankets_2 = EXCLUDED.blankets_2,
-        sum_drying_load = EXCLUDED.sum_drying_load,
-        steps_total = EXCLUDED.steps_total,
-        kipper = EXCLUDED.kipper,
-        avg_drying_load = EXCLUDED.avg_drying_load,
-        sum_drying = EXCLUDED.sum_drying,
-        steps = EXCLUDED.steps;
-    
-    GET DIAGNOSTICS rows_affected = ROW_COUNT;
-    DELETE FROM drying_staging;
-    RETURN rows_affected;
-END;
-$$ LANGUAGE plpgsql;
-
+''' + upsert_functions + '''
 -- =============================================================================
 -- MASTER UPSERT FUNCTION
--- Calls all individual upsert functions in proper order
+-- Checks the staged child rows against their parents in bulk, then calls all
+-- individual upsert functions in proper order (dropping the foreign keys around them
+-- for bulk loads)
 -- =============================================================================
 
-CREATE OR REPLACE FUNCTION upsert_all_data()
-RETURNS TEXT AS $$
-DECLARE
-    overview_rows INTEGER;
-    fleet_rows INTEGER;
-    washing_rows INTEGER;
-    drying_rows INTEGER;
-    result_msg TEXT;
-BEGIN
-    -- Upsert in order: overview first (parent), then child tables
-    overview_rows := upsert_overview_data();
-    fleet_rows := upsert_fleet_data();
-    washing_rows := upsert_washing_machines_data();
-    drying_rows := upsert_drying_data();
-    
-    result_msg := format('Upsert completed: Overview=%s, Fleet=%s, Washing=%s, Drying=%s rows',
-                        overview_rows, fleet_rows, washing_rows, drying_rows);
-    
-    RAISE NOTICE '%', result_msg;
-    RETURN result_msg;
-END;
-$$ LANGUAGE plpgsql;
-    '''
\ No newline at end of file
+-- Sessions that committed dropping the foreign keys for a chunked bulk load, cleared
+-- when the keys are restored
+CREATE TABLE IF NOT EXISTS reference_key_drop (
+    pid INTEGER NOT NULL,
+    backend_start TIMESTAMPTZ NOT NULL,
+    dropped_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+''' + reference_check_function_sql(TABLES) + '''
+''' + reference_key_functions_sql(TABLES, partitioning) + '''
+-- The main table DDL above already added back keys a killed load left dropped
+SELECT restore_abandoned_reference_keys();
+''' + upsert_all_function_sql(TABLES, partitioning) + '''
+-- Rebuild the reporting tables from all rows, covering new reporting columns and data
+-- loaded before they existed
+INSERT INTO ''' + REPORTING_QUEUE_TABLE + ''' (date)
+SELECT date FROM ''' + ROLLUP_SOURCE_TABLE + '''
+ON CONFLICT DO NOTHING;
+SELECT refresh_reporting_tables();
+'''
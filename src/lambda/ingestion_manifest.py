@@ -0,0 +1,195 @@
+import base64
+import hashlib
+import json
+import boto3
+import psycopg2
+import logging
+import os
+from urllib.parse import unquote, urlparse
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+# A 'processing' claim older than this is treated as abandoned and can be re-claimed
+CLAIM_TIMEOUT_MINUTES = int(os.environ.get('MANIFEST_CLAIM_TIMEOUT_MINUTES', '240'))
+
+s3_client = boto3.client('s3')
+
+
+def lambda_handler(event, context):
+    """
+    Lambda function to look up and record uploads in the ingestion manifest.
+
+    action 'check': hash the uploaded object and claim it; returns duplicate=True when the
+    same content was already ingested successfully (or is being ingested right now).
+    action 'record': store the outcome and row counts of a pipeline run.
+    """
+    try:
+        action = event.get('action', 'check')
+        logger.info(f"🚀 Ingestion manifest action: {action}")
+
+        conn = connect_to_database()
+        try:
+            if action == 'check':
+                result = check_upload(conn, event)
+            elif action == 'record':
+                result = record_outcome(conn, event)
+            else:
+                raise ValueError(f"Unknown manifest action: {action}")
+        finally:
+            conn.close()
+
+        return result
+
+    except Exception as e:
+        logger.error(f"❌ Ingestion manifest {event.get('action', 'check')} failed: {str(e)}")
+        # Re-raise the exception to make Step Functions fail properly
+        raise RuntimeError(f"Ingestion manifest operation failed: {str(e)}")
+
+
+def connect_to_database():
+    """
+    Open an autocommit connection using the credentials in Secrets Manager
+    """
+    secrets_client = boto3.client('secretsmanager')
+
+    secret_name = os.environ.get('SECRET_NAME')
+    if not secret_name:
+        raise ValueError("SECRET_NAME environment variable not set")
+
+    secret_response = secrets_client.get_secret_value(SecretId=secret_name)
+    db_credentials = json.loads(secret_response['SecretString'])
+
+    conn = psycopg2.connect(
+        host=db_credentials['host'],
+        port=db_credentials.get('port', 5432),
+        database=db_credentials['dbname'],
+        user=db_credentials['username'],
+        password=db_credentials['password'],
+        connect_timeout=30
+    )
+    conn.autocommit = True
+    return conn
+
+
+def parse_s3_path(s3_input_path):
+    """
+    Split an s3://bucket/key path into bucket and (URL-decoded) key
+    """
+    parsed = urlparse(unquote(s3_input_path))
+    return parsed.netloc, parsed.path.lstrip('/')
+
+
+def compute_content_hash(bucket, key):
+    """
+    Return (sha256 hex digest, size in bytes) of an S3 object.
+
+    Uses the SHA-256 checksum S3 stored at upload time when there is one for the whole
+    object, otherwise streams the object through hashlib.
+    """
+    head = s3_client.head_object(Bucket=bucket, Key=key, ChecksumMode='ENABLED')
+    size_bytes = head['ContentLength']
+
+    checksum = head.get('ChecksumSHA256')
+    # Multipart uploads carry a checksum of part checksums ("...-N"), not of the content
+    if checksum and '-' not in checksum:
+        return base64.b64decode(checksum).hex(), size_bytes
+
+    digest = hashlib.sha256()
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    for chunk in body.iter_chunks(chunk_size=HASH_CHUNK_BYTES):
+        digest.update(chunk)
+    return digest.hexdigest(), size_bytes
+
+
+def check_upload(conn, event):
+    """
+    Hash the upload and atomically claim it in the manifest unless identical content was already processed
+    """
+    s3_input_path = event['s3_input_path']
+    bucket, key = parse_s3_path(s3_input_path)
+    content_hash, size_bytes = compute_content_hash(bucket, key)
+    logger.info(f"🔑 {key}: sha256={content_hash} ({size_bytes} bytes)")
+
+    cursor = conn.cursor()
+
+    if event.get('force'):
+        logger.info("⚠️ Forced run - ignoring previous manifest entries")
+
+    # Claim the hash: new content, previously failed runs and abandoned claims can be (re)processed
+    cursor.execute("""
+        INSERT INTO ingestion_manifest (content_hash, source_key, size_bytes, status, execution_id)
+        VALUES (%s, %s, %s, 'processing', %s)
+        ON CONFLICT (content_hash) DO UPDATE SET
+            source_key = EXCLUDED.source_key,
+            size_bytes = EXCLUDED.size_bytes,
+            status = 'processing',
+            execution_id = EXCLUDED.execution_id,
+            row_counts = NULL,
+            updated_at = now()
+        WHERE %s
+           OR ingestion_manifest.status = 'failed'
+           OR (ingestion_manifest.status = 'processing'
+               AND ingestion_manifest.updated_at < now() - make_interval(mins => %s))
+        RETURNING content_hash
+    """, (content_hash, key, size_bytes, event.get('execution_id'), bool(event.get('force')), CLAIM_TIMEOUT_MINUTES))
+    claimed = cursor.fetchone() is not None
+
+    if claimed:
+        logger.info(f"✅ New content claimed for processing: {key}")
+        previous = None
+    else:
+        cursor.execute(
+            "SELECT source_key, status, execution_id, updated_at FROM ingestion_manifest WHERE content_hash = %s",
+            (content_hash,)
+        )
+        source_key, status, execution_id, updated_at = cursor.fetchone()
+        previous = {
+            'source_key': source_key,
+            'status': status,
+            'execution_id': execution_id,
+            'updated_at': updated_at.isoformat()
+        }
+        logger.info(f"⏭️ Duplicate upload - same content as {source_key} ({status} by {execution_id} at {updated_at})")
+
+    cursor.close()
+
+    return {
+        'duplicate': not claimed,
+        'content_hash': content_hash,
+        'source_key': key,
+        'size_bytes': size_bytes,
+        'previous': previous
+    }
+
+
+def record_outcome(conn, event):
+    """
+    Store the final status and row counts of a pipeline run for a content hash
+    """
+    content_hash = event['content_hash']
+    status = event.get('status', 'succeeded')
+    row_counts = event.get('row_counts')
+
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE ingestion_manifest
+        SET status = %s,
+            row_counts = %s,
+            processed_at = now(),
+            updated_at = now()
+        WHERE content_hash = %s
+    """, (status, json.dumps(row_counts) if row_counts is not None else None, content_hash))
+    updated = cursor.rowcount
+    cursor.close()
+
+    logger.info(f"📝 Recorded outcome '{status}' for {content_hash} ({updated} manifest row)")
+
+    return {
+        'content_hash': content_hash,
+        'status': status,
+        'recorded': updated == 1
+    }
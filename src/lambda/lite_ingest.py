@@ -0,0 +1,74 @@
+import io
+import json
+import boto3
+import psycopg2
+import logging
+import os
+from urllib.parse import unquote, urlparse
+
+from lite_engine import run_lite_ingestion
+from table_registry import SHARED_INGESTION_ID
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3_client = boto3.client('s3')
+
+
+def lambda_handler(event, context):
+    """
+    Lambda function to load a small workbook into the staging tables without Spark
+    (same staging output as the Glue job, see src/glue/lite_engine.py)
+    """
+    try:
+        logger.info("🚀 Starting lite ingestion...")
+
+        s3_input_path = unquote(event['s3_input_path'])
+        parsed = urlparse(s3_input_path)
+        bucket, key = parsed.netloc, parsed.path.lstrip('/')
+        # The state machine passes its execution name so the run stages into its own partitions
+        ingestion_id = event.get('ingestion_id') or SHARED_INGESTION_ID
+
+        logger.info(f"📄 Reading s3://{bucket}/{key}")
+        excel_bytes = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+        logger.info(f"✅ Excel file downloaded: {len(excel_bytes)} bytes")
+
+        # Get database credentials from Secrets Manager
+        secrets_client = boto3.client('secretsmanager')
+
+        secret_name = os.environ.get('SECRET_NAME')
+        if not secret_name:
+            raise ValueError("SECRET_NAME environment variable not set")
+
+        secret_response = secrets_client.get_secret_value(SecretId=secret_name)
+        db_credentials = json.loads(secret_response['SecretString'])
+
+        conn = psycopg2.connect(
+            host=db_credentials['host'],
+            port=db_credentials.get('port', 5432),
+            database=db_credentials['dbname'],
+            user=db_credentials['username'],
+            password=db_credentials['password'],
+            connect_timeout=30
+        )
+
+        try:
+            metrics = run_lite_ingestion(conn, io.BytesIO(excel_bytes), source_file=key, ingestion_id=ingestion_id)
+        finally:
+            conn.close()
+
+        logger.info(f"🎉 Staging tables populated in {metrics['seconds']}s: {metrics['tables']}")
+
+        return {
+            'statusCode': 200,
+            'body': {
+                'message': 'Lite ingestion completed successfully',
+                'metrics': metrics
+            }
+        }
+
+    except Exception as e:
+        logger.error(f"❌ Lite ingestion failed: {str(e)}")
+        # Re-raise the exception to make Step Functions fail properly
+        raise RuntimeError(f"Lite ingestion failed: {str(e)}")
@@ -0,0 +1,113 @@
+import io
+import re
+import zipfile
+import boto3
+import logging
+import os
+import posixpath
+from urllib.parse import unquote, urlparse
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+ENGINE_LITE = "lite"
+ENGINE_GLUE = "glue"
+
+# Uploads up to these limits are ingested in-process by the lite engine
+DEFAULT_LITE_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_LITE_MAX_ROWS = 5000
+
+# Bytes of the worksheet XML read to find its <dimension> element
+SHEET_HEADER_BYTES = 4096
+
+DIMENSION_PATTERN = re.compile(rb'<(?:\w+:)?dimension ref="[A-Z]+\d+(?::[A-Z]+(\d+))?"')
+SHEET_PATTERN = re.compile(rb'<(?:\w+:)?sheet\b[^>]*\br:id="([^"]+)"')
+RELATIONSHIP_PATTERN = re.compile(rb'<Relationship\b[^>]*>')
+ATTRIBUTE_PATTERN = re.compile(rb'(\w+)="([^"]*)"')
+
+s3_client = boto3.client('s3')
+
+
+def choose_engine(size_bytes, estimated_rows, max_lite_bytes=DEFAULT_LITE_MAX_BYTES, max_lite_rows=DEFAULT_LITE_MAX_ROWS):
+    """
+    Decide which engine ingests an upload; returns (engine, reason).
+
+    Files over the byte limit always go to Glue. Otherwise the row estimate decides, and
+    when no estimate is available the byte limit alone decides.
+    """
+    if size_bytes > max_lite_bytes:
+        return ENGINE_GLUE, f"{size_bytes} bytes exceeds the lite limit of {max_lite_bytes} bytes"
+    if estimated_rows is None:
+        return ENGINE_LITE, f"{size_bytes} bytes is within the lite limit (row count unknown)"
+    if estimated_rows > max_lite_rows:
+        return ENGINE_GLUE, f"~{estimated_rows} rows exceeds the lite limit of {max_lite_rows} rows"
+    return ENGINE_LITE, f"~{estimated_rows} rows and {size_bytes} bytes are within the lite limits"
+
+
+def estimate_xlsx_rows(xlsx_bytes):
+    """
+    Estimate the row count of the first worksheet from its <dimension> element.
+
+    Only the workbook relationships and the first few KB of the sheet XML are read, so
+    this is cheap compared to parsing the workbook. Returns None when it cannot tell.
+    """
+    try:
+        with zipfile.ZipFile(io.BytesIO(xlsx_bytes)) as archive:
+            sheet_match = SHEET_PATTERN.search(archive.read("xl/workbook.xml"))
+            if not sheet_match:
+                return None
+
+            sheet_path = None
+            for relationship in RELATIONSHIP_PATTERN.findall(archive.read("xl/_rels/workbook.xml.rels")):
+                attributes = dict(ATTRIBUTE_PATTERN.findall(relationship))
+                if attributes.get(b"Id") == sheet_match.group(1):
+                    target = attributes[b"Target"].decode()
+                    sheet_path = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+                    break
+            if not sheet_path:
+                return None
+
+            with archive.open(sheet_path) as sheet:
+                dimension_match = DIMENSION_PATTERN.search(sheet.read(SHEET_HEADER_BYTES))
+    except (zipfile.BadZipFile, KeyError):
+        return None
+
+    if not dimension_match:
+        return None
+    return int(dimension_match.group(1) or 1)
+
+
+def lambda_handler(event, context):
+    """
+    Lambda function to route an upload to the lite engine or the Glue job based on its size and row estimate
+    """
+    try:
+        s3_input_path = unquote(event['s3_input_path'])
+        parsed = urlparse(s3_input_path)
+        bucket, key = parsed.netloc, parsed.path.lstrip('/')
+
+        max_lite_bytes = int(os.environ.get('LITE_MAX_BYTES', DEFAULT_LITE_MAX_BYTES))
+        max_lite_rows = int(os.environ.get('LITE_MAX_ROWS', DEFAULT_LITE_MAX_ROWS))
+
+        size_bytes = s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+
+        estimated_rows = None
+        # Large files go to Glue without being downloaded
+        if size_bytes <= max_lite_bytes and key.lower().endswith(('.xlsx', '.xlsm')):
+            estimated_rows = estimate_xlsx_rows(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read())
+
+        engine, reason = choose_engine(size_bytes, estimated_rows, max_lite_bytes, max_lite_rows)
+        logger.info(f"🧭 {key}: routing to {engine} - {reason}")
+
+        return {
+            'engine': engine,
+            'reason': reason,
+            'size_bytes': size_bytes,
+            'estimated_rows': estimated_rows
+        }
+
+    except Exception as e:
+        logger.error(f"❌ Ingestion routing failed: {str(e)}")
+        # Re-raise the exception to make Step Functions fail properly
+        raise RuntimeError(f"Ingestion routing failed: {str(e)}")
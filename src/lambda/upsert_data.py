@@ -1,163 +1,871 @@
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import boto3
 import psycopg2
+import psycopg2.errors
+import psycopg2.pool
 import logging
 import os
 
+from table_registry import (
+    INGESTION_ID_COLUMN, SHARED_INGESTION_ID, TABLES, foreign_key_name, staging_table_name, upsert_function_name
+)
+
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Module-scope state survives across warm invocations of the same execution environment
+SECRET_CACHE_TTL_SECONDS = int(os.environ.get('SECRET_CACHE_TTL_SECONDS', '300'))
+POOL_MAX_CONNECTIONS = int(os.environ.get('POOL_MAX_CONNECTIONS', '4'))
+
+# Staging partitions of runs that never finished (failed upstream) are dropped after this long
+STAGING_RUN_RETENTION_HOURS = int(os.environ.get('STAGING_RUN_RETENTION_HOURS', '24'))
+# DETACH ... CONCURRENTLY waits for transactions still using the staging tables; give up
+# after this long and leave the partitions to a later cleanup
+STAGING_DETACH_LOCK_TIMEOUT = '30s'
+
+# Diagnostics levels: 'off' logs nothing extra, 'cheap' adds catalog row estimates,
+# 'full' snapshots counts and first rows of every table before and after each upsert
+DIAGNOSTICS_OFF = 'off'
+DIAGNOSTICS_CHEAP = 'cheap'
+DIAGNOSTICS_FULL = 'full'
+DIAGNOSTICS_LEVELS = (DIAGNOSTICS_OFF, DIAGNOSTICS_CHEAP, DIAGNOSTICS_FULL)
+
+# Upsert modes: 'transactional' runs upsert_all_data() as one all-or-nothing statement,
+# 'parallel' commits overview first and then upserts the child tables concurrently,
+# 'chunked' commits upsert_all_data() per date range of UPSERT_BATCH_ROWS staged dates
+UPSERT_MODE_TRANSACTIONAL = 'transactional'
+UPSERT_MODE_PARALLEL = 'parallel'
+UPSERT_MODE_CHUNKED = 'chunked'
+UPSERT_MODES = (UPSERT_MODE_TRANSACTIONAL, UPSERT_MODE_PARALLEL, UPSERT_MODE_CHUNKED)
+DEFAULT_UPSERT_BATCH_ROWS = 10000
+
+# Reference checks: 'row' keeps the child tables' foreign keys during the upsert (one lookup
+# into overview per inserted row), 'bulk' drops them for the upsert and validates the loaded
+# rows with one VALIDATE CONSTRAINT per table afterwards - for large backfills. Orphan dates
+# are reported in bulk either way.
+REFERENCE_CHECKS_ROW = 'row'
+REFERENCE_CHECKS_BULK = 'bulk'
+REFERENCE_CHECKS = (REFERENCE_CHECKS_ROW, REFERENCE_CHECKS_BULK)
+
+# Post-load maintenance: 'auto' analyzes a main table once an upsert changed at least
+# MAINTENANCE_ANALYZE_FRACTION of its rows, and vacuums it as well once updates left
+# MAINTENANCE_VACUUM_FRACTION of dead row versions - well before autovacuum would
+# (10% and 20% by default). Loads under MAINTENANCE_MIN_ROWS rows are left to autovacuum.
+MAINTENANCE_AUTO = 'auto'
+MAINTENANCE_OFF = 'off'
+MAINTENANCE_MODES = (MAINTENANCE_AUTO, MAINTENANCE_OFF)
+MAINTENANCE_ANALYZE_FRACTION = float(os.environ.get('MAINTENANCE_ANALYZE_FRACTION', '0.02'))
+MAINTENANCE_VACUUM_FRACTION = float(os.environ.get('MAINTENANCE_VACUUM_FRACTION', '0.05'))
+MAINTENANCE_MIN_ROWS = int(os.environ.get('MAINTENANCE_MIN_ROWS', '1000'))
+# Maintenance only runs while the Lambda has more time left than this, and each statement
+# is cancelled (statement_timeout) before eating into it: the reserve covers the staging
+# cleanup (its detach waits up to STAGING_DETACH_LOCK_TIMEOUT) and returning the result
+MAINTENANCE_RESERVE_SECONDS = int(os.environ.get('MAINTENANCE_RESERVE_SECONDS', '45'))
+ACTION_ANALYZE = 'ANALYZE'
+ACTION_VACUUM = 'VACUUM'
+ACTION_VACUUM_ANALYZE = 'VACUUM (ANALYZE)'
+# SKIP_LOCKED skips a table another run is already vacuuming instead of queueing behind it
+MAINTENANCE_STATEMENTS = {
+    ACTION_ANALYZE: 'ANALYZE (SKIP_LOCKED)',
+    ACTION_VACUUM: 'VACUUM (SKIP_LOCKED)',
+    ACTION_VACUUM_ANALYZE: 'VACUUM (ANALYZE, SKIP_LOCKED)'
+}
+
+# Upsert functions and their corresponding tables, in the order upsert_all_data() runs them
+UPSERT_TABLES = [
+    {
+        'function': upsert_function_name(table),
+        'staging_table': staging_table_name(table),
+        'main_table': table['table_name'],
+        'parent': table['parent'],
+        'foreign_key': foreign_key_name(table) if table['parent'] else None
+    }
+    for table in TABLES
+]
+
+secrets_client = boto3.client('secretsmanager')
+_secret_cache = {'credentials': None, 'expires_at': 0.0}
+_connection_pool = None
+# Guards creating and resetting the pool, which the parallel mode's threads share
+_pool_lock = threading.Lock()
+
+
+def get_db_credentials(force_refresh=False):
+    """
+    Return database credentials from Secrets Manager, cached for SECRET_CACHE_TTL_SECONDS
+    """
+    if not force_refresh and _secret_cache['credentials'] and time.monotonic() < _secret_cache['expires_at']:
+        return _secret_cache['credentials']
+
+    # Get secret name from environment variable
+    secret_name = os.environ.get('SECRET_NAME')
+    if not secret_name:
+        raise ValueError("SECRET_NAME environment variable not set")
+
+    logger.info(f"🔑 Retrieving credentials from secret: {secret_name}")
+    secret_response = secrets_client.get_secret_value(SecretId=secret_name)
+    _secret_cache['credentials'] = json.loads(secret_response['SecretString'])
+    _secret_cache['expires_at'] = time.monotonic() + SECRET_CACHE_TTL_SECONDS
+    return _secret_cache['credentials']
+
+
+def get_connection_pool(force_refresh=False):
+    """
+    Return the module-level ThreadedConnectionPool, creating it on cold start or after a reset
+    """
+    with _pool_lock:
+        return _open_connection_pool(force_refresh)
+
+
+def _open_connection_pool(force_refresh):
+    global _connection_pool
+
+    if _connection_pool is not None and not force_refresh:
+        return _connection_pool
+
+    if _connection_pool is not None:
+        _connection_pool.closeall()
+        _connection_pool = None
+
+    db_credentials = get_db_credentials(force_refresh=force_refresh)
+    db_host = db_credentials['host']
+    db_port = db_credentials.get('port', 5432)
+    db_name = db_credentials['dbname']
+
+    logger.info(f"🔌 Connecting to database {db_name} at {db_host}:{db_port}")
+    _connection_pool = psycopg2.pool.ThreadedConnectionPool(
+        1,
+        POOL_MAX_CONNECTIONS,
+        host=db_host,
+        port=db_port,
+        database=db_name,
+        user=db_credentials['username'],
+        password=db_credentials['password'],
+        connect_timeout=30
+    )
+    return _connection_pool
+
+
+def is_connection_healthy(conn):
+    """
+    Cheap liveness probe for a pooled connection
+    """
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_connection(allow_reset=True):
+    """
+    Check out a healthy autocommit connection, reconnecting transparently when pooled ones went stale.
+
+    After a long idle every pooled connection may be stale, so they are probed and discarded
+    until a live one comes back; the pool opens fresh connections once the stale ones are gone.
+    Worker threads pass allow_reset=False, as resetting the pool closes every connection
+    checked out of it, including those their sibling threads are using.
+    """
+    try:
+        pool = get_connection_pool()
+    except psycopg2.OperationalError as e:
+        if not allow_reset:
+            raise
+        # Credentials may have been rotated - refresh the secret and retry once
+        logger.info(f"🔄 Connecting failed ({e}), refreshing credentials")
+        pool = get_connection_pool(force_refresh=True)
+
+    # Every idle connection may be stale, the one opened after them is fresh
+    for _ in range(POOL_MAX_CONNECTIONS + 1):
+        try:
+            conn = pool.getconn()
+        except psycopg2.OperationalError as e:
+            if not allow_reset:
+                raise
+            logger.info(f"🔄 Reconnecting failed ({e}), refreshing credentials")
+            pool = get_connection_pool(force_refresh=True)
+            conn = pool.getconn()
+        if not conn.closed:
+            conn.autocommit = True
+        if is_connection_healthy(conn):
+            return conn
+        logger.info("🔄 Pooled connection is stale, reconnecting")
+        pool.putconn(conn, close=True)
+
+    raise psycopg2.OperationalError("No live database connection after discarding the stale pooled ones")
+
+
+def release_connection(conn, broken=False):
+    """
+    Return a connection to the pool for the next warm invocation (closing it if it is broken)
+    """
+    if _connection_pool is not None:
+        _connection_pool.putconn(conn, close=broken or conn.closed)
+    else:
+        conn.close()
+
+def get_diagnostics_level(event):
+    """
+    Diagnostics level from the event ('diagnostics') or the UPSERT_DIAGNOSTICS environment variable
+    """
+    level = (event.get('diagnostics') or os.environ.get('UPSERT_DIAGNOSTICS', DIAGNOSTICS_CHEAP)).lower()
+    if level not in DIAGNOSTICS_LEVELS:
+        raise ValueError(f"Unknown diagnostics level '{level}', expected one of {', '.join(DIAGNOSTICS_LEVELS)}")
+    return level
+
+
+def capture_before_snapshot(cursor, staging_table, main_table, ingestion_id):
+    """
+    Full diagnostics: log staging/main counts and the first main row before an upsert.
+    Returns None when the staging table is missing or empty (there is nothing to compare afterwards).
+    """
+    # Check if staging table exists and has data
+    try:
+        cursor.execute(f"SELECT COUNT(*) FROM {staging_table} WHERE {INGESTION_ID_COLUMN} = %s", (ingestion_id,))
+        staging_count = cursor.fetchone()[0]
+        logger.info(f"📋 Staging table {staging_table} has {staging_count} rows")
+        
+        if staging_count == 0:
+            logger.info(f"⏭️ Skipping snapshot of {main_table} - no data in staging table")
+            return None
+    except Exception as e:
+        logger.info(f"⏭️ Skipping snapshot of {main_table} - staging table {staging_table} doesn't exist or error: {e}")
+        return None
+    
+    # Log BEFORE state of main table
+    cursor.execute(f"SELECT COUNT(*) FROM {main_table}")
+    before_count = cursor.fetchone()[0]
+    logger.info(f"📊 BEFORE: {main_table} has {before_count} rows")
+    
+    # Get column names for mapping row data
+    cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s ORDER BY ordinal_position", (main_table,))
+    columns = [row[0] for row in cursor.fetchall()]
+    
+    # Log first row of main table (if exists)
+    cursor.execute(f"SELECT * FROM {main_table} ORDER BY date LIMIT 1")
+    first_row_before = cursor.fetchone()
+    if first_row_before:
+        first_row_dict = dict(zip(columns, first_row_before))
+        logger.info(f"📝 BEFORE - First row of {main_table}: {first_row_dict}")
+    else:
+        logger.info(f"📝 BEFORE - {main_table} is empty")
+    
+    return {
+        'count': before_count,
+        'columns': columns,
+        'first_row': first_row_before
+    }
+
+
+def log_after_snapshot(cursor, staging_table, main_table, ingestion_id, before):
+    """
+    Full diagnostics: log main counts and the first main row after an upsert and compare with the snapshot
+    """
+    # Log AFTER state of main table
+    cursor.execute(f"SELECT COUNT(*) FROM {main_table}")
+    after_count = cursor.fetchone()[0]
+    logger.info(f"📊 AFTER: {main_table} has {after_count} rows (change: {after_count - before['count']:+d})")
+    
+    # Log first row of main table after upsert
+    cursor.execute(f"SELECT * FROM {main_table} ORDER BY date LIMIT 1")
+    first_row_after = cursor.fetchone()
+    if first_row_after:
+        first_row_dict_after = dict(zip(before['columns'], first_row_after))
+        logger.info(f"📝 AFTER - First row of {main_table}: {first_row_dict_after}")
+        
+        # Compare first row before and after
+        if before['first_row'] and first_row_after:
+            if before['first_row'] == first_row_after:
+                logger.info("🔄 First row unchanged (as expected for duplicate data)")
+            else:
+                logger.info("🔄 First row changed (data update detected)")
+    
+    # Verify staging table is empty after upsert (should be cleared by the function)
+    cursor.execute(f"SELECT COUNT(*) FROM {staging_table} WHERE {INGESTION_ID_COLUMN} = %s", (ingestion_id,))
+    staging_count_after = cursor.fetchone()[0]
+    logger.info(f"📋 Staging table {staging_table} after upsert: {staging_count_after} rows (should be 0)")
+
+
+def log_catalog_estimates(cursor, main_tables):
+    """
+    Cheap diagnostics: log planner row estimates of the main tables in a single catalog query
+    """
+    cursor.execute(
+        "SELECT relname, reltuples::BIGINT FROM pg_class WHERE relname = ANY(%s) AND relkind IN ('r', 'p')",
+        (list(main_tables),)
+    )
+    for relname, reltuples in sorted(cursor.fetchall()):
+        # reltuples is -1 until the table has been vacuumed or analyzed
+        estimate = f"~{reltuples} rows" if reltuples >= 0 else "not analyzed yet"
+        logger.info(f"📊 {relname}: {estimate} (catalog estimate)")
+
+
+def get_upsert_mode(event):
+    """
+    Upsert mode from the event ('mode') or the UPSERT_MODE environment variable
+    """
+    mode = (event.get('mode') or os.environ.get('UPSERT_MODE', UPSERT_MODE_TRANSACTIONAL)).lower()
+    if mode not in UPSERT_MODES:
+        raise ValueError(f"Unknown upsert mode '{mode}', expected one of {', '.join(UPSERT_MODES)}")
+    return mode
+
+
+def get_upsert_batch_rows(event):
+    """
+    Staged dates per chunked upsert batch from the event ('batch_rows') or the UPSERT_BATCH_ROWS environment variable
+    """
+    batch_rows = int(event.get('batch_rows') or os.environ.get('UPSERT_BATCH_ROWS', DEFAULT_UPSERT_BATCH_ROWS))
+    if batch_rows < 1:
+        raise ValueError(f"The upsert batch size must be positive, got {batch_rows}")
+    return batch_rows
+
+
+def get_reference_checks(event, mode):
+    """
+    Reference checks from the event ('reference_checks') or the UPSERT_REFERENCE_CHECKS environment variable
+    """
+    reference_checks = (event.get('reference_checks')
+                        or os.environ.get('UPSERT_REFERENCE_CHECKS', REFERENCE_CHECKS_ROW)).lower()
+    if reference_checks not in REFERENCE_CHECKS:
+        raise ValueError(f"Unknown reference checks '{reference_checks}', expected one of {', '.join(REFERENCE_CHECKS)}")
+    if reference_checks == REFERENCE_CHECKS_BULK and mode == UPSERT_MODE_PARALLEL:
+        # The child tables are upserted on separate connections, none of which may drop the foreign keys
+        raise ValueError(f"Bulk reference checks need the {UPSERT_MODE_TRANSACTIONAL} or {UPSERT_MODE_CHUNKED} mode")
+    return reference_checks
+
+
+def get_maintenance_mode(event):
+    """
+    Post-load maintenance from the event ('maintenance') or the UPSERT_MAINTENANCE environment variable
+    """
+    maintenance = (event.get('maintenance') or os.environ.get('UPSERT_MAINTENANCE', MAINTENANCE_AUTO)).lower()
+    if maintenance not in MAINTENANCE_MODES:
+        raise ValueError(f"Unknown maintenance '{maintenance}', expected one of {', '.join(MAINTENANCE_MODES)}")
+    return maintenance
+
+
+def staging_partition_name(cursor, staging_table, ingestion_id):
+    """
+    Name of the staging partition holding one ingestion run's rows
+    """
+    if ingestion_id == SHARED_INGESTION_ID:
+        return f"{staging_table}_{SHARED_INGESTION_ID}"
+    cursor.execute("SELECT run_staging_partition_name(%s, %s)", (staging_table, ingestion_id))
+    return cursor.fetchone()[0]
+
+
+def run_table_upsert(cursor, upsert_config, ingestion_id):
+    """
+    Call one per-table upsert function for an ingestion run and return its counts
+    """
+    start = time.perf_counter()
+    cursor.execute(f"SELECT inserted, updated, unchanged FROM {upsert_config['function']}(%s)", (ingestion_id,))
+    inserted, updated, unchanged = cursor.fetchone()
+    logger.info(f"⏱️ {upsert_config['function']}() took {time.perf_counter() - start:.2f}s")
+    return {
+        'inserted': inserted,
+        'updated': updated,
+        'unchanged': unchanged
+    }
+
+
+def run_pooled_table_upsert(upsert_config, ingestion_id):
+    """
+    Run one per-table upsert function on its own pooled connection
+    """
+    conn = get_connection(allow_reset=False)
+    try:
+        with conn.cursor() as cursor:
+            counts = run_table_upsert(cursor, upsert_config, ingestion_id)
+    except Exception:
+        release_connection(conn, broken=True)
+        raise
+    release_connection(conn)
+    return counts
+
+
+def upsert_transactional(cursor, ingestion_id, bulk_references=False):
+    """
+    Upsert every table with a single upsert_all_data() call
+    """
+    # One statement upserts every table, so a failure anywhere rolls all of them back
+    # and a Step Functions retry starts from the same state
+    logger.info("🔄 Calling stored function: upsert_all_data()")
+    cursor.execute("SELECT upsert_all_data(%s, p_bulk_references => %s)", (ingestion_id, bulk_references))
+    return cursor.fetchone()[0]
+
+
+def plan_upsert_batches(cursor, ingestion_id, batch_rows):
+    """
+    Split the dates staged by a run (in any table) into consecutive ranges of at most
+    batch_rows dates; returns (first date, last date, date count) per batch
+    """
+    staged_dates = " UNION ".join(
+        f"SELECT date FROM {upsert_config['staging_table']} WHERE {INGESTION_ID_COLUMN} = %s"
+        for upsert_config in UPSERT_TABLES
+    )
+    cursor.execute(f"""
+        SELECT min(date), max(date), count(*)
+        FROM (
+            SELECT date, (row_number() OVER (ORDER BY date) - 1) / %s AS batch
+            FROM ({staged_dates}) AS staged_dates
+        ) AS numbered_dates
+        GROUP BY batch
+        ORDER BY batch
+    """, [batch_rows] + [ingestion_id] * len(UPSERT_TABLES))
+    return cursor.fetchall()
+
+
+def upsert_chunked(cursor, ingestion_id, batch_rows, bulk_references=False):
+    """
+    Upsert a run's staged rows in consecutive date ranges, committing every batch.
+
+    Each batch is one upsert_all_data() call over its date range, so row locks and the
+    advisory locks are only held for one batch and the standby replays small transactions
+    instead of one huge one. Committed batches are removed from staging, so a retry
+    resumes with the batches that are left.
+
+    With bulk reference checks the foreign keys are dropped once before the first batch
+    and restored after the last one (also when a batch fails), rather than per batch:
+    every drop locks the tables ACCESS EXCLUSIVE, and restoring them on partitioned
+    tables validates the whole child tables. If the Lambda is killed in between, the
+    next invocation restores them (restore_abandoned_reference_keys).
+    """
+    batches = plan_upsert_batches(cursor, ingestion_id, batch_rows)
+    total_dates = sum(date_count for _, _, date_count in batches)
+    logger.info(f"📦 Upserting {total_dates} staged dates in {len(batches)} batches of up to {batch_rows}")
+    
+    if len(batches) > 1 and ingestion_id != SHARED_INGESTION_ID:
+        # Every batch reads and deletes one date range of the run's partitions; the index
+        # is dropped with them. The shared partitions are kept, so they go without.
+        for upsert_config in UPSERT_TABLES:
+            partition_name = staging_partition_name(cursor, upsert_config['staging_table'], ingestion_id)
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS "{partition_name}_date_idx" ON "{partition_name}" (date)')
+    
+    all_counts = {
+        upsert_config['main_table']: {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        for upsert_config in UPSERT_TABLES
+    }
+    if bulk_references:
+        cursor.execute("SELECT drop_reference_keys()")
+        logger.info("🔗 Dropped the foreign keys for the batches")
+    
+    start = time.perf_counter()
+    done_dates = 0
+    try:
+        for batch_number, (first_date, last_date, date_count) in enumerate(batches, start=1):
+            batch_start = time.perf_counter()
+            cursor.execute("SELECT upsert_all_data(%s, %s, %s)", (ingestion_id, first_date, last_date))
+            for main_table, counts in cursor.fetchone()[0].items():
+                for key in all_counts[main_table]:
+                    all_counts[main_table][key] += counts[key]
+            
+            done_dates += date_count
+            elapsed = time.perf_counter() - start
+            remaining = elapsed / done_dates * (total_dates - done_dates)
+            logger.info(f"📦 Batch {batch_number}/{len(batches)} ({first_date} to {last_date}) committed in "
+                        f"{time.perf_counter() - batch_start:.2f}s - {done_dates}/{total_dates} dates, ~{remaining:.0f}s left")
+    finally:
+        if bulk_references:
+            restore_start = time.perf_counter()
+            cursor.execute("SELECT restore_reference_keys()")
+            logger.info(f"🔗 Restored the foreign keys in {time.perf_counter() - restore_start:.2f}s")
+    return all_counts
+
+
+def upsert_parallel(cursor, ingestion_id):
+    """
+    Upsert overview first, then the child tables concurrently on separate pooled connections.
+
+    The children only depend on overview through their date foreign keys, so once it has
+    committed they can run side by side. Every child upsert is awaited; any failure fails
+    the run (tables that did succeed stay committed and are unchanged on a retry).
+    """
+    parent_configs = [upsert_config for upsert_config in UPSERT_TABLES if not upsert_config['parent']]
+    child_configs = [upsert_config for upsert_config in UPSERT_TABLES if upsert_config['parent']]
+    
+    # The per-table functions don't check the staged rows up front, upsert_all_data() does
+    cursor.execute("SELECT check_staged_references(%s)", (ingestion_id,))
+    
+    all_counts = {}
+    for parent_config in parent_configs:
+        logger.info(f"🔄 Calling stored function: {parent_config['function']}()")
+        all_counts[parent_config['main_table']] = run_table_upsert(cursor, parent_config, ingestion_id)
+    
+    logger.info(f"⚡ Upserting {len(child_configs)} child tables concurrently")
+    failures = {}
+    with ThreadPoolExecutor(max_workers=len(child_configs)) as executor:
+        futures = {
+            executor.submit(run_pooled_table_upsert, upsert_config, ingestion_id): upsert_config['main_table']
+            for upsert_config in child_configs
+        }
+        for future in as_completed(futures):
+            main_table = futures[future]
+            try:
+                all_counts[main_table] = future.result()
+            except Exception as e:
+                logger.error(f"❌ Upserting {main_table} failed: {e}")
+                failures[main_table] = e
+
+    # The per-table functions only queue the dates they changed, upsert_all_data() refreshes
+    start = time.perf_counter()
+    cursor.execute("SELECT refresh_reporting_tables()")
+    logger.info(f"📈 Refreshed reporting tables for {cursor.fetchone()[0]} changed dates "
+                f"in {time.perf_counter() - start:.2f}s")
+
+    if failures:
+        first_failure = next(iter(failures.values()))
+        raise RuntimeError(f"Upserts failed for: {', '.join(failures)} (succeeded: {', '.join(all_counts)})") from first_failure
+    return all_counts
+
+
+def restore_abandoned_reference_keys(cursor):
+    """
+    Restore the foreign keys if a chunked bulk load was killed (e.g. by the Lambda timeout)
+    after committing their drop, before its own restore ran
+    """
+    cursor.execute("SELECT restore_abandoned_reference_keys()")
+    if cursor.fetchone()[0]:
+        logger.warning("⚠️ Restored the foreign keys an interrupted bulk load left dropped")
+
+
+def validate_references(cursor):
+    """
+    Validate the foreign keys a bulk upsert added back NOT VALID.
+
+    One set-based check per child table under a SHARE UPDATE EXCLUSIVE lock, so dashboards
+    and other runs keep reading and writing meanwhile; already valid keys are skipped.
+    """
+    for upsert_config in UPSERT_TABLES:
+        if not upsert_config['foreign_key']:
+            continue
+        start = time.perf_counter()
+        cursor.execute(f"ALTER TABLE {upsert_config['main_table']} VALIDATE CONSTRAINT {upsert_config['foreign_key']}")
+        logger.info(f"🔗 Validated {upsert_config['foreign_key']} in {time.perf_counter() - start:.2f}s")
+
+
+def staged_date_ranges(cursor, ingestion_id):
+    """
+    First and last staged date of a run per partitioned main table, read before the upsert
+    empties staging, so maintenance can target the partitions the run wrote to
+    """
+    cursor.execute(
+        "SELECT relname FROM pg_class WHERE relname = ANY(%s) AND relkind = 'p'",
+        ([upsert_config['main_table'] for upsert_config in UPSERT_TABLES],)
+    )
+    partitioned = {row[0] for row in cursor.fetchall()}
+
+    date_ranges = {}
+    for upsert_config in UPSERT_TABLES:
+        if upsert_config['main_table'] not in partitioned:
+            continue
+        cursor.execute(
+            f"SELECT min(date), max(date) FROM {upsert_config['staging_table']} WHERE {INGESTION_ID_COLUMN} = %s",
+            (ingestion_id,)
+        )
+        first_date, last_date = cursor.fetchone()
+        if first_date is not None:
+            date_ranges[upsert_config['main_table']] = (first_date, last_date)
+    return date_ranges
+
+
+def maintenance_targets(cursor, main_table, date_range):
+    """
+    The tables to maintain for a main table with their estimated rows: the partitions
+    covering the staged dates of a partitioned table, otherwise the table itself.
+    reltuples still holds the estimate from before the load, -1 if never analyzed.
+    """
+    if date_range:
+        cursor.execute(
+            "SELECT partition.relname, partition.reltuples::BIGINT "
+            "FROM pg_inherits "
+            "JOIN pg_class AS partition ON partition.oid = pg_inherits.inhrelid, "
+            "LATERAL date_partition_bounds(partition.oid) AS bounds "
+            "WHERE pg_inherits.inhparent = %s::regclass "
+            "AND bounds.lower_bound <= %s AND bounds.upper_bound > %s "
+            "ORDER BY partition.relname",
+            (main_table, date_range[1], date_range[0])
+        )
+    else:
+        cursor.execute("SELECT relname, reltuples::BIGINT FROM pg_class WHERE relname = %s AND relkind = 'r'",
+                       (main_table,))
+    return [(relname, max(reltuples, 0)) for relname, reltuples in cursor.fetchall()]
+
+
+def plan_maintenance(cursor, table_counts, ingestion_id, date_ranges=None):
+    """
+    Decide per table from the upsert counts what to run; returns (table, action, rows changed, estimated rows)
+
+    Updates leave dead row versions behind, inserts only make the statistics stale. On a
+    partitioned main table only the partitions covering the run's staged dates
+    (date_ranges) are maintained, measured against their own row estimates, instead of
+    every partition through the parent. The shared staging partitions are logged tables
+    emptied by DELETE, so they are vacuumed after a manual run; a run's own partitions
+    are dropped instead.
+    """
+    date_ranges = date_ranges or {}
+    actions = []
+    for upsert_config in UPSERT_TABLES:
+        main_table = upsert_config['main_table']
+        counts = table_counts.get(main_table)
+        if not counts:
+            continue
+        changed = counts['inserted'] + counts['updated']
+        if changed >= MAINTENANCE_MIN_ROWS:
+            targets = maintenance_targets(cursor, main_table, date_ranges.get(main_table))
+            rows_before = sum(table_rows for _, table_rows in targets)
+            action = None
+            if counts['updated'] >= max(MAINTENANCE_MIN_ROWS, MAINTENANCE_VACUUM_FRACTION * rows_before):
+                action = ACTION_VACUUM_ANALYZE
+            elif changed >= MAINTENANCE_ANALYZE_FRACTION * rows_before:
+                action = ACTION_ANALYZE
+            if action:
+                actions.extend((table_name, action, changed, table_rows) for table_name, table_rows in targets)
+
+        staged = changed + counts['unchanged']
+        if ingestion_id == SHARED_INGESTION_ID and staged >= MAINTENANCE_MIN_ROWS:
+            shared_partition = staging_partition_name(cursor, upsert_config['staging_table'], ingestion_id)
+            actions.append((shared_partition, ACTION_VACUUM, staged, None))
+    return actions
+
+
+def run_maintenance(cursor, table_counts, ingestion_id, date_ranges=None, context=None):
+    """
+    Run the planned ANALYZE / VACUUM (ANALYZE) statements and record them in maintenance_log.
+
+    Needs the autocommit connection, VACUUM cannot run in a transaction block. Best effort
+    like the staging cleanup: the upsert has committed, so failures are only logged. With
+    the Lambda context every statement is bounded by the time left minus
+    MAINTENANCE_RESERVE_SECONDS, so a long VACUUM is cancelled (or skipped) rather than
+    timing out the Lambda and failing a load that succeeded; autovacuum catches up later.
+    """
+    performed = []
+    try:
+        for table_name, action, rows_changed, table_rows in plan_maintenance(cursor, table_counts, ingestion_id, date_ranges):
+            if context is not None:
+                budget_ms = context.get_remaining_time_in_millis() - MAINTENANCE_RESERVE_SECONDS * 1000
+                if budget_ms <= 0:
+                    logger.warning(f"⚠️ Skipping {action} of {table_name} and the rest, "
+                                   f"less than {MAINTENANCE_RESERVE_SECONDS}s left - leaving them to autovacuum")
+                    break
+                cursor.execute(f"SET statement_timeout = {budget_ms}")
+            
+            start = time.perf_counter()
+            try:
+                cursor.execute(f'{MAINTENANCE_STATEMENTS[action]} "{table_name}"')
+            except psycopg2.errors.QueryCanceled:
+                logger.warning(f"⚠️ {action} of {table_name} cancelled after {time.perf_counter() - start:.2f}s "
+                               f"to stay within the Lambda timeout - leaving the rest to autovacuum")
+                break
+            except psycopg2.Error as e:
+                logger.warning(f"⚠️ {action} of {table_name} failed: {e}")
+                continue
+            seconds = time.perf_counter() - start
+            logger.info(f"🧽 {action} {table_name} ({rows_changed} rows changed) took {seconds:.2f}s")
+            performed.append({'table': table_name, 'action': action, 'seconds': round(seconds, 3)})
+            
+            try:
+                cursor.execute(
+                    "INSERT INTO maintenance_log (ingestion_id, table_name, action, rows_changed, table_rows, seconds) "
+                    "VALUES (%s, %s, %s, %s, %s, %s)",
+                    (ingestion_id, table_name, action, rows_changed, table_rows, seconds)
+                )
+            except psycopg2.Error as e:
+                logger.warning(f"⚠️ Could not record {action} of {table_name}: {e}")
+    finally:
+        if context is not None:
+            cursor.execute("RESET statement_timeout")
+    return performed
+
+
+def drop_run_staging(cursor, ingestion_id):
+    """
+    Detach and drop the staging partitions of one ingestion run and forget the run.
+
+    DETACH ... CONCURRENTLY only takes a SHARE UPDATE EXCLUSIVE lock, so runs still writing
+    to their own partitions are not blocked. It cannot run inside a transaction block,
+    which is why this needs the autocommit connection. A detach interrupted half-way
+    leaves the partition pending, which FINALIZE completes.
+    """
+    for upsert_config in UPSERT_TABLES:
+        staging_table = upsert_config['staging_table']
+        partition_name = staging_partition_name(cursor, staging_table, ingestion_id)
+        cursor.execute("SELECT inhdetachpending FROM pg_inherits WHERE inhrelid = to_regclass(%s)", (partition_name,))
+        attached = cursor.fetchone()
+        if attached:
+            detach = "FINALIZE" if attached[0] else "CONCURRENTLY"
+            cursor.execute(f'ALTER TABLE {staging_table} DETACH PARTITION "{partition_name}" {detach}')
+        cursor.execute(f'DROP TABLE IF EXISTS "{partition_name}"')
+    cursor.execute("DELETE FROM staging_run WHERE ingestion_id = %s", (ingestion_id,))
+
+
+def finalize_pending_detaches(cursor):
+    """
+    Complete staging detaches an earlier cleanup left pending (its DETACH ... CONCURRENTLY
+    timed out or was killed half-way). A table can only have one pending detach, so until
+    it is finalized every other run's partitions would fail to detach.
+    """
+    cursor.execute(
+        "SELECT inhparent::regclass::text, inhrelid::regclass::text FROM pg_inherits "
+        "WHERE inhdetachpending AND inhparent = ANY(%s::regclass[])",
+        ([upsert_config['staging_table'] for upsert_config in UPSERT_TABLES],)
+    )
+    for staging_table, partition_name in cursor.fetchall():
+        cursor.execute(f"ALTER TABLE {staging_table} DETACH PARTITION {partition_name} FINALIZE")
+        logger.info(f"🧹 Finalized the pending detach of {partition_name}")
+
+
+def cleanup_run_staging(cursor, ingestion_id):
+    """
+    Drop the finished run's staging partitions, those left over by other finished runs
+    and those of runs that never finished.
+
+    Best effort: the upsert has already committed, so a failed cleanup is only logged and
+    the partitions are picked up by the next run. The detach waits for loads still running
+    in other runs; once it times out the rest would wait for the same loads, so it stops.
+    Detaches left pending by an earlier cleanup are finalized first.
+    """
+    if ingestion_id != SHARED_INGESTION_ID:
+        cursor.execute("UPDATE staging_run SET finished_at = now() WHERE ingestion_id = %s", (ingestion_id,))
+    cursor.execute(
+        "SELECT ingestion_id FROM staging_run WHERE ingestion_id <> %s "
+        "AND (finished_at IS NOT NULL OR prepared_at < now() - make_interval(hours => %s)) ORDER BY prepared_at",
+        (ingestion_id, STAGING_RUN_RETENTION_HOURS)
+    )
+    leftover_runs = [row[0] for row in cursor.fetchall()]
+    runs = ([ingestion_id] if ingestion_id != SHARED_INGESTION_ID else []) + leftover_runs
+
+    cursor.execute(f"SET lock_timeout = '{STAGING_DETACH_LOCK_TIMEOUT}'")
+    try:
+        try:
+            finalize_pending_detaches(cursor)
+        except psycopg2.errors.LockNotAvailable:
+            logger.warning("⚠️ Finalizing a pending staging detach timed out, leaving the cleanup for the next run")
+            return
+        except psycopg2.Error as e:
+            logger.warning(f"⚠️ Could not finalize pending staging detaches: {e}")
+        
+        for run in runs:
+            start = time.perf_counter()
+            try:
+                drop_run_staging(cursor, run)
+                label = "leftover run" if run in leftover_runs else "run"
+                logger.info(f"🧹 Dropped staging partitions of {label} {run} in {time.perf_counter() - start:.2f}s")
+            except psycopg2.errors.LockNotAvailable:
+                logger.warning(f"⚠️ Dropping staging partitions of run {run} timed out, leaving the rest for the next run")
+                break
+            except psycopg2.Error as e:
+                logger.warning(f"⚠️ Could not drop staging partitions of run {run}: {e}")
+    finally:
+        cursor.execute("RESET lock_timeout")
+
+
 def lambda_handler(event, context):
     """
     Lambda function to perform upsert operations from staging tables to main tables
-    and provide detailed logging for debugging
+    (set diagnostics to 'full' for detailed before/after logging when debugging)
     """
+    conn = None
     try:
-        logger.info("🚀 Starting database upsert operations...")
-        
-        # Get database credentials from Secrets Manager
-        secrets_client = boto3.client('secretsmanager')
-        
-        # Get secret name from environment variable
-        secret_name = os.environ.get('SECRET_NAME')
-        if not secret_name:
-            raise ValueError("SECRET_NAME environment variable not set")
-        
-        logger.info(f"🔑 Retrieving credentials from secret: {secret_name}")
-        secret_response = secrets_client.get_secret_value(SecretId=secret_name)
-        db_credentials = json.loads(secret_response['SecretString'])
-        
-        # Extract connection parameters
-        db_host = db_credentials['host']
-        db_port = db_credentials.get('port', 5432)
-        db_name = db_credentials['dbname']
-        db_user = db_credentials['username']
-        db_password = db_credentials['password']
-        
-        logger.info(f"🔌 Connecting to database {db_name} at {db_host}:{db_port}")
-        
-        # Connect to PostgreSQL
-        conn = psycopg2.connect(
-            host=db_host,
-            port=db_port,
-            database=db_name,
-            user=db_user,
-            password=db_password,
-            connect_timeout=30
-        )
-        conn.autocommit = True
+        diagnostics = get_diagnostics_level(event)
+        mode = get_upsert_mode(event)
+        reference_checks = get_reference_checks(event, mode)
+        maintenance = get_maintenance_mode(event)
+        bulk_references = reference_checks == REFERENCE_CHECKS_BULK
+        # The state machine passes its execution name; manual runs upsert the shared staging rows
+        ingestion_id = event.get('ingestion_id') or SHARED_INGESTION_ID
+        logger.info(f"🚀 Starting database upsert operations (ingestion: {ingestion_id}, mode: {mode}, "
+                    f"reference checks: {reference_checks}, diagnostics: {diagnostics})...")
+        
+        # Warm invocations reuse the cached secret and pooled connection
+        conn = get_connection()
         
         logger.info("✅ Database connection successful")
         
         cursor = conn.cursor()
         
-        # Define upsert functions and their corresponding tables
-        upsert_functions = [
-            {
-                'function': 'upsert_overview_data',
-                'staging_table': 'overview_staging',
-                'main_table': 'overview'
-            },
-            {
-                'function': 'upsert_fleet_data', 
-                'staging_table': 'fleet_staging',
-                'main_table': 'fleet'
-            },
-            {
-                'function': 'upsert_washing_machines_data',
-                'staging_table': 'washing_machines_staging', 
-                'main_table': 'washing_machines'
-            },
-            {
-                'function': 'upsert_drying_data',
-                'staging_table': 'drying_staging', 
-                'main_table': 'drying'
-            }
-        ]
+        restore_abandoned_reference_keys(cursor)
         
         total_rows_processed = 0
+        table_counts = {}
+        
+        before = {}
+        if diagnostics == DIAGNOSTICS_FULL:
+            for upsert_config in UPSERT_TABLES:
+                logger.info(f"\n📊 Snapshot of table: {upsert_config['main_table']}")
+                before[upsert_config['main_table']] = capture_before_snapshot(
+                    cursor, upsert_config['staging_table'], upsert_config['main_table'], ingestion_id)
+
+        date_ranges = {}
+        if maintenance == MAINTENANCE_AUTO:
+            date_ranges = staged_date_ranges(cursor, ingestion_id)
+
+        if mode == UPSERT_MODE_PARALLEL:
+            all_counts = upsert_parallel(cursor, ingestion_id)
+        elif mode == UPSERT_MODE_CHUNKED:
+            all_counts = upsert_chunked(cursor, ingestion_id, get_upsert_batch_rows(event), bulk_references)
+        else:
+            all_counts = upsert_transactional(cursor, ingestion_id, bulk_references)
+        
+        if bulk_references:
+            validate_references(cursor)
         
-        # Process each upsert function
-        for upsert_config in upsert_functions:
-            function_name = upsert_config['function']
+        for upsert_config in UPSERT_TABLES:
             staging_table = upsert_config['staging_table']
             main_table = upsert_config['main_table']
+            counts = all_counts[main_table]
+            inserted, updated, unchanged = counts['inserted'], counts['updated'], counts['unchanged']
+            rows_affected = inserted + updated
             
-            logger.info(f"\n📊 Processing table: {main_table}")
-            
-            # Check if staging table exists and has data
-            try:
-                cursor.execute(f"SELECT COUNT(*) FROM {staging_table}")
-                staging_count = cursor.fetchone()[0]
-                logger.info(f"📋 Staging table {staging_table} has {staging_count} rows")
-                
-                if staging_count == 0:
-                    logger.info(f"⏭️ Skipping {main_table} - no data in staging table")
-                    continue
-            except Exception as e:
-                logger.info(f"⏭️ Skipping {main_table} - staging table {staging_table} doesn't exist or error: {e}")
+            # An empty staging table comes back as all zeros
+            if rows_affected + unchanged == 0:
+                logger.info(f"⏭️ Skipping {main_table} - no data in staging table")
                 continue
             
-            # Log BEFORE state of main table
-            cursor.execute(f"SELECT COUNT(*) FROM {main_table}")
-            before_count = cursor.fetchone()[0]
-            logger.info(f"📊 BEFORE: {main_table} has {before_count} rows")
-            
-            # Get column names for mapping row data
-            cursor.execute(f"SELECT column_name FROM information_schema.columns WHERE table_name = '{main_table}' ORDER BY ordinal_position")
-            columns = [row[0] for row in cursor.fetchall()]
-            
-            # Log first row of main table (if exists)
-            cursor.execute(f"SELECT * FROM {main_table} ORDER BY date LIMIT 1")
-            first_row_before = cursor.fetchone()
-            if first_row_before:
-                first_row_dict = dict(zip(columns, first_row_before))
-                logger.info(f"📝 BEFORE - First row of {main_table}: {first_row_dict}")
-            else:
-                logger.info(f"📝 BEFORE - {main_table} is empty")
-            
-            # Call the stored upsert function
-            logger.info(f"🔄 Calling stored function: {function_name}()")
-            cursor.execute(f"SELECT {function_name}()")
-            rows_affected = cursor.fetchone()[0]
-            
             total_rows_processed += rows_affected
-            logger.info(f"✅ Upserted {rows_affected} rows for {main_table}")
-            
-            # Log AFTER state of main table
-            cursor.execute(f"SELECT COUNT(*) FROM {main_table}")
-            after_count = cursor.fetchone()[0]
-            logger.info(f"📊 AFTER: {main_table} has {after_count} rows (change: {after_count - before_count:+d})")
-            
-            # Log first row of main table after upsert
-            cursor.execute(f"SELECT * FROM {main_table} ORDER BY date LIMIT 1")
-            first_row_after = cursor.fetchone()
-            if first_row_after:
-                first_row_dict_after = dict(zip(columns, first_row_after))
-                logger.info(f"📝 AFTER - First row of {main_table}: {first_row_dict_after}")
-                
-                # Compare first row before and after
-                if first_row_before and first_row_after:
-                    if first_row_before == first_row_after:
-                        logger.info("🔄 First row unchanged (as expected for duplicate data)")
-                    else:
-                        logger.info("🔄 First row changed (data update detected)")
+            table_counts[main_table] = {
+                'inserted': inserted,
+                'updated': updated,
+                'unchanged': unchanged
+            }
+            logger.info(f"✅ {main_table}: {inserted} inserted, {updated} updated, {unchanged} unchanged")
             
-            # Verify staging table is empty after upsert (should be cleared by the function)
-            cursor.execute(f"SELECT COUNT(*) FROM {staging_table}")
-            staging_count_after = cursor.fetchone()[0]
-            logger.info(f"📋 Staging table {staging_table} after upsert: {staging_count_after} rows (should be 0)")
+            if before.get(main_table):
+                log_after_snapshot(cursor, staging_table, main_table, ingestion_id, before[main_table])
+        
+        maintenance_actions = []
+        if maintenance == MAINTENANCE_AUTO:
+            maintenance_actions = run_maintenance(cursor, table_counts, ingestion_id, date_ranges, context)
+        
+        if diagnostics == DIAGNOSTICS_CHEAP:
+            log_catalog_estimates(cursor, [config['main_table'] for config in UPSERT_TABLES])
+        
+        cleanup_run_staging(cursor, ingestion_id)
         
         cursor.close()
-        conn.close()
+        # Keep the connection open for the next warm invocation
+        release_connection(conn)
+        conn = None
         
         result = {
             'statusCode': 200,
             'body': {
                 'message': 'Database upsert operations completed successfully',
                 'total_rows_processed': total_rows_processed,
-                'tables_processed': [config['main_table'] for config in upsert_functions]
+                'tables_processed': [config['main_table'] for config in UPSERT_TABLES],
+                'table_counts': table_counts,
+                'ingestion_id': ingestion_id,
+                'mode': mode,
+                'reference_checks': reference_checks,
+                'maintenance': maintenance_actions,
+                'diagnostics': diagnostics
             }
         }
         
@@ -166,6 +874,9 @@ def lambda_handler(event, context):
         
     except Exception as e:
         logger.error(f"❌ Upsert operations failed: {str(e)}")
+        if conn is not None:
+            # Don't hand a connection in an unknown state to the next invocation
+            release_connection(conn, broken=True)
         # Re-raise the exception to make Step Functions fail properly
         raise RuntimeError(f"Database upsert operations failed: {str(e)}")
 
@@ -79,6 +79,9 @@ module "step_functions" {
   aws_region   = var.aws_region
   glue_job_name = module.compute.glue_job_name
   upsert_lambda_arn = module.compute.upsert_lambda_arn
+  ingestion_manifest_lambda_arn = module.compute.ingestion_manifest_lambda_arn
+  route_ingestion_lambda_arn = module.compute.route_ingestion_lambda_arn
+  lite_ingest_lambda_arn = module.compute.lite_ingest_lambda_arn
 
   depends_on = [ module.compute ]
 }
@@ -106,6 +106,30 @@ resource "aws_s3_object" "glue_script" {
   acl    = "private"
 }
 
+resource "aws_s3_object" "glue_copy_loader" {
+  bucket = var.scripts_bucket
+  key    = "glue/copy_loader.py"
+  source = "${path.module}/../../../src/glue/copy_loader.py"
+  etag   = filemd5("${path.module}/../../../src/glue/copy_loader.py")
+  acl    = "private"
+}
+
+resource "aws_s3_object" "glue_workbook" {
+  bucket = var.scripts_bucket
+  key    = "glue/workbook.py"
+  source = "${path.module}/../../../src/glue/workbook.py"
+  etag   = filemd5("${path.module}/../../../src/glue/workbook.py")
+  acl    = "private"
+}
+
+resource "aws_s3_object" "glue_table_registry" {
+  bucket = var.scripts_bucket
+  key    = "glue/table_registry.py"
+  source = "${path.module}/../../../src/glue/table_registry.py"
+  etag   = filemd5("${path.module}/../../../src/glue/table_registry.py")
+  acl    = "private"
+}
+
 resource "aws_iam_role" "glue_job_role" {
   name = "${var.project_name}-glue-role"
   assume_role_policy = jsonencode({
@@ -226,7 +250,25 @@ resource "aws_glue_job" "data_processing_job" {
     "--enable-continuous-cloudwatch-log" = "true"
     "--job-language"                    = "python"
     "--enable-auto-scaling"               = "true"
-    "--extra-py-files"                   = join(",", [for file in local.wheel_files : "s3://${var.scripts_bucket}/glue/wheels/${file}"])
+    "--extra-py-files"                   = join(",", concat(
+      [for file in local.wheel_files : "s3://${var.scripts_bucket}/glue/wheels/${file}"],
+      [
+        "s3://${var.scripts_bucket}/${aws_s3_object.glue_workbook.key}",
+        "s3://${var.scripts_bucket}/${aws_s3_object.glue_copy_loader.key}",
+        "s3://${var.scripts_bucket}/${aws_s3_object.glue_table_registry.key}"
+      ]
+    ))
+    "--reader_mode"                      = var.glue_reader_mode
+    "--chunk_rows"                       = tostring(var.glue_chunk_rows)
+    "--ingestion_mode"                   = var.glue_ingestion_mode
+    "--materialize_mode"                 = var.glue_materialize_mode
+    "--write_mode"                       = var.glue_write_mode
+    "--write_parallelism"                = tostring(var.glue_write_parallelism)
+    "--staging_loader"                   = var.glue_staging_loader
+    "--copy_format"                      = var.glue_copy_format
+    # Same psycopg2 build as the Lambda layer (src/lambda/layers/requirements.txt), installed for
+    # Glue's Python: every run prepares its staging partitions over it, whatever the staging loader
+    "--additional-python-modules"        = "psycopg2-binary==2.9.10"
   }
 
   number_of_workers = var.glue_max_capacity
@@ -242,6 +284,9 @@ resource "aws_glue_job" "data_processing_job" {
 
   depends_on = [
     aws_s3_object.glue_script,
+    aws_s3_object.glue_workbook,
+    aws_s3_object.glue_copy_loader,
+    aws_s3_object.glue_table_registry,
     aws_s3_object.wheel_files
   ]
 }
@@ -264,8 +309,17 @@ resource "aws_lambda_layer_version" "psycopg2_layer" {
 # Package Lambda function
 data "archive_file" "deploy_schema_lambda" {
   type        = "zip"
-  source_file = "${path.module}/../../../src/lambda/deploy_schema.py"
   output_path = "${path.module}/../../../src/lambda/deploy_schema.zip"
+
+  source {
+    content  = file("${path.module}/../../../src/lambda/deploy_schema.py")
+    filename = "deploy_schema.py"
+  }
+
+  source {
+    content  = file("${path.module}/../../../src/glue/table_registry.py")
+    filename = "table_registry.py"
+  }
 }
 
 # IAM role for Lambda
@@ -352,7 +406,9 @@ resource "aws_lambda_function" "deploy_schema" {
   
   environment {
     variables = {
-      SECRET_NAME = var.db_secret_name
+      SECRET_NAME             = var.db_secret_name
+      UPSERT_ENGINE           = var.upsert_engine
+      MAIN_TABLE_PARTITIONING = var.main_table_partitioning
     }
   }
   
@@ -374,8 +430,17 @@ resource "aws_cloudwatch_log_group" "deploy_schema_logs" {
 # Package Upsert Lambda function
 data "archive_file" "upsert_lambda" {
   type        = "zip"
-  source_file = "${path.module}/../../../src/lambda/upsert_data.py"
   output_path = "${path.module}/../../../src/lambda/upsert_data.zip"
+
+  source {
+    content  = file("${path.module}/../../../src/lambda/upsert_data.py")
+    filename = "upsert_data.py"
+  }
+
+  source {
+    content  = file("${path.module}/../../../src/glue/table_registry.py")
+    filename = "table_registry.py"
+  }
 }
 
 # IAM role for Upsert Lambda
@@ -462,7 +527,14 @@ resource "aws_lambda_function" "upsert_data" {
   
   environment {
     variables = {
-      SECRET_NAME = var.db_secret_name
+      SECRET_NAME                 = var.db_secret_name
+      SECRET_CACHE_TTL_SECONDS    = var.upsert_secret_cache_ttl_seconds
+      UPSERT_DIAGNOSTICS          = var.upsert_diagnostics
+      UPSERT_MODE                 = var.upsert_mode
+      UPSERT_BATCH_ROWS           = var.upsert_batch_rows
+      UPSERT_REFERENCE_CHECKS     = var.upsert_reference_checks
+      UPSERT_MAINTENANCE          = var.upsert_maintenance
+      STAGING_RUN_RETENTION_HOURS = var.staging_run_retention_hours
     }
   }
   
@@ -475,4 +547,351 @@ resource "aws_lambda_function" "upsert_data" {
 resource "aws_cloudwatch_log_group" "upsert_data_logs" {
   name              = "/aws/lambda/${aws_lambda_function.upsert_data.function_name}"
   retention_in_days = 14
-}
\ No newline at end of file
+}
+# =============================================================================
+# INGESTION MANIFEST LAMBDA FUNCTION
+# =============================================================================
+
+# Package Ingestion Manifest Lambda function
+data "archive_file" "ingestion_manifest_lambda" {
+  type        = "zip"
+  source_file = "${path.module}/../../../src/lambda/ingestion_manifest.py"
+  output_path = "${path.module}/../../../src/lambda/ingestion_manifest.zip"
+}
+
+# IAM role for Ingestion Manifest Lambda
+resource "aws_iam_role" "ingestion_manifest_lambda_role" {
+  name = "${var.project_name}-lambda-ingestion-manifest-role"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "lambda.amazonaws.com"
+        }
+      }
+    ]
+  })
+}
+
+# IAM policy for Ingestion Manifest Lambda
+resource "aws_iam_role_policy" "ingestion_manifest_lambda_policy" {
+  name = "${var.project_name}-lambda-ingestion-manifest-policy"
+  role = aws_iam_role.ingestion_manifest_lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "logs:CreateLogGroup",
+          "logs:CreateLogStream",
+          "logs:PutLogEvents"
+        ]
+        Resource = "arn:aws:logs:*:*:*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "ec2:CreateNetworkInterface",
+          "ec2:DescribeNetworkInterfaces",
+          "ec2:DeleteNetworkInterface",
+          "ec2:AttachNetworkInterface",
+          "ec2:DetachNetworkInterface"
+        ]
+        Resource = "*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "secretsmanager:GetSecretValue"
+        ]
+        Resource = var.db_secret_arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject"
+        ]
+        Resource = "arn:aws:s3:::${var.data_bucket}/*"
+      }
+    ]
+  })
+}
+
+# Attach VPC execution role policy for Ingestion Manifest Lambda
+resource "aws_iam_role_policy_attachment" "ingestion_manifest_lambda_vpc_execution" {
+  role       = aws_iam_role.ingestion_manifest_lambda_role.name
+  policy_arn = "arn:aws:iam::aws:policy/service-role/AWSLambdaVPCAccessExecutionRole"
+}
+
+# Ingestion Manifest Lambda function
+resource "aws_lambda_function" "ingestion_manifest" {
+  filename         = data.archive_file.ingestion_manifest_lambda.output_path
+  function_name    = "${var.project_name}-ingestion-manifest"
+  role            = aws_iam_role.ingestion_manifest_lambda_role.arn
+  handler         = "ingestion_manifest.lambda_handler"
+  runtime         = "python3.9"
+  timeout         = 60
+  memory_size     = 256
+  
+  source_code_hash = data.archive_file.ingestion_manifest_lambda.output_base64sha256
+  
+  layers = [aws_lambda_layer_version.psycopg2_layer.arn]
+  
+  vpc_config {
+    subnet_ids         = [var.vpc_subnet_id, var.private_subnet_b_id]
+    security_group_ids = [var.lambda_security_group_id]
+  }
+  
+  environment {
+    variables = {
+      SECRET_NAME = var.db_secret_name
+    }
+  }
+  
+  tags = {
+    Name = "${var.project_name}-ingestion-manifest"
+  }
+}
+
+# CloudWatch Log Group for Ingestion Manifest Lambda
+resource "aws_cloudwatch_log_group" "ingestion_manifest_logs" {
+  name              = "/aws/lambda/${aws_lambda_function.ingestion_manifest.function_name}"
+  retention_in_days = 14
+}
+
+# =============================================================================
+# LITE INGESTION LAMBDA FUNCTION
+# Spark-free ingestion for small workbooks (same staging output as the Glue job)
+# =============================================================================
+
+# Package Lite Ingestion Lambda function with the shared workbook and COPY modules
+data "archive_file" "lite_ingest_lambda" {
+  type        = "zip"
+  output_path = "${path.module}/../../../src/lambda/lite_ingest.zip"
+
+  source {
+    content  = file("${path.module}/../../../src/lambda/lite_ingest.py")
+    filename = "lite_ingest.py"
+  }
+
+  source {
+    content  = file("${path.module}/../../../src/glue/lite_engine.py")
+    filename = "lite_engine.py"
+  }
+
+  source {
+    content  = file("${path.module}/../../../src/glue/workbook.py")
+    filename = "workbook.py"
+  }
+
+  source {
+    content  = file("${path.module}/../../../src/glue/copy_loader.py")
+    filename = "copy_loader.py"
+  }
+
+  source {
+    content  = file("${path.module}/../../../src/glue/table_registry.py")
+    filename = "table_registry.py"
+  }
+}
+
+# IAM role for Lite Ingestion Lambda
+resource "aws_iam_role" "lite_ingest_lambda_role" {
+  name = "${var.project_name}-lambda-lite-ingest-role"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "lambda.amazonaws.com"
+        }
+      }
+    ]
+  })
+}
+
+# IAM policy for Lite Ingestion Lambda
+resource "aws_iam_role_policy" "lite_ingest_lambda_policy" {
+  name = "${var.project_name}-lambda-lite-ingest-policy"
+  role = aws_iam_role.lite_ingest_lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "logs:CreateLogGroup",
+          "logs:CreateLogStream",
+          "logs:PutLogEvents"
+        ]
+        Resource = "arn:aws:logs:*:*:*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "ec2:CreateNetworkInterface",
+          "ec2:DescribeNetworkInterfaces",
+          "ec2:DeleteNetworkInterface",
+          "ec2:AttachNetworkInterface",
+          "ec2:DetachNetworkInterface"
+        ]
+        Resource = "*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "secretsmanager:GetSecretValue"
+        ]
+        Resource = var.db_secret_arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject"
+        ]
+        Resource = "arn:aws:s3:::${var.data_bucket}/*"
+      }
+    ]
+  })
+}
+
+# Attach VPC execution role policy for Lite Ingestion Lambda
+resource "aws_iam_role_policy_attachment" "lite_ingest_lambda_vpc_execution" {
+  role       = aws_iam_role.lite_ingest_lambda_role.name
+  policy_arn = "arn:aws:iam::aws:policy/service-role/AWSLambdaVPCAccessExecutionRole"
+}
+
+# Lite Ingestion Lambda function
+resource "aws_lambda_function" "lite_ingest" {
+  filename         = data.archive_file.lite_ingest_lambda.output_path
+  function_name    = "${var.project_name}-lite-ingest"
+  role            = aws_iam_role.lite_ingest_lambda_role.arn
+  handler         = "lite_ingest.lambda_handler"
+  runtime         = "python3.9"
+  timeout         = 300
+  memory_size     = 1024
+  
+  source_code_hash = data.archive_file.lite_ingest_lambda.output_base64sha256
+  
+  # pandas/openpyxl come from the AWS SDK for pandas layer, psycopg2 from our layer
+  layers = [var.pandas_layer_arn, aws_lambda_layer_version.psycopg2_layer.arn]
+  
+  vpc_config {
+    subnet_ids         = [var.vpc_subnet_id, var.private_subnet_b_id]
+    security_group_ids = [var.lambda_security_group_id]
+  }
+  
+  environment {
+    variables = {
+      SECRET_NAME = var.db_secret_name
+    }
+  }
+  
+  tags = {
+    Name = "${var.project_name}-lite-ingest"
+  }
+}
+
+# CloudWatch Log Group for Lite Ingestion Lambda
+resource "aws_cloudwatch_log_group" "lite_ingest_logs" {
+  name              = "/aws/lambda/${aws_lambda_function.lite_ingest.function_name}"
+  retention_in_days = 14
+}
+
+# =============================================================================
+# INGESTION ROUTING LAMBDA FUNCTION
+# Sends small uploads to the lite engine and large ones to the Glue job
+# =============================================================================
+
+# Package Ingestion Routing Lambda function
+data "archive_file" "route_ingestion_lambda" {
+  type        = "zip"
+  source_file = "${path.module}/../../../src/lambda/route_ingestion.py"
+  output_path = "${path.module}/../../../src/lambda/route_ingestion.zip"
+}
+
+# IAM role for Ingestion Routing Lambda
+resource "aws_iam_role" "route_ingestion_lambda_role" {
+  name = "${var.project_name}-lambda-route-ingestion-role"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "lambda.amazonaws.com"
+        }
+      }
+    ]
+  })
+}
+
+# IAM policy for Ingestion Routing Lambda
+resource "aws_iam_role_policy" "route_ingestion_lambda_policy" {
+  name = "${var.project_name}-lambda-route-ingestion-policy"
+  role = aws_iam_role.route_ingestion_lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "logs:CreateLogGroup",
+          "logs:CreateLogStream",
+          "logs:PutLogEvents"
+        ]
+        Resource = "arn:aws:logs:*:*:*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject"
+        ]
+        Resource = "arn:aws:s3:::${var.data_bucket}/*"
+      }
+    ]
+  })
+}
+
+# Ingestion Routing Lambda function (no VPC access needed, it only reads S3)
+resource "aws_lambda_function" "route_ingestion" {
+  filename         = data.archive_file.route_ingestion_lambda.output_path
+  function_name    = "${var.project_name}-route-ingestion"
+  role            = aws_iam_role.route_ingestion_lambda_role.arn
+  handler         = "route_ingestion.lambda_handler"
+  runtime         = "python3.9"
+  timeout         = 30
+  memory_size     = 256
+  
+  source_code_hash = data.archive_file.route_ingestion_lambda.output_base64sha256
+  
+  environment {
+    variables = {
+      LITE_MAX_BYTES = tostring(var.lite_max_bytes)
+      LITE_MAX_ROWS  = tostring(var.lite_max_rows)
+    }
+  }
+  
+  tags = {
+    Name = "${var.project_name}-route-ingestion"
+  }
+}
+
+# CloudWatch Log Group for Ingestion Routing Lambda
+resource "aws_cloudwatch_log_group" "route_ingestion_logs" {
+  name              = "/aws/lambda/${aws_lambda_function.route_ingestion.function_name}"
+  retention_in_days = 14
+}
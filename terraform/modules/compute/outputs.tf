@@ -26,4 +26,18 @@ output "upsert_lambda_arn" {
 output "upsert_lambda_name" {
   description = "Name of the upsert Lambda function"
   value       = aws_lambda_function.upsert_data.function_name
-}
\ No newline at end of file
+}
+output "ingestion_manifest_lambda_arn" {
+  description = "ARN of the ingestion manifest Lambda function"
+  value       = aws_lambda_function.ingestion_manifest.arn
+}
+
+output "lite_ingest_lambda_arn" {
+  description = "ARN of the lite ingestion Lambda function"
+  value       = aws_lambda_function.lite_ingest.arn
+}
+
+output "route_ingestion_lambda_arn" {
+  description = "ARN of the ingestion routing Lambda function"
+  value       = aws_lambda_function.route_ingestion.arn
+}
@@ -50,6 +50,54 @@ variable "glue_worker_type" {
   default     = "G.1X"
 }
 
+variable "glue_reader_mode" {
+  type        = string
+  description = "Excel reader mode for the Glue job (full, streaming)"
+  default     = "full"
+}
+
+variable "glue_chunk_rows" {
+  type        = number
+  description = "Rows per chunk when the Glue job streams the workbook"
+  default     = 10000
+}
+
+variable "glue_ingestion_mode" {
+  type        = string
+  description = "pandas-to-Spark handoff for the Glue job (typed, string)"
+  default     = "typed"
+}
+
+variable "glue_materialize_mode" {
+  type        = string
+  description = "How the Glue job materializes the parsed workbook before the table fan-out (cache, checkpoint, none)"
+  default     = "cache"
+}
+
+variable "glue_write_mode" {
+  type        = string
+  description = "How the Glue job writes the staging tables (sequential, parallel)"
+  default     = "sequential"
+}
+
+variable "glue_write_parallelism" {
+  type        = number
+  description = "Maximum concurrent staging writes when glue_write_mode is parallel"
+  default     = 4
+}
+
+variable "glue_staging_loader" {
+  type        = string
+  description = "How the Glue job loads the staging tables (jdbc, copy)"
+  default     = "jdbc"
+}
+
+variable "glue_copy_format" {
+  type        = string
+  description = "COPY format used by the copy staging loader (csv, binary)"
+  default     = "csv"
+}
+
 variable "db_host" {
   type        = string
   description = "Database host"
@@ -108,3 +156,75 @@ variable "lambda_security_group_id" {
   type        = string
   description = "Security group ID for Lambda"
 }
+
+variable "pandas_layer_arn" {
+  type        = string
+  description = "AWS SDK for pandas Lambda layer (pandas, openpyxl) for the python3.9 runtime, see https://aws-sdk-pandas.readthedocs.io/en/stable/layers.html"
+  default     = "arn:aws:lambda:eu-central-1:336392948345:layer:AWSSDKPandas-Python39:24"
+}
+
+variable "lite_max_bytes" {
+  type        = number
+  description = "Largest upload (in bytes) routed to the lite ingestion engine instead of Glue"
+  default     = 5242880
+}
+
+variable "lite_max_rows" {
+  type        = number
+  description = "Largest estimated row count routed to the lite ingestion engine instead of Glue"
+  default     = 5000
+}
+
+variable "upsert_secret_cache_ttl_seconds" {
+  type        = number
+  description = "How long warm upsert Lambda invocations reuse the cached database secret before re-reading it"
+  default     = 300
+}
+
+variable "upsert_diagnostics" {
+  type        = string
+  description = "Upsert Lambda diagnostics level (off, cheap, full)"
+  default     = "cheap"
+}
+
+variable "upsert_mode" {
+  type        = string
+  description = "How the upsert Lambda runs the table upserts (transactional, parallel, chunked)"
+  default     = "transactional"
+}
+
+variable "upsert_batch_rows" {
+  type        = number
+  description = "Staged dates per committed batch in the chunked upsert mode"
+  default     = 10000
+}
+
+variable "upsert_reference_checks" {
+  type        = string
+  description = "Child table foreign key checks in the upsert Lambda (row, or bulk: validated once after the load, for backfills)"
+  default     = "row"
+}
+
+variable "upsert_maintenance" {
+  type        = string
+  description = "ANALYZE / VACUUM of the tables a load changed substantially, right after the upsert (auto, off)"
+  default     = "auto"
+}
+
+variable "staging_run_retention_hours" {
+  type        = number
+  description = "Hours after which the upsert Lambda drops staging partitions of runs that never finished"
+  default     = 24
+}
+
+variable "upsert_engine" {
+  type        = string
+  description = "Statement the generated upsert functions are built on (on_conflict, merge - needs Postgres 17)"
+  default     = "on_conflict"
+}
+
+variable "main_table_partitioning" {
+  type        = string
+  description = "Range partitioning of the main tables by date (none, year, month); deploying a change converts existing tables"
+  default     = "none"
+}
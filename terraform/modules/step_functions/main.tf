@@ -39,7 +39,12 @@ resource "aws_iam_role_policy" "step_function_policy" {
         Action = [
           "lambda:InvokeFunction"
         ]
-        Resource = var.upsert_lambda_arn
+        Resource = [
+          var.upsert_lambda_arn,
+          var.ingestion_manifest_lambda_arn,
+          var.route_ingestion_lambda_arn,
+          var.lite_ingest_lambda_arn
+        ]
       },
       {
         Effect = "Allow"
@@ -77,9 +82,140 @@ resource "aws_sfn_state_machine" "data_processing_workflow" {
   }
 
   definition = jsonencode({
-    Comment = "Data processing workflow that triggers Glue job"
-    StartAt = "StartGlueJob"
+    # Start an execution with {"s3_input_path": ..., "force": true} to re-ingest content the
+    # manifest already lists as succeeded, e.g. to restore the values of an earlier file
+    Comment = "Data processing workflow that triggers Glue job; set force=true in the input to re-ingest a duplicate upload"
+    StartAt = "HasForceFlag"
     States = {
+      HasForceFlag = {
+        Type = "Choice"
+        Choices = [
+          {
+            Variable  = "$.force"
+            IsPresent = true
+            Next      = "CheckManifest"
+          }
+        ]
+        Default = "DefaultForceFlag"
+      }
+      DefaultForceFlag = {
+        Type       = "Pass"
+        Result     = false
+        ResultPath = "$.force"
+        Next       = "CheckManifest"
+      }
+      CheckManifest = {
+        Type     = "Task"
+        Resource = "arn:aws:states:::lambda:invoke"
+        Parameters = {
+          FunctionName = var.ingestion_manifest_lambda_arn
+          Payload = {
+            "action"            = "check"
+            "s3_input_path.$"   = "$.s3_input_path"
+            "execution_id.$"    = "$$.Execution.Name"
+            "force.$"           = "$.force"
+          }
+        }
+        ResultSelector = {
+          "duplicate.$"    = "$.Payload.duplicate"
+          "content_hash.$" = "$.Payload.content_hash"
+        }
+        ResultPath = "$.manifest"
+        Next       = "IsDuplicateUpload"
+        Catch = [
+          {
+            # Fail open: without a manifest answer the file is processed as usual
+            ErrorEquals = ["States.ALL"]
+            Next        = "DefaultManifest"
+            ResultPath  = "$.manifest_error"
+          }
+        ]
+      }
+      DefaultManifest = {
+        Type    = "Pass"
+        Comment = "RecordSuccess and RecordFailure read $.manifest; without a claimed hash they update nothing"
+        Result = {
+          duplicate    = false
+          content_hash = null
+        }
+        ResultPath = "$.manifest"
+        Next       = "RouteIngestion"
+      }
+      IsDuplicateUpload = {
+        Type = "Choice"
+        Choices = [
+          {
+            Variable      = "$.manifest.duplicate"
+            BooleanEquals = true
+            Next          = "SkipDuplicate"
+          }
+        ]
+        Default = "RouteIngestion"
+      }
+      SkipDuplicate = {
+        Type    = "Succeed"
+        Comment = "Identical content was already ingested"
+      }
+      RouteIngestion = {
+        Type     = "Task"
+        Resource = "arn:aws:states:::lambda:invoke"
+        Parameters = {
+          FunctionName = var.route_ingestion_lambda_arn
+          Payload = {
+            "s3_input_path.$" = "$.s3_input_path"
+          }
+        }
+        ResultSelector = {
+          "engine.$" = "$.Payload.engine"
+          "reason.$" = "$.Payload.reason"
+        }
+        ResultPath = "$.route"
+        Next       = "ChooseEngine"
+        Catch = [
+          {
+            # Glue handles any size, so it is the safe default
+            ErrorEquals = ["States.ALL"]
+            Next        = "StartGlueJob"
+            ResultPath  = "$.route_error"
+          }
+        ]
+      }
+      ChooseEngine = {
+        Type = "Choice"
+        Choices = [
+          {
+            Variable     = "$.route.engine"
+            StringEquals = "lite"
+            Next         = "LiteIngest"
+          }
+        ]
+        Default = "StartGlueJob"
+      }
+      LiteIngest = {
+        Type     = "Task"
+        Resource = "arn:aws:states:::lambda:invoke"
+        Parameters = {
+          FunctionName = var.lite_ingest_lambda_arn
+          Payload = {
+            "s3_input_path.$" = "$.s3_input_path"
+            # Each execution stages into its own staging partitions
+            "ingestion_id.$"  = "$$.Execution.Name"
+          }
+        }
+        ResultSelector = {
+          "metrics.$" = "$.Payload.body.metrics"
+        }
+        ResultPath = "$.lite_result"
+        Next       = "UpsertData"
+        Catch = [
+          {
+            # The lite load is a single transaction, so nothing is staged on failure
+            ErrorEquals = ["States.ALL"]
+            Next        = "StartGlueJob"
+            ResultPath  = "$.lite_error"
+          }
+        ]
+      }
       StartGlueJob = {
         Type     = "Task"
         Resource = "arn:aws:states:::glue:startJobRun.sync"
@@ -87,13 +223,15 @@ resource "aws_sfn_state_machine" "data_processing_workflow" {
           JobName = var.glue_job_name
           Arguments = {
             "--s3_input_path.$" = "$.s3_input_path"
+            "--ingestion_id.$"  = "$$.Execution.Name"
           }
         }
+        ResultPath = "$.glue_result"
         Next = "UpsertData"
         Catch = [
           {
             ErrorEquals = ["States.TaskFailed", "States.Timeout"]
-            Next        = "JobFailed"
+            Next        = "RecordFailure"
             ResultPath  = "$.error"
           }
         ]
@@ -112,14 +250,19 @@ resource "aws_sfn_state_machine" "data_processing_workflow" {
         Parameters = {
           FunctionName = var.upsert_lambda_arn
           Payload = {
-            "source" = "step-function"
+            "source"         = "step-function"
+            "ingestion_id.$" = "$$.Execution.Name"
           }
         }
-        Next = "JobSucceeded"
+        ResultSelector = {
+          "body.$" = "$.Payload.body"
+        }
+        ResultPath = "$.upsert_result"
+        Next = "RecordSuccess"
         Catch = [
           {
             ErrorEquals = ["States.TaskFailed", "States.Timeout"]
-            Next        = "JobFailed"
+            Next        = "RecordFailure"
             ResultPath  = "$.upsert_error"
           }
         ]
@@ -132,6 +275,50 @@ resource "aws_sfn_state_machine" "data_processing_workflow" {
           }
         ]
       }
+      RecordSuccess = {
+        Type     = "Task"
+        Resource = "arn:aws:states:::lambda:invoke"
+        Parameters = {
+          FunctionName = var.ingestion_manifest_lambda_arn
+          Payload = {
+            "action"         = "record"
+            "status"         = "succeeded"
+            "content_hash.$" = "$.manifest.content_hash"
+            "row_counts.$"   = "$.upsert_result.body"
+          }
+        }
+        ResultPath = null
+        Next       = "JobSucceeded"
+        Catch = [
+          {
+            # The data is loaded; a missing manifest entry only means a later duplicate is reprocessed
+            ErrorEquals = ["States.ALL"]
+            Next        = "JobSucceeded"
+            ResultPath  = "$.manifest_error"
+          }
+        ]
+      }
+      RecordFailure = {
+        Type     = "Task"
+        Resource = "arn:aws:states:::lambda:invoke"
+        Parameters = {
+          FunctionName = var.ingestion_manifest_lambda_arn
+          Payload = {
+            "action"         = "record"
+            "status"         = "failed"
+            "content_hash.$" = "$.manifest.content_hash"
+          }
+        }
+        ResultPath = null
+        Next       = "JobFailed"
+        Catch = [
+          {
+            ErrorEquals = ["States.ALL"]
+            Next        = "JobFailed"
+            ResultPath  = "$.manifest_error"
+          }
+        ]
+      }
       JobSucceeded = {
         Type = "Succeed"
       }
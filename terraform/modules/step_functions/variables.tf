@@ -17,3 +17,18 @@ variable "upsert_lambda_arn" {
   description = "ARN of the upsert Lambda function"
   type        = string
 }
+
+variable "ingestion_manifest_lambda_arn" {
+  description = "ARN of the ingestion manifest Lambda function"
+  type        = string
+}
+
+variable "route_ingestion_lambda_arn" {
+  description = "ARN of the ingestion routing Lambda function"
+  type        = string
+}
+
+variable "lite_ingest_lambda_arn" {
+  description = "ARN of the lite ingestion Lambda function"
+  type        = string
+}
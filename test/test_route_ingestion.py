@@ -0,0 +1,109 @@
+"""
+Tests of the ingestion router's engine choice and its xlsx row estimate
+"""
+import io
+import os
+import re
+import sys
+import zipfile
+
+import pytest
+from openpyxl import Workbook
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "lambda"))
+from route_ingestion import (  # noqa: E402
+    DEFAULT_LITE_MAX_BYTES, DEFAULT_LITE_MAX_ROWS, ENGINE_GLUE, ENGINE_LITE, choose_engine, estimate_xlsx_rows
+)
+
+SHEET_PATH = "xl/worksheets/sheet1.xml"
+
+
+def workbook_bytes(rows, columns=3):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append([f"Header {column}" for column in range(columns)])
+    for row in range(rows):
+        sheet.append([row] * columns)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def with_sheet_xml(xlsx_bytes, rewrite):
+    """
+    The workbook with its first worksheet's XML passed through rewrite
+    """
+    source = zipfile.ZipFile(io.BytesIO(xlsx_bytes))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as target:
+        for item in source.infolist():
+            content = source.read(item.filename)
+            target.writestr(item, rewrite(content) if item.filename == SHEET_PATH else content)
+    return buffer.getvalue()
+
+
+def test_size_at_the_limit_stays_lite():
+    assert choose_engine(DEFAULT_LITE_MAX_BYTES, 10)[0] == ENGINE_LITE
+
+
+def test_size_one_byte_over_the_limit_goes_to_glue():
+    assert choose_engine(DEFAULT_LITE_MAX_BYTES + 1, 10)[0] == ENGINE_GLUE
+
+
+def test_size_over_the_limit_wins_over_an_unknown_row_count():
+    assert choose_engine(DEFAULT_LITE_MAX_BYTES + 1, None)[0] == ENGINE_GLUE
+
+
+def test_rows_at_the_limit_stay_lite():
+    assert choose_engine(1024, DEFAULT_LITE_MAX_ROWS)[0] == ENGINE_LITE
+
+
+def test_rows_one_over_the_limit_go_to_glue():
+    engine, reason = choose_engine(1024, DEFAULT_LITE_MAX_ROWS + 1)
+    assert engine == ENGINE_GLUE
+    assert str(DEFAULT_LITE_MAX_ROWS) in reason
+
+
+def test_unknown_row_count_is_decided_by_size():
+    engine, reason = choose_engine(1024, None)
+    assert engine == ENGINE_LITE
+    assert "unknown" in reason
+
+
+def test_custom_limits():
+    assert choose_engine(100, 10, max_lite_bytes=99, max_lite_rows=10)[0] == ENGINE_GLUE
+    assert choose_engine(99, 11, max_lite_bytes=99, max_lite_rows=10)[0] == ENGINE_GLUE
+    assert choose_engine(99, 10, max_lite_bytes=99, max_lite_rows=10)[0] == ENGINE_LITE
+
+
+@pytest.mark.parametrize("rows", [0, 1, 250])
+def test_estimate_of_an_openpyxl_workbook(rows):
+    # The header row counts too
+    assert estimate_xlsx_rows(workbook_bytes(rows)) == rows + 1
+
+
+def test_estimate_of_a_single_cell_dimension():
+    xlsx = with_sheet_xml(workbook_bytes(5), lambda xml: re.sub(rb'<dimension ref="[^"]*"', b'<dimension ref="A1"', xml))
+    assert estimate_xlsx_rows(xlsx) == 1
+
+
+def test_estimate_without_a_dimension_element():
+    xlsx = with_sheet_xml(workbook_bytes(5), lambda xml: re.sub(rb"<dimension [^>]*/>", b"", xml))
+    assert estimate_xlsx_rows(xlsx) is None
+
+
+def test_estimate_with_a_malformed_dimension():
+    xlsx = with_sheet_xml(workbook_bytes(5), lambda xml: re.sub(rb'<dimension ref="[^"]*"', b'<dimension ref="rows"', xml))
+    assert estimate_xlsx_rows(xlsx) is None
+
+
+def test_estimate_of_a_file_that_is_not_a_workbook():
+    assert estimate_xlsx_rows(b"Datum;Tonage\n2024-01-01;12\n") is None
+
+
+def test_estimate_of_an_archive_without_a_workbook():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("readme.txt", "not a workbook")
+    assert estimate_xlsx_rows(buffer.getvalue()) is None